@@ -4,28 +4,41 @@
 # Description  : Import devices from devices.csv into DHCP, DNS and LINBO/GRUB config
 # Signed-off by: thomas@linuxmuster.net
 # Assisted by  : Claude
-# Date         : 20260818
+# Date         : 20261017
 #
 
 import configparser
+import contextlib
+import cProfile
 import csv
 import datetime
 import fnmatch
 import getopt
+import hashlib
+import io
+import json
 import os
+import re
 import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 sys.path.insert(0, '/usr/lib/linuxmuster')
 import environment
 
+from concurrent.futures import ThreadPoolExecutor
 from os import listdir
 from os.path import isfile, join
 from pathlib import Path
 
-from linuxmuster_base7.functions import getDevicesArray, getGrubOstype, getGrubPart, getStartconfOsValues, \
-    getStartconfOption, getStartconfPartnr, getStartconfPartlabel, getSubnetArray, \
-    getLinboVersion, printScript, readTextfile, writeTextfile
+from linuxmuster_base7.functions import getDeviceIndex, getDevicesCsvPath, getFieldProjection, getGrubOstype, \
+    getGrubPart, getGrubTemplate, getStartconfOsValues, getStartconfOption, getStartconfPartnr, \
+    getStartconfPartlabel, getLinboVersion, OmapiClient, OmapiError, printScript, readTextfile, \
+    writeTextfileAtomic, buildDhcpHostDeclaration, getDhcpBackend, checkDevicesCsv, \
+    mapWithOrderedOutput
 
 # Setup logging
 logfile = environment.LOGDIR + '/import-devices.log'
@@ -36,8 +49,27 @@ logfile = environment.LOGDIR + '/import-devices.log'
 DEVICE_FIELDS_DHCP = '1,2,3,4,7,8,10'  # Fields needed for DHCP config
 DEVICE_FIELDS_LINKS = '1,2,3,4,10'      # Fields needed for LINBO symlinks
 
-# Minimum length for valid DHCP options string (e.g., "opt=val")
-MIN_DHCP_OPTS_LENGTH = 5
+# Directory holding the last applied device snapshot per school,
+# used to import only what changed since the previous run
+SNAPSHOTDIR = os.path.dirname(environment.SETUPINI) + '/import-devices'
+
+# Hash of the DHCP configuration the service was last restarted with
+DHCPSTATEFILE = SNAPSHOTDIR + '/dhcp.json'
+
+# OMAPI access to the running dhcpd, see getOmapiConfig()
+OMAPICONF = environment.SYSDIR + '/omapi.conf'
+
+# Seconds a post-import hook may run before it is killed (0: no limit)
+HOOK_TIMEOUT = 300
+
+# State of the last successful sophomorix-device sync
+SYNCSTATEFILE = SNAPSHOTDIR + '/sophomorix-sync.json'
+
+# One JSON run report per line, see RunReport
+RUNREPORTFILE = environment.LOGDIR + '/import-devices.runs.jsonl'
+
+# Grub templates whose change requires regenerating every group's grub.cfg
+GRUB_TEMPLATES = ['grub.cfg.global', 'grub.cfg.os', 'grub.cfg.os-iso']
 
 
 def logToFile(message):
@@ -54,6 +86,19 @@ def usage():
     print('Usage: linuxmuster-import-devices [options]')
     print(' [options] may be:')
     print(' -s <schoolname>,   --school=<schoolname>   : Select a school other than default-school.')
+    print(' -a,                --all-schools           : Process all schools, restarting dhcp only once.')
+    print(' -j <number>,       --jobs=<number>         : Process up to <number> device groups in parallel.')
+    print('                    --full                  : Ignore the last import snapshot, rebuild everything.')
+    print('                    --force-sync            : Run sophomorix-device even if no devices.csv changed.')
+    print('                    --pipeline              : Generate configs while sophomorix-device syncs.')
+    print('                    --hook-jobs=<number>    : Run up to <number> post hooks of a stage in parallel.')
+    print('                    --hook-timeout=<secs>   : Kill post hooks running longer (default: 300, 0: no limit).')
+    print('                    --check                 : Only check the devices.csv of all schools, change nothing.')
+    print('                    --summary               : Print device counts per subnet and group instead of every device.')
+    print('                    --quiet                 : Print only a one line result, the full output only on errors.')
+    print('                    --json                  : Print the result as JSON document only (for the webui).')
+    print('                    --profile               : Print the duration of every phase at the end.')
+    print('                    --profile-stats=<file>  : Like --profile, also dump cProfile stats to <file>.')
 
 
 # Module-level execution code has been moved to main() function below
@@ -61,30 +106,29 @@ def usage():
 
 # functions begin
 
-# delete symlinks
-def delSymlinksByPattern(directory, pattern):
-    """Delete all symlinks matching a pattern in a directory tree.
+# list symlinks
+def scanSymlinks(directory, pattern):
+    """Return the symlinks matching a pattern directly inside a directory.
+
+    Only the directory itself is scanned (no recursion), so large trees
+    like the LINBO image directories are never walked.
 
     Args:
-        directory: Root directory to search for symlinks
+        directory: Directory to scan
         pattern: Glob pattern to match against symlink names (e.g., "*.cfg")
+
+    Returns:
+        Dict mapping symlink path to its link source
     """
-    # check if dir exists
-    if not os.path.exists(directory):
-        #print(f"Directory '{directory}' does not exist.")  # debug
-        return
-    # iterate through dir
-    for root, dirs, files in os.walk(directory):
-        for name in files + dirs:
-            path = os.path.join(root, name)
-            # test for symlink
-            if os.path.islink(path) and fnmatch.fnmatch(name, pattern):
-                try:
-                    os.unlink(path)  # delete symlink
-                    #print(f"Symlink deleted: {path}")  # debug
-                except Exception as error:
-                    continue
-                    #print(f"Deletion of {path} failed: {err}")  # debug
+    links = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_symlink() and fnmatch.fnmatch(entry.name, pattern):
+                    links[entry.path] = os.readlink(entry.path)
+    except FileNotFoundError:
+        pass
+    return links
 
 
 # Helper functions for grub configuration
@@ -108,41 +152,30 @@ def getCachePartitionInfo(startconf):
     return (cacheroot, cachelabel, partnr)
 
 
-def createGrubGlobalSection(grubcfg, group, cacheroot, cachelabel, kopts):
-    """Create global section of grub config from template.
+def buildGrubGlobalSection(group, cacheroot, cachelabel, kopts):
+    """Render the global section of a group's grub config from its template.
 
     Args:
-        grubcfg: Path to grub config file
         group: Device group name
         cacheroot: Grub partition name for cache
         cachelabel: Partition label for cache
         kopts: Kernel options
 
     Returns:
-        True if successful, False otherwise
+        Rendered section, None if the template cannot be read
     """
-    # Load global grub template (contains menu structure and basic settings)
-    global_tpl = environment.LINBOTPLDIR + '/grub.cfg.global'
-    rc, content = readTextfile(global_tpl)
-    if not rc:
-        return False
-
-    # Replace template variables with actual values
-    replace_list = [('@@group@@', group), ('@@cachelabel@@', cachelabel),
-                    ('@@cacheroot@@', cacheroot), ('@@kopts@@', kopts)]
-    for item in replace_list:
-        content = content.replace(item[0], item[1])
-
-    # Write global section (mode 'w' overwrites any existing file)
-    rc = writeTextfile(grubcfg, content, 'w')
-    return rc
+    # Global grub template (contains menu structure and basic settings)
+    template = getGrubTemplate('grub.cfg.global')
+    if template is None:
+        return None
+    return template.render({'group': group, 'cachelabel': cachelabel,
+                            'cacheroot': cacheroot, 'kopts': kopts})
 
 
-def createGrubOsSection(grubcfg, startconf, group, cacheroot, cachelabel, kopts):
-    """Create OS-specific sections of grub config from templates.
+def buildGrubOsSections(startconf, group, cacheroot, cachelabel, kopts):
+    """Render the OS-specific sections of a group's grub config from templates.
 
     Args:
-        grubcfg: Path to grub config file
         startconf: Path to start.conf file
         group: Device group name
         cacheroot: Grub partition name for cache
@@ -150,15 +183,15 @@ def createGrubOsSection(grubcfg, startconf, group, cacheroot, cachelabel, kopts)
         kopts: Kernel options
 
     Returns:
-        True if successful, False otherwise
+        Rendered sections, None on error
     """
     # Get list of all OS definitions from start.conf
     oslists = getStartconfOsValues(startconf)
     if oslists is None:
-        return False
+        return None
 
     # Process each OS (Windows, Linux, etc.) and create boot menu entries
-    ostpl_pre = environment.LINBOTPLDIR + '/grub.cfg.os'
+    sections = []
     for oslist in oslists:
         # Unpack OS configuration: name, image file, partition, kernel, initrd, kernel params, OS number
         osname, baseimage, partition, kernel, initrd, kappend, osnr = oslist
@@ -170,9 +203,11 @@ def createGrubOsSection(grubcfg, startconf, group, cacheroot, cachelabel, kopts)
         # Select template: different template for ISO-based live systems vs. installed OS
         imagename, ext = os.path.splitext(baseimage)
         if ext == '.iso':
-            ostpl = ostpl_pre + '-iso'  # Use ISO boot template
+            template = getGrubTemplate('grub.cfg.os-iso')  # Use ISO boot template
         else:
-            ostpl = ostpl_pre  # Use standard OS template
+            template = getGrubTemplate('grub.cfg.os')  # Use standard OS template
+        if template is None:
+            return None
 
         # Add root parameter to kernel command line if not already present
         # (not needed for ISO boots which have their own root mechanism)
@@ -182,28 +217,15 @@ def createGrubOsSection(grubcfg, startconf, group, cacheroot, cachelabel, kopts)
             except Exception as error:
                 kappend = kappend + ' root=' + partition  # Fallback to device path
 
-        # Load OS-specific template
-        rc, content = readTextfile(ostpl)
-        if not rc:
-            return False
-
-        # Replace all template placeholders with actual OS configuration
-        replace_list = [('@@group@@', group), ('@@cachelabel@@', cachelabel),
-                        ('@@baseimage@@', baseimage), ('@@cacheroot@@', cacheroot),
-                        ('@@osname@@', osname), ('@@osnr@@', osnr),
-                        ('@@ostype@@', ostype), ('@@oslabel@@', oslabel),
-                        ('@@osroot@@', osroot), ('@@partnr@@', partnr),
-                        ('@@kernel@@', kernel), ('@@initrd@@', initrd),
-                        ('@@kopts@@', kopts), ('@@append@@', kappend)]
-        for item in replace_list:
-            content = content.replace(item[0], str(item[1]))
-
-        # Append OS section to grub config (mode 'a' appends to existing file)
-        rc = writeTextfile(grubcfg, content, 'a')
-        if not rc:
-            return False
+        # Fill in all template placeholders with the actual OS configuration
+        sections.append(template.render({
+            'group': group, 'cachelabel': cachelabel, 'baseimage': baseimage,
+            'cacheroot': cacheroot, 'osname': osname, 'osnr': osnr,
+            'ostype': ostype, 'oslabel': oslabel, 'osroot': osroot,
+            'partnr': partnr, 'kernel': kernel, 'initrd': initrd,
+            'kopts': kopts, 'append': kappend}))
 
-    return True
+    return ''.join(sections)
 
 
 def doGrubCfg(startconf, group, kopts):
@@ -229,8 +251,9 @@ def doGrubCfg(startconf, group, kopts):
 
     # If cache is not defined provide a forced netboot cfg
     if cacheroot is None:
-        netboottpl = environment.LINBOTPLDIR + '/grub.cfg.forced_netboot'
-        shutil.copy2(netboottpl, grubcfg)
+        template = getGrubTemplate('grub.cfg.forced_netboot')
+        if template is None or not writeTextfileAtomic(outputPath(grubcfg), template.content):
+            return 'error!'
         return 'not yet configured!'
 
     # Determine status message
@@ -239,12 +262,16 @@ def doGrubCfg(startconf, group, kopts):
     else:
         msg = 'created'
 
-    # Create global section of grub config
-    if not createGrubGlobalSection(grubcfg, group, cacheroot, cachelabel, kopts):
+    # Render global and OS-specific sections in memory
+    global_section = buildGrubGlobalSection(group, cacheroot, cachelabel, kopts)
+    if global_section is None:
+        return 'error!'
+    os_sections = buildGrubOsSections(startconf, group, cacheroot, cachelabel, kopts)
+    if os_sections is None:
         return 'error!'
 
-    # Create OS-specific sections
-    if not createGrubOsSection(grubcfg, startconf, group, cacheroot, cachelabel, kopts):
+    # Write the complete config at once, so a half written file never boots
+    if not writeTextfileAtomic(outputPath(grubcfg), global_section + os_sections):
         return 'error!'
 
     return msg
@@ -269,6 +296,8 @@ def doLinboStartconf(group):
             msg1 = 'present'
     else:
         msg1 = 'not yet configured!'
+        # read from where the copy was written to, it may still be staged
+        startconf = outputPath(startconf)
         shutil.copy2(environment.LINBODIR + '/start.conf', startconf)
     # read kernel options from start.conf
     kopts = getStartconfOption(startconf, 'LINBO', 'KernelOptions')
@@ -279,82 +308,282 @@ def doLinboStartconf(group):
     printScript("  {: <15} | {: <20} | {: <20}".format(*row))
 
 
-# Helper functions for DHCP configuration
-# These functions reduce nesting and improve readability of DHCP config generation
-
-def buildDhcpHostDeclaration(hostname, group, mac, ip, dhcpopts, pxeflag):
-    """Build DHCP host declaration for a single device.
+def processLinboGroup(group):
+    """Run doLinboStartconf() for a group, reporting errors instead of raising.
 
     Args:
-        hostname: Device hostname
         group: Device group name
-        mac: MAC address
-        ip: IP address or 'DHCP'
-        dhcpopts: DHCP options string (comma-separated)
-        pxeflag: PXE boot flag (0=no PXE, 1/2/3=different PXE modes)
 
     Returns:
-        String containing complete DHCP host declaration
+        True on success, False if the group failed
+    """
+    start = time.monotonic()
+    try:
+        doLinboStartconf(group)
+        return True
+    except Exception as error:
+        printScript("  {: <15} | {: <20} | {: <20}".format(group, 'error!', 'error!'))
+        logToFile(f'Processing group {group} failed: {error}')
+        return False
+    finally:
+        _report.addGroup(group, time.monotonic() - start)
+
+
+# files written while sophomorix-device syncs in the background
+class StagingArea(object):
+    """Collects generated files until they are activated or discarded.
+
+    Every file is written next to its target under a hidden '.<name>.staged'
+    name, so activate() can move it in place with an atomic rename on the
+    same filesystem and discard() simply removes it. A replaced target
+    keeps its permissions.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def path(self, target):
+        staged = os.path.join(os.path.dirname(target), '.' + os.path.basename(target) + '.staged')
+        with self.lock:
+            self.files[target] = staged
+        return staged
+
+    def staged(self, target):
+        """Return the staged file of target, None if target is not staged."""
+        return self.files.get(target)
+
+    def activate(self):
+        """Move all staged files to their targets, returns their number."""
+        count = 0
+        for target, staged in self.files.items():
+            if os.path.lexists(staged):
+                if os.path.isfile(target) and not os.path.islink(staged):
+                    shutil.copymode(target, staged)
+                os.replace(staged, target)
+                count += 1
+        self.files = {}
+        return count
+
+    def discard(self):
+        for staged in self.files.values():
+            if os.path.lexists(staged):
+                os.unlink(staged)
+        self.files = {}
+
+
+# timings and counts of an import run
+class RunReport(object):
+    """Collects phase durations and counts of an import run.
+
+    Phases are timed with the phase() context manager; a phase entered
+    several times, e.g. once per school, accumulates its durations. save()
+    appends the report as one JSON document per line to RUNREPORTFILE.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = datetime.datetime.now()
+        self.start = time.monotonic()
+        self.phases = {}
+        self.groups = {}
+        self.hooks = []
+        self.counts = {}
+        self.info = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # list phases in the order they were entered
+        with self.lock:
+            self.phases.setdefault(name, 0)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.addPhase(name, time.monotonic() - start)
+
+    def addPhase(self, name, duration):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0) + duration
+
+    def addGroup(self, group, duration):
+        with self.lock:
+            self.groups[group] = self.groups.get(group, 0) + duration
+
+    def addHook(self, hook, school, returncode, duration):
+        with self.lock:
+            self.hooks.append({'hook': hook, 'school': school, 'returncode': returncode,
+                               'duration': round(duration, 3)})
+
+    def count(self, name, number=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + number
+
+    def asDict(self):
+        return {'started': self.started.isoformat(timespec='seconds'),
+                'duration': round(time.monotonic() - self.start, 3),
+                **self.info,
+                'phases': {name: round(value, 3) for name, value in self.phases.items()},
+                'counts': self.counts,
+                'groups': {name: round(value, 3) for name, value in self.groups.items()},
+                'hooks': self.hooks}
+
+    def save(self, path=None):
+        try:
+            with open(path or RUNREPORTFILE, 'a') as outfile:
+                outfile.write(json.dumps(self.asDict(), sort_keys=False) + '\n')
+        except OSError as error:
+            logToFile(f'Cannot write run report: {error}')
+
+    def printSummary(self, top=5):
+        """Print the phase durations, counts and the slowest groups and hooks."""
+        report = self.asDict()
+        printScript('', 'begin')
+        printScript('Profile:')
+        printScript("  {: <30} | {: >10}".format('phase', 'seconds'))
+        printScript("  {: <30}+{: >10}".format('-'*31, '-'*11))
+        for name, value in report['phases'].items():
+            printScript("  {: <30} | {: >10.3f}".format(name, value))
+        printScript("  {: <30} | {: >10.3f}".format('total', report['duration']))
+        if report['counts']:
+            printScript('* ' + ', '.join(f'{value} {name}' for name, value in report['counts'].items()))
+        slowest = sorted(report['groups'].items(), key=lambda item: item[1], reverse=True)[:top]
+        if slowest:
+            printScript('* slowest groups: ' + ', '.join(f'{name} {value:.3f}s' for name, value in slowest))
+        slowest = sorted(report['hooks'], key=lambda hook: hook['duration'], reverse=True)[:top]
+        if slowest:
+            printScript('* slowest hooks: ' + ', '.join(
+                f"{hook['hook']} ({hook['school']}) {hook['duration']:.3f}s" for hook in slowest))
+
+
+# report of the running import, replaced by main()
+_report = RunReport()
+
+# console output mode: verbose (every device), summary, quiet or json;
+# all but verbose print counts instead of a line per device
+_output_mode = 'verbose'
+
+
+# buffer the console output of a run
+class OutputCapture(object):
+    """Collects everything printed between start() and stop().
+
+    With redirect_fd the output of child processes, which write to file
+    descriptor 1 directly, goes to stderr meanwhile, so stdout carries
+    only what is printed after stop().
     """
-    # Start with basic host declaration template
-    host_decl_tpl = """host @@hostname@@ {
-  option host-name "@@hostname@@";
-  hardware ethernet @@mac@@;
-"""
-    host_decl = host_decl_tpl.replace('@@mac@@', mac).replace('@@hostname@@', hostname)
 
-    # Add fixed IP address if not using DHCP
-    if ip != 'DHCP':
-        host_decl = host_decl + '  fixed-address ' + ip + ';\n'
+    def __init__(self, redirect_fd=False):
+        self.redirect_fd = redirect_fd
+        self.buffer = io.StringIO()
+        self.stream = None
+        self.saved_fd = None
 
-    # Add PXE-specific options for network boot clients
-    if int(pxeflag) != 0:
-        # extensions-path and nis-domain tell client which LINBO group config to use
-        host_decl = host_decl + '  option extensions-path "' + group + '";\n  option nis-domain "' + group + '";\n'
-        # Add custom DHCP options if provided (minimum length for validation)
-        if len(dhcpopts) >= MIN_DHCP_OPTS_LENGTH:
-            for opt in dhcpopts.split(','):
-                host_decl = host_decl + '  ' + opt + ';\n'
+    def start(self):
+        self.stream = sys.stdout
+        self.stream.flush()
+        if self.redirect_fd:
+            self.saved_fd = os.dup(1)
+            os.dup2(2, 1)
+        sys.stdout = self.buffer
 
-    # Close host declaration block
-    host_decl = host_decl + '}\n'
-    return host_decl
+    def stop(self):
+        """Restore stdout and return the collected output."""
+        sys.stdout = self.stream
+        if self.saved_fd is not None:
+            os.dup2(self.saved_fd, 1)
+            os.close(self.saved_fd)
+            self.saved_fd = None
+        return self.buffer.getvalue()
 
 
-def writeSubnetHeader(outfile, subnet):
-    """Write subnet header comment to DHCP config file.
+# active StagingArea, None if files are written in place
+_staging = None
+
+
+# DHCP files, staged until the config test accepted them (see activateDhcpConfig())
+_dhcp_staging = StagingArea()
+
+# DHCP server backend (see functions/dhcp.py), set up by dhcpBackend()
+_dhcp_backend = None
+
+
+def dhcpBackend():
+    """Return the DHCP backend configured in setup.ini."""
+    global _dhcp_backend
+    if _dhcp_backend is None:
+        _dhcp_backend = getDhcpBackend()
+    return _dhcp_backend
+
+
+def outputPath(path):
+    """Return the path a file destined for path has to be written to."""
+    if _staging is None:
+        return path
+    return _staging.path(path)
+
+
+def processLinboGroups(groups, jobs=1):
+    """Process the start.conf/grub.cfg of several groups, optionally in parallel.
+
+    A failing group does not abort the others, see mapWithOrderedOutput()
+    for how jobs > 1 is handled.
+
+    Args:
+        groups: List of device group names
+        jobs: Number of groups processed concurrently
+
+    Returns:
+        List of the groups that failed
+    """
+    results = mapWithOrderedOutput(processLinboGroup, groups, jobs)
+    return [group for group, rc in zip(groups, results) if not rc]
+
+
+# Helper functions for DHCP configuration
+# These functions reduce nesting and improve readability of DHCP config generation
+
+def printSubnetHeader(subnet):
+    """Print the subnet headline of the device listing.
 
     Args:
-        outfile: File handle to write to
         subnet: Subnet identifier or 'DHCP'
     """
     if subnet == 'DHCP':
-        outfile.write('# dynamic ip hosts\n')
         printScript('* dynamic ip hosts:')
     else:
-        outfile.write('# subnet ' + subnet + '\n')
         printScript('* in subnet ' + subnet + ':')
 
 
-def processDevicesForSubnet(outfile, subnet, school):
-    """Process all devices in a subnet and write DHCP declarations.
+def processDevicesForSubnet(subnet, school, index=None):
+    """Collect the DHCP relevant fields of all devices in a subnet.
 
     Args:
-        outfile: File handle to write to
         subnet: Subnet identifier (e.g., '10.0.0.0/24' or 'DHCP')
         school: School name
+        index: DeviceIndex of the school (looked up via getDeviceIndex() if None)
 
     Returns:
-        Number of devices processed
+        List of (hostname, group, mac, ip, dhcpopts, pxeflag) tuples as
+        expected by DhcpBackend.renderDevices()
     """
-    device_count = 0
+    hosts = []
     headline_written = False
-
-    # Query all devices in this subnet from devices.csv
-    for device_array in getDevicesArray(fieldnrs=DEVICE_FIELDS_DHCP, subnet=subnet, school=school):
+    if index is None:
+        index = getDeviceIndex(school)
+
+    # Query all devices in this subnet from the parsed devices.csv
+    project = getFieldProjection(DEVICE_FIELDS_DHCP)
+    verbose = _output_mode == 'verbose'
+    for device in index.select(subnet):
+        device_array = project(device.row)
+        if not verbose:
+            hostname, group, mac, ip, dhcpopts, computertype, pxeflag = device_array
+            hosts.append((hostname, group, mac, ip, dhcpopts, pxeflag))
+            continue
         # Write subnet header only once when first device is encountered
         if not headline_written:
-            writeSubnetHeader(outfile, subnet)
+            printSubnetHeader(subnet)
             headline_written = True
 
         # Unpack device fields (see DEVICE_FIELDS_DHCP constant for field mapping)
@@ -367,61 +596,213 @@ def processDevicesForSubnet(outfile, subnet, school):
         row = [hostname, ip, computertype, pxeflag]
         printScript("  {: <15} | {: <15} | {: <15} | {: <1}".format(*row))
 
-        # Generate and write DHCP host declaration
-        host_decl = buildDhcpHostDeclaration(hostname, group, mac, ip, dhcpopts, pxeflag)
-        outfile.write(host_decl)
-        device_count += 1
+        hosts.append((hostname, group, mac, ip, dhcpopts, pxeflag))
+
+    if not verbose and hosts:
+        if subnet == 'DHCP':
+            printScript(f'* dynamic ip hosts: {len(hosts)} device(s)')
+        else:
+            printScript(f'* in subnet {subnet}: {len(hosts)} device(s)')
+    return hosts
+
+
+# write file only if its content differs, return True if it was written
+def writeIfChanged(path, content, staging=None):
+    rc, current = readTextfile(path)
+    if rc and current == content:
+        return False
+    if staging is not None:
+        outpath = staging.path(path)
+    else:
+        outpath = outputPath(path)
+    with open(outpath, 'w') as outfile:
+        outfile.write(content)
+    return True
+
 
-    return device_count
+# write devices.conf including all schools' dhcp devices configs
+def writeDhcpIncludes():
+    """Stage the backend's devicesconf combining every config in its devicesdir.
+
+    School configs staged but not yet activated are included as well.
+
+    Returns:
+        True if the file changed, False if it was up to date
+    """
+    backend = dhcpBackend()
+    Path(backend.devicesdir).mkdir(parents=True, exist_ok=True)
+    # skip staged or editor files
+    names = set(name for name in listdir(backend.devicesdir) if not name.startswith('.'))
+    for target in list(_dhcp_staging.files):
+        if os.path.dirname(target) == backend.devicesdir:
+            names.add(os.path.basename(target))
+    files = []
+    for devices_conf in sorted(names):
+        target = backend.devicesdir + '/' + devices_conf
+        files.append((target, _dhcp_staging.staged(target) or target))
+    return writeIfChanged(backend.devicesconf, backend.renderDevicesConf(files), _dhcp_staging)
+
+
+def validateDhcpConfig():
+    """Check the DHCP configuration including the staged files.
+
+    Copies of the main config and devicesconf referring to the staged files
+    are written to a hidden directory next to the main config (where the
+    server's apparmor profile allows reading) and passed to the backend's
+    test command (dhcpd -t -cf, kea-dhcp4 -t). Validation is skipped if the
+    server binary or the main config is not present.
+
+    Returns:
+        Tuple (ok, output)
+    """
+    backend = dhcpBackend()
+    mainconf = os.path.basename(backend.mainconf)
+    command = backend.testCommand(mainconf)
+    binary = shutil.which(command[0])
+    if binary is None or not os.path.isfile(backend.mainconf):
+        return True, command[0] + ' or ' + backend.mainconf + ' not found, validation skipped.'
+    rc, devices_conf = readTextfile(_dhcp_staging.staged(backend.devicesconf) or backend.devicesconf)
+    rc, main_conf = readTextfile(backend.mainconf)
+    tmpdir = tempfile.mkdtemp(prefix='.import-devices-', dir=os.path.dirname(backend.mainconf))
+    try:
+        for target, staged in _dhcp_staging.files.items():
+            devices_conf = devices_conf.replace('"' + target + '"', '"' + staged + '"')
+        test_devices_conf = tmpdir + '/' + os.path.basename(backend.devicesconf)
+        with open(test_devices_conf, 'w') as outfile:
+            outfile.write(devices_conf or '')
+        test_main_conf = tmpdir + '/' + mainconf
+        with open(test_main_conf, 'w') as outfile:
+            outfile.write(main_conf.replace('"' + backend.devicesconf + '"',
+                                            '"' + test_devices_conf + '"'))
+        command = [binary] + backend.testCommand(test_main_conf)[1:]
+        result = subprocess.run(command,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                shell=False, check=False)
+        return result.returncode == 0, result.stdout.decode('utf-8', errors='replace')
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def activateDhcpConfig():
+    """Validate the staged DHCP files and move them into place.
+
+    Stages devicesconf first. If the server's config test rejects the
+    configuration the staged files are discarded and the active
+    configuration is kept.
+
+    Returns:
+        True if the configuration was activated (or nothing had changed),
+        False if it was rejected
+    """
+    try:
+        writeDhcpIncludes()
+    except Exception as error:
+        print(error)
+        _dhcp_staging.discard()
+        return False
+    if not _dhcp_staging.files:
+        return True
+    ok, output = validateDhcpConfig()
+    if not ok:
+        msg = 'DHCP server rejected the generated configuration, keeping the active one!'
+        printScript(msg)
+        logToFile(msg)
+        print(output)
+        logToFile('config test output: ' + output.strip())
+        _dhcp_staging.discard()
+        return False
+    logToFile('config test: ' + output.strip().replace('\n', ' '))
+    _dhcp_staging.activate()
+    return True
+
+
+def getDhcpConfigFiles(path=None, seen=None):
+    """Return the main config and all files it includes, recursively, in order."""
+    if path is None:
+        path = dhcpBackend().mainconf
+    if seen is None:
+        seen = []
+    if path in seen:
+        return seen
+    seen.append(path)
+    rc, content = readTextfile(path)
+    if rc:
+        for include in dhcpBackend().getIncludes(content):
+            getDhcpConfigFiles(include, seen)
+    return seen
+
+
+def getDhcpConfigHash(devices=True):
+    """Return a hash over the content of the effective DHCP configuration.
+
+    devicesconf is always covered, even if the main config does not include it.
+
+    Args:
+        devices: Include devicesconf and the per-school device configs;
+                 without them the hash tells whether anything but host
+                 declarations changed
+    """
+    backend = dhcpBackend()
+    files = getDhcpConfigFiles()
+    getDhcpConfigFiles(backend.devicesconf, files)
+    if not devices:
+        files = [path for path in files if path != backend.devicesconf
+                 and os.path.dirname(path) != backend.devicesdir]
+    digest = hashlib.sha1()
+    for path in files:
+        digest.update(path.encode() + b'\0' + str(fileHash(path)).encode() + b'\0')
+    return digest.hexdigest()
 
 
 # write dhcp subnet devices config
-def writeDhcpDevicesConfig(school='default-school'):
+def writeDhcpDevicesConfig(school='default-school', index=None):
     """Generate DHCP device configuration for a school.
 
+    The configuration is rendered in memory and only staged if its content
+    differs from what is on disk; activateDhcpConfig() validates and
+    activates it.
+
     Args:
         school: School name (default: 'default-school')
+        index: DeviceIndex of the school (looked up via getDeviceIndex() if None)
 
     Returns:
-        False on error, None on success
+        False on error, 'changed' if a file was rewritten, 'unchanged' otherwise
     """
     printScript('', 'begin')
     msg = 'Working on dhcp configuration for devices'
     printScript(msg)
     logToFile(msg)
 
-    base_config_file_path = environment.DHCPDEVCONF
-    devices_config_basedir = "/etc/dhcp/devices"
-    Path(devices_config_basedir).mkdir(parents=True, exist_ok=True)
-
-    cfgfile = devices_config_basedir + "/" + school + ".conf"
-    if os.path.isfile(cfgfile):
-        os.unlink(cfgfile)
-    if os.path.isfile(base_config_file_path):
-        os.unlink(base_config_file_path)
+    backend = dhcpBackend()
+    Path(backend.devicesdir).mkdir(parents=True, exist_ok=True)
+    cfgfile = backend.devicesdir + "/" + school + backend.suffix
 
     try:
-        # open devices/<school>.conf for append
-        with open(cfgfile, 'a') as outfile:
-            # iterate over the defined subnets
-            subnets = getSubnetArray('0')
-            subnets.append(['DHCP'])
-            for item in subnets:
-                subnet = item[0]
-                processDevicesForSubnet(outfile, subnet, school)
-
-        # open devices.conf for append
-        with open(base_config_file_path, 'a') as outfile:
-            for devices_conf in listdir(devices_config_basedir):
-                outfile.write("include \"{0}/{1}\";\n".format(devices_config_basedir, devices_conf))
+        # parse devices.csv once, grouped by subnet
+        if index is None:
+            index = getDeviceIndex(school)
+        # iterate over the defined subnets
+        sections = []
+        for subnet in index.subnets + ['DHCP']:
+            hosts = processDevicesForSubnet(subnet, school, index)
+            if hosts:
+                sections.append((subnet, hosts))
+        # render devices/<school>.conf
+        changed = writeIfChanged(cfgfile, backend.renderDevices(sections), _dhcp_staging)
 
     except Exception as error:
         print(error)
         return False
 
+    if changed:
+        return 'changed'
+    logToFile('DHCP devices configuration unchanged.')
+    return 'unchanged'
+
 
 # Create necessary host-based symlinks
-def doPxeGroupsBySchool(school='default-school'):
+def doPxeGroupsBySchool(school='default-school', index=None):
     """Generate PXE boot symlinks for devices by school.
 
     Creates symlinks mapping each PXE-enabled device to its group configuration.
@@ -430,16 +811,19 @@ def doPxeGroupsBySchool(school='default-school'):
 
     Args:
         school: School name (default: 'default-school')
+        index: DeviceIndex of the school (looked up via getDeviceIndex() if None)
 
     Returns:
         List of unique PXE-enabled groups for this school
     """
     pxe_groups = []
+    if index is None:
+        index = getDeviceIndex(school)
 
     # clean up
     links_file_basepath = environment.LINBODIR + "/boot/links"
     Path(links_file_basepath).mkdir(parents=True, exist_ok=True)
-    links_file = links_file_basepath + "/" + school + ".csv"
+    links_file = outputPath(links_file_basepath + "/" + school + ".csv")
     if os.path.isfile(links_file):
         os.unlink(links_file)
 
@@ -447,46 +831,86 @@ def doPxeGroupsBySchool(school='default-school'):
         csv_writer = csv.writer(csvfile, delimiter=';',
                                 quotechar='"', quoting=csv.QUOTE_MINIMAL)
 
-        for device_array in getDevicesArray(fieldnrs=DEVICE_FIELDS_LINKS, subnet='all', pxeflag='1,2,3', school=school):
-            host, group, mac, ip, pxeflag = device_array
+        project = getFieldProjection(DEVICE_FIELDS_LINKS)
+        verbose = _output_mode == 'verbose'
+        group_counts = {}
+        for device in index.select(subnet='all', pxeflag='1,2,3'):
+            host, group, mac, ip, pxeflag = project(device.row)
             # collect groups with pxe for later use
             if group not in pxe_groups:
                 pxe_groups.append(group)
+            group_counts[group] = group_counts.get(group, 0) + 1
 
             # format row in columns for output
-            printScript("  {: <15} | {: <15}".format(host, group))
-
-            # start.conf
-            link_source = 'start.conf.' + group
-            link_target = environment.LINBODIR + '/start.conf-'
-            if ip == 'DHCP':
-                link_target += mac.lower()
-            else:
-                link_target += ip
-            csv_writer.writerow([link_source, link_target])
+            if verbose:
+                printScript("  {: <15} | {: <15}".format(host, group))
 
-            # Grub.cfg
-            link_source = '../' + group + '.cfg'
-            link_target = environment.LINBOGRUBDIR + '/hostcfg/' + host + '.cfg'
-            csv_writer.writerow([link_source, link_target])
+            for link in getDeviceLinks(host, group, mac, ip):
+                csv_writer.writerow(link)
 
+    if not verbose:
+        for group in pxe_groups:
+            printScript("  {: <15} | {} device(s)".format(group, group_counts[group]))
     return pxe_groups
 
 
-# look up all links for all schools and place them in the correct place
-def doAllGroupLinks():
-    """Create all PXE boot symlinks from CSV files for all schools.
+def getDeviceLinks(host, group, mac, ip):
+    """Return the LINBO symlinks of a PXE device.
 
-    Reads the link definition CSV files created by doPxeGroupsBySchool()
-    and creates the actual symlinks in the filesystem. This maps device
-    identifiers (IP, MAC, hostname) to their respective group configurations.
+    Args:
+        host: Device hostname
+        group: Device group name
+        mac: MAC address
+        ip: IP address or 'DHCP'
+
+    Returns:
+        List of [link_source, link_target] pairs for start.conf and grub.cfg
     """
-    # delete old config links
-    delSymlinksByPattern(environment.LINBODIR, "start.conf-*")
-    delSymlinksByPattern(environment.LINBOGRUBDIR + "/hostcfg", "*.cfg")
+    # start.conf
+    link_source = 'start.conf.' + group
+    link_target = environment.LINBODIR + '/start.conf-'
+    if ip == 'DHCP':
+        link_target += mac.lower()
+    else:
+        link_target += ip
+    links = [[link_source, link_target]]
+
+    # Grub.cfg
+    link_source = '../' + group + '.cfg'
+    link_target = environment.LINBOGRUBDIR + '/hostcfg/' + host + '.cfg'
+    links.append([link_source, link_target])
+    return links
+
+
+# create or atomically retarget a symlink
+def replaceSymlink(link_source, link_target):
+    """Point link_target to link_source, replacing an existing link atomically.
+
+    Returns:
+        True if the link was created or retargeted, False if it was already correct
+    """
+    if os.path.islink(link_target) and os.readlink(link_target) == link_source:
+        return False
+    tmplink = link_target + '.tmp'
+    if os.path.lexists(tmplink):
+        os.unlink(tmplink)
+    os.symlink(link_source, tmplink)
+    os.replace(tmplink, link_target)
+    return True
 
+
+# read the desired links of all schools
+def readGroupLinks():
+    """Read the link definition CSV files of all schools.
+
+    Returns:
+        Dict mapping link target (symlink path) to link source
+    """
+    desired = {}
     links_conf_basedir = environment.LINBODIR + "/boot/links"
-    for school_links_conf in listdir(links_conf_basedir):
+    if not os.path.isdir(links_conf_basedir):
+        return desired
+    for school_links_conf in sorted(listdir(links_conf_basedir)):
         school_links_conf_path = links_conf_basedir + "/" + school_links_conf
         if not os.path.isfile(school_links_conf_path) or not school_links_conf.endswith(".csv"):
             continue
@@ -494,7 +918,192 @@ def doAllGroupLinks():
         with open(school_links_conf_path, newline='') as csvfile:
             csv_reader = csv.reader(csvfile, delimiter=';', quotechar='"')
             for row in csv_reader:
-                os.symlink(row[0], row[1])
+                desired[row[1]] = row[0]
+    return desired
+
+
+# look up all links for all schools and place them in the correct place
+def doAllGroupLinks():
+    """Reconcile all PXE boot symlinks with the CSV files of all schools.
+
+    Reads the link definition CSV files created by doPxeGroupsBySchool()
+    and compares them with the start.conf-* links in LINBODIR and the *.cfg
+    links in LINBOGRUBDIR/hostcfg. Only links that differ are created,
+    retargeted (atomically) or removed, so PXE clients booting during an
+    import never see a missing link.
+
+    Returns:
+        Dict with the counts of 'created', 'retargeted', 'removed' and
+        'unchanged' links
+    """
+    desired = readGroupLinks()
+    existing = scanSymlinks(environment.LINBODIR, "start.conf-*")
+    existing.update(scanSymlinks(environment.LINBOGRUBDIR + "/hostcfg", "*.cfg"))
+
+    counts = {'created': 0, 'retargeted': 0, 'removed': 0, 'unchanged': 0}
+    for link_target, link_source in desired.items():
+        if existing.get(link_target) == link_source:
+            counts['unchanged'] += 1
+            continue
+        if os.path.lexists(link_target):
+            counts['retargeted'] += 1
+        else:
+            Path(os.path.dirname(link_target)).mkdir(parents=True, exist_ok=True)
+            counts['created'] += 1
+        replaceSymlink(link_source, link_target)
+
+    # remove obsolete links
+    for link_target in existing:
+        if link_target not in desired:
+            try:
+                os.unlink(link_target)
+                counts['removed'] += 1
+            except FileNotFoundError:
+                continue
+
+    msg = 'LINBO links: {created} created, {retargeted} retargeted, ' \
+          '{removed} removed, {unchanged} unchanged.'.format(**counts)
+    printScript(msg)
+    logToFile(msg)
+    return counts
+
+
+# Helper functions for incremental imports
+# The last applied device set is kept as a snapshot with one hash per device,
+# so the next run only has to touch what was added, removed or changed.
+
+def fileHash(path):
+    """Return the sha1 hex digest of a file's content, None if it is missing."""
+    try:
+        with open(path, 'rb') as infile:
+            return hashlib.sha1(infile.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def getGrubTemplatesHash():
+    """Return a combined hash of the grub templates all group configs are built from."""
+    digest = hashlib.sha1()
+    for template in GRUB_TEMPLATES:
+        digest.update(str(fileHash(environment.LINBOTPLDIR + '/' + template)).encode())
+    return digest.hexdigest()
+
+
+def buildDeviceSnapshot(index, school='default-school'):
+    """Describe the current device set of a school for later comparison.
+
+    Args:
+        index: DeviceIndex of the school
+        school: School name
+
+    Returns:
+        Dict with the school name, a 'hosts' dict (hostname -> hash, DHCP
+        relevant fields, LINBO links and 'dhcp', True if the host is part
+        of the DHCP configuration like in writeDhcpDevicesConfig(), i.e. in
+        a subnets.csv network or dynamic) and an empty 'startconfs' dict
+        that is filled in once the group configs are processed; importDevices()
+        adds 'dhcp_hash', the DHCP state hash running when it is stored
+    """
+    pxe_hosts = set(d.hostname for d in index.select(subnet='all', pxeflag='1,2,3'))
+    dhcp_hosts = set(d.hostname for d in index.select(subnet='all') + index.select('DHCP'))
+    hosts = {}
+    project = getFieldProjection(DEVICE_FIELDS_DHCP)
+    for device in index.devices:
+        hostname, group, mac, ip, dhcpopts, computertype, pxeflag = project(device.row)
+        links = []
+        if hostname in pxe_hosts:
+            links = getDeviceLinks(hostname, group, mac, ip)
+        dhcp = hostname in dhcp_hosts
+        digest = hashlib.sha1(json.dumps([device.row, links, dhcp]).encode()).hexdigest()
+        hosts[hostname] = {'hash': digest, 'group': group, 'mac': mac, 'ip': ip,
+                           'dhcpopts': dhcpopts, 'pxe': pxeflag, 'links': links, 'dhcp': dhcp}
+    return {'school': school, 'hosts': hosts, 'startconfs': {},
+            'templates': getGrubTemplatesHash()}
+
+
+def getSnapshotPath(school='default-school'):
+    return SNAPSHOTDIR + '/' + school + '.json'
+
+
+def loadDeviceSnapshot(school='default-school'):
+    """Return the last applied snapshot of a school, None if there is none."""
+    try:
+        with open(getSnapshotPath(school)) as infile:
+            snapshot = json.load(infile)
+        if snapshot.get('school') != school:
+            return None
+        return snapshot
+    except (OSError, ValueError):
+        return None
+
+
+def saveDeviceSnapshot(snapshot):
+    """Store a snapshot atomically as the last applied state of its school."""
+    Path(SNAPSHOTDIR).mkdir(parents=True, exist_ok=True)
+    snapfile = getSnapshotPath(snapshot['school'])
+    tmpfile = snapfile + '.tmp'
+    with open(tmpfile, 'w') as outfile:
+        json.dump(snapshot, outfile)
+    os.replace(tmpfile, snapfile)
+
+
+class DeviceDiff(object):
+    """Hosts added, removed and changed between two device snapshots.
+
+    Attributes:
+        added: Sorted hostnames only present in the new snapshot
+        removed: Sorted hostnames only present in the old snapshot
+        changed: Sorted hostnames present in both with a different hash
+        groups: Device groups any added, removed or changed host belongs
+            (or belonged) to
+    """
+
+    def __init__(self, old, new):
+        self.old = old['hosts']
+        self.new = new['hosts']
+        self.added = sorted(set(self.new) - set(self.old))
+        self.removed = sorted(set(self.old) - set(self.new))
+        self.changed = sorted(h for h in self.new
+                              if h in self.old and self.old[h]['hash'] != self.new[h]['hash'])
+        self.groups = set()
+        for host in self.added + self.changed:
+            self.groups.add(self.new[host]['group'])
+        for host in self.removed + self.changed:
+            self.groups.add(self.old[host]['group'])
+
+    @property
+    def unchanged(self):
+        """True if no host was added, removed or changed."""
+        return not (self.added or self.removed or self.changed)
+
+    def summary(self):
+        return (f'{len(self.added)} added, {len(self.removed)} removed, '
+                f'{len(self.changed)} changed')
+
+
+def getStartconfHashes(groups):
+    """Return {group: hash of start.conf.<group>} for the given groups."""
+    return {group: fileHash(environment.LINBODIR + '/start.conf.' + group) for group in groups}
+
+
+def selectGroupsToRebuild(pxe_groups, diff, old_snapshot):
+    """Return the PXE groups whose start.conf/grub.cfg need processing.
+
+    A group is processed if its membership changed, its start.conf changed
+    since the last import, its grub.cfg is missing or the grub templates
+    changed. Without a previous snapshot every group is processed.
+    """
+    if diff is None or old_snapshot.get('templates') != getGrubTemplatesHash():
+        return pxe_groups
+    old_hashes = old_snapshot.get('startconfs', {})
+    new_hashes = getStartconfHashes(pxe_groups)
+    groups = []
+    for group in pxe_groups:
+        grubcfg = environment.LINBOGRUBDIR + '/' + group + '.cfg'
+        if group in diff.groups or group not in old_hashes \
+                or old_hashes[group] != new_hashes[group] or not os.path.isfile(grubcfg):
+            groups.append(group)
+    return groups
 
 # functions end
 
@@ -503,31 +1112,111 @@ def parseArguments():
     """Parse command-line arguments.
 
     Returns:
-        School name to import devices for (default: 'default-school')
+        Dict with keys: school (default: 'default-school'), all_schools, check,
+        full, force_sync, pipeline, jobs, hook_jobs, hook_timeout, output
+        (verbose, summary, quiet or json), profile, profile_stats
     """
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "s:", ["school="])
+        opts, args = getopt.getopt(sys.argv[1:], "aj:s:", ["all-schools", "jobs=", "school=", "check", "full",
+                                                           "force-sync", "pipeline", "hook-jobs=",
+                                                           "hook-timeout=", "summary", "quiet",
+                                                           "json", "profile", "profile-stats="])
     except getopt.GetoptError as err:
         print(err)  # e.g., "option -a not recognized"
         usage()
         sys.exit(2)
 
-    school = 'default-school'
+    values = {
+        'school':        'default-school',
+        'all_schools':   False,
+        'check':         False,
+        'full':          False,
+        'force_sync':    False,
+        'pipeline':      False,
+        'jobs':          1,
+        'hook_jobs':     1,
+        'hook_timeout':  HOOK_TIMEOUT,
+        'output':        'verbose',
+        'profile':       False,
+        'profile_stats': None,
+    }
+    school_given = False
     for o, a in opts:
         if o in ("-s", "--school"):
-            school = a
-    return school
+            values['school'] = a
+            school_given = True
+        elif o in ("-a", "--all-schools"):
+            values['all_schools'] = True
+        elif o == "--check":
+            values['check'] = True
+        elif o == "--full":
+            values['full'] = True
+        elif o == "--force-sync":
+            values['force_sync'] = True
+        elif o == "--pipeline":
+            values['pipeline'] = True
+        elif o in ("-j", "--jobs"):
+            try:
+                values['jobs'] = int(a)
+            except ValueError:
+                values['jobs'] = 0
+            if values['jobs'] < 1:
+                print('Invalid number of jobs: ' + a)
+                usage()
+                sys.exit(2)
+        elif o == "--hook-jobs":
+            try:
+                values['hook_jobs'] = int(a)
+            except ValueError:
+                values['hook_jobs'] = 0
+            if values['hook_jobs'] < 1:
+                print('Invalid number of hook jobs: ' + a)
+                usage()
+                sys.exit(2)
+        elif o == "--hook-timeout":
+            try:
+                values['hook_timeout'] = int(a)
+            except ValueError:
+                values['hook_timeout'] = -1
+            if values['hook_timeout'] < 0:
+                print('Invalid hook timeout: ' + a)
+                usage()
+                sys.exit(2)
+        elif o in ("--summary", "--quiet", "--json"):
+            values['output'] = o[2:]
+        elif o == "--profile":
+            values['profile'] = True
+        elif o == "--profile-stats":
+            values['profile'] = True
+            values['profile_stats'] = a
+    if school_given and values['all_schools']:
+        print('Options --school and --all-schools are mutually exclusive.')
+        usage()
+        sys.exit(2)
+    return values
 
 
-def runSophomorixCommand(action):
+def runSophomorixCommand(action, capture=False):
     """Run a single sophomorix-device command, logging its output.
 
     Args:
         action: sophomorix-device subcommand, e.g. '--dry-run' or '--sync'
+        capture: Collect the output and log it in one piece when the command
+                 has finished, so it does not interleave with other log lines
 
     Returns:
         CompletedProcess instance from subprocess.run()
     """
+    if capture:
+        result = subprocess.run(['sophomorix-device', action],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                shell=False, check=False)
+        with open(logfile, 'a') as log:
+            log.write('-' * 78 + '\n')
+            log.write(f'sophomorix-device {action} output:\n')
+            log.write('-' * 78 + '\n')
+            log.write(result.stdout.decode('utf-8', errors='replace'))
+        return result
     with open(logfile, 'a') as log:
         log.write('-' * 78 + '\n')
         log.write(f'sophomorix-device {action} output:\n')
@@ -538,11 +1227,114 @@ def runSophomorixCommand(action):
                               shell=False, check=False)
 
 
-def runSophomorixDeviceSync():
+def getSophomorixSyncState():
+    """Describe the input of a sophomorix-device sync.
+
+    sophomorix-device syncs the devices.csv of every school, so the state
+    consists of the content hashes of all of them plus the mtime and size
+    of the sophomorix-device executable, which change on updates.
+
+    Returns:
+        Dict with keys devices (school -> hash) and sophomorix
+    """
+    devices = {}
+    for school in getSchools():
+        devices[school] = fileHash(getDevicesCsvPath(school))
+    sophomorix = None
+    tool = shutil.which('sophomorix-device')
+    if tool is not None:
+        st = os.stat(tool)
+        sophomorix = [tool, st.st_mtime_ns, st.st_size]
+    return {'devices': devices, 'sophomorix': sophomorix}
+
+
+def loadSophomorixSyncState():
+    """Return the state recorded after the last successful sync, None if there is none."""
+    try:
+        with open(SYNCSTATEFILE) as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+
+def saveSophomorixSyncState(state):
+    """Record the state of a successful sync atomically.
+
+    A state that cannot be written is only logged, the next run then
+    simply syncs again.
+    """
+    try:
+        Path(SNAPSHOTDIR).mkdir(parents=True, exist_ok=True)
+        tmpfile = SYNCSTATEFILE + '.tmp'
+        with open(tmpfile, 'w') as outfile:
+            json.dump(state, outfile)
+        os.replace(tmpfile, SYNCSTATEFILE)
+    except OSError as error:
+        logToFile(f'Cannot save sophomorix-device sync state: {error}')
+
+
+def checkSophomorixSyncResult(result, state):
+    """Report the result of a sync and record its state on success.
+
+    Returns:
+        True if the sync succeeded, False otherwise
+    """
+    if result.returncode == 0:
+        msg = 'sophomorix-device sync finished OK!'
+        printScript(msg)
+        logToFile(msg)
+        saveSophomorixSyncState(state)
+        return True
+    msg = f'sophomorix-device --sync failed with return code {result.returncode}!'
+    printScript(msg)
+    logToFile(msg)
+    return False
+
+
+def joinSophomorixSync(future, state):
+    """Wait for a sync started by runSophomorixDeviceSync(background=True).
+
+    Returns:
+        True if the sync succeeded, False otherwise
+    """
+    msg = 'Waiting for sophomorix-device sync to finish:'
+    printScript(msg)
+    logToFile(msg)
+    try:
+        result = future.result()
+    except Exception as error:
+        msg = 'sophomorix-device errors detected!'
+        printScript(msg)
+        logToFile(msg + ' ' + str(error))
+        print(error)
+        return False
+    return checkSophomorixSyncResult(result, state)
+
+
+def runSophomorixDeviceSync(force=False, background=False):
     """Run sophomorix-device dry-run first, then sync if the dry-run succeeds.
 
+    Both steps are skipped if no devices.csv changed since the last
+    successful sync, unless force is set.
+
     Exits the process with status 1 if either step fails or raises an error.
+
+    Args:
+        force: Run sophomorix-device regardless of the recorded state
+        background: Start the sync in a worker thread once the dry-run
+                    succeeded instead of waiting for it
+
+    Returns:
+        With background a tuple (future, state) to pass to
+        joinSophomorixSync(), otherwise or if skipped None
     """
+    state = getSophomorixSyncState()
+    if not force and loadSophomorixSyncState() == state:
+        msg = 'devices.csv unchanged since last sync, skipping sophomorix-device.'
+        printScript(msg)
+        logToFile(msg)
+        return
+
     msg = 'Starting sophomorix-device dry-run:'
     printScript(msg)
     logToFile(msg)
@@ -555,20 +1347,21 @@ def runSophomorixDeviceSync():
             logToFile(msg)
             sys.exit(1)
 
+        if background:
+            msg = 'sophomorix-device dry-run OK, starting sync in background.'
+            printScript(msg)
+            logToFile(msg)
+            pool = ThreadPoolExecutor(max_workers=1)
+            future = pool.submit(runSophomorixCommand, '--sync', True)
+            pool.shutdown(wait=False)
+            return future, state
+
         msg = 'sophomorix-device dry-run OK, starting sync:'
         printScript(msg)
         logToFile(msg)
 
         result = runSophomorixCommand('--sync')
-
-        if result.returncode == 0:
-            msg = 'sophomorix-device sync finished OK!'
-            printScript(msg)
-            logToFile(msg)
-        else:
-            msg = f'sophomorix-device --sync failed with return code {result.returncode}!'
-            printScript(msg)
-            logToFile(msg)
+        if not checkSophomorixSyncResult(result, state):
             sys.exit(1)
     except Exception as error:
         msg = 'sophomorix-device errors detected!'
@@ -578,75 +1371,594 @@ def runSophomorixDeviceSync():
         sys.exit(1)
 
 
-def generateGrubConfigsForGroups(school):
-    """Generate LINBO/GRUB boot configuration for all PXE-enabled device groups.
+def getSchools():
+    """Return all schools under SOPHOSYSDIR that have a devices.csv.
+
+    Returns:
+        List of school names, default-school first
+    """
+    schools = []
+    try:
+        entries = sorted(entry.name for entry in os.scandir(environment.SOPHOSYSDIR) if entry.is_dir())
+    except OSError:
+        return schools
+    for school in entries:
+        if os.path.isfile(getDevicesCsvPath(school)):
+            schools.append(school)
+    if 'default-school' in schools:
+        schools.remove('default-school')
+        schools.insert(0, 'default-school')
+    return schools
+
+
+def prepareSchoolImport(school, full=False):
+    """Compare a school's devices with the last import and write its configs.
 
-    Creates PXE symlinks for the given school, resolves symlinks for all
-    schools, then writes/refreshes the grub.cfg for every PXE group.
+    Writes the DHCP devices config and the PXE links csv of the school and
+    selects the groups whose grub.cfg has to be rebuilt.
 
     Args:
-        school: School name to generate configs for
+        school: School name
+        full: Ignore the last import snapshot
+
+    Returns:
+        Dict with keys: school, snapshot, diff, dhcp_hash (the DHCP state
+        hash stored with the last snapshot), dhcp_status, pxe_groups and
+        groups (the PXE groups to rebuild)
     """
-    # Return value currently unused, kept to preserve original behavior
-    # (also acts as an implicit sanity check that the LINBO version string parses)
-    linbo_version = int(getLinboVersion().split('.')[0])
+    # Compare with the last applied device set
+    with _report.phase('prepare.parse'):
+        index = getDeviceIndex(school)
+        snapshot = buildDeviceSnapshot(index, school)
+        old_snapshot = None if full else loadDeviceSnapshot(school)
+    _report.count('devices', len(snapshot['hosts']))
+    _report.count('subnets', len(index.subnets))
+    diff = None
+    if old_snapshot is not None:
+        diff = DeviceDiff(old_snapshot, snapshot)
+        if diff.unchanged:
+            msg = 'No device changes since last import.'
+        else:
+            msg = 'Device changes since last import: ' + diff.summary()
+        printScript(msg)
+        logToFile(msg)
+
+    with _report.phase('prepare.dhcp'):
+        dhcp_status = writeDhcpDevicesConfig(school=school, index=index)
+
     printScript('', 'begin')
     msg = 'Working on linbo/grub configuration for devices:'
     printScript(msg)
     logToFile(msg)
-
     # Create symlinks from devices to their group configurations
-    pxe_groups = doPxeGroupsBySchool(school=school)
+    with _report.phase('prepare.links'):
+        pxe_groups = doPxeGroupsBySchool(school=school, index=index)
 
-    # Resolve and place all symlinks for all schools
-    doAllGroupLinks()
+    return {'school': school, 'snapshot': snapshot, 'diff': diff,
+            'dhcp_hash': old_snapshot.get('dhcp_hash') if old_snapshot else None,
+            'dhcp_status': dhcp_status, 'pxe_groups': pxe_groups,
+            'groups': selectGroupsToRebuild(pxe_groups, diff, old_snapshot)}
+
+
+def prepareSchoolImports(schools, full=False, jobs=1):
+    """Run prepareSchoolImport() for several schools, optionally in parallel.
+
+    Args:
+        schools: List of school names
+        full: Ignore the last import snapshots
+        jobs: Number of schools processed concurrently
+
+    Returns:
+        List of the prepareSchoolImport() results in the order of schools
+    """
+    if len(schools) == 1:
+        return [prepareSchoolImport(schools[0], full)]
+
+    def prepare(school):
+        printScript('', 'begin')
+        msg = 'Importing devices of school ' + school + ':'
+        printScript(msg)
+        logToFile(msg)
+        return prepareSchoolImport(school, full)
+
+    return mapWithOrderedOutput(prepare, schools, jobs)
+
+
+def generateGrubConfigsForGroups(imports, jobs=1, links=True):
+    """Generate LINBO/GRUB boot configuration for the PXE groups of all imports.
+
+    Reconciles the LINBO symlinks of all schools once, then writes/refreshes
+    the grub.cfg of every group selected by prepareSchoolImport(). Groups
+    shared by several schools are processed only once.
+
+    Args:
+        imports: prepareSchoolImport() results
+        jobs: Number of groups processed concurrently
+        links: Reconcile the LINBO symlinks (see doAllGroupLinks())
+
+    Returns:
+        List of the groups whose processing failed
+    """
+    # Return value currently unused, kept to preserve original behavior
+    # (also acts as an implicit sanity check that the LINBO version string parses)
+    linbo_version = int(getLinboVersion().split('.')[0])
+
+    # Reconcile the symlinks of all schools, touching only differing ones
+    if links:
+        with _report.phase('grub.symlinks'):
+            doAllGroupLinks()
 
     # Generate grub configs for each PXE boot group
+    pxe_groups = list(dict.fromkeys(group for item in imports for group in item['pxe_groups']))
+    groups = list(dict.fromkeys(group for item in imports for group in item['groups']))
     printScript('', 'begin')
     msg = 'Working on linbo/grub configuration for groups:'
     printScript(msg)
     logToFile(msg)
+    if len(groups) < len(pxe_groups):
+        msg = f'{len(pxe_groups) - len(groups)} unchanged group(s) skipped.'
+        printScript(msg)
+        logToFile(msg)
     printScript("  {: <15} | {: <20} | {: <20}".format(
         *[' ', 'linbo start.conf', 'grub cfg']))
     printScript("  {: <15}+{: <20}+{: <20}".format(*['-'*16, '-'*22, '-'*21]))
-    for group in pxe_groups:
-        doLinboStartconf(group)
+    with _report.phase('grub.groups'):
+        failed = processLinboGroups(groups, jobs)
+    _report.count('pxe_groups', len(pxe_groups))
+    _report.count('groups_rebuilt', len(groups))
+    if failed:
+        msg = 'Processing failed for group(s): ' + ', '.join(failed)
+        printScript(msg)
+        logToFile(msg)
+    return failed
 
 
-def runPostImportHooks(school):
+def getHookStages(hookpath):
+    """Return the executable hook scripts of a directory grouped into stages.
+
+    Hooks whose names start with a number form a stage per number, run in
+    ascending order; hooks without a numeric prefix form the last stage.
+    E.g. 10-webui and 10-printers run in stage 10, 20-torrent after them.
+
+    Args:
+        hookpath: Directory containing the hook scripts
+
+    Returns:
+        List of stages, each a sorted list of hook names
+    """
+    stages = {}
+    for h in sorted(listdir(hookpath)):
+        if not isfile(join(hookpath, h)) or not os.access(join(hookpath, h), os.X_OK):
+            continue
+        prefix = re.match(r'\d+', h)
+        key = (0, int(prefix.group(0))) if prefix else (1, 0)
+        stages.setdefault(key, []).append(h)
+    return [stages[key] for key in sorted(stages)]
+
+
+def runHook(hookscript, school, timeout=HOOK_TIMEOUT):
+    """Run a single hook script, killing it and its children on timeout.
+
+    Args:
+        hookscript: Path of the hook script
+        school: School name, passed via -s
+        timeout: Seconds after which the hook is killed (0: no limit)
+
+    Returns:
+        Tuple (returncode, output, duration); returncode is None if the hook
+        timed out and 126 if it could not be started (like in a shell)
+    """
+    start = time.monotonic()
+    try:
+        proc = subprocess.Popen([hookscript, "-s", school], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, start_new_session=True)
+    except OSError as error:
+        return 126, str(error), time.monotonic() - start
+    try:
+        output, _ = proc.communicate(timeout=timeout or None)
+        returncode = proc.returncode
+    except subprocess.TimeoutExpired:
+        # the hook runs in its own session, so this also stops its children
+        os.killpg(proc.pid, signal.SIGKILL)
+        output, _ = proc.communicate()
+        returncode = None
+    return returncode, output.decode('utf-8', errors='replace'), time.monotonic() - start
+
+
+def runPostImportHooks(schools, jobs=1, timeout=HOOK_TIMEOUT):
     """Execute all executable post-device-import hook scripts.
 
+    Hooks run in the stages returned by getHookStages(); up to jobs hooks of
+    a stage run in parallel. Each hook's output is printed as a whole once
+    it finished. Failing or timed out hooks are reported and logged with
+    their duration and exit status, but do not abort the import.
+
     Args:
-        school: School name, passed to each hook script via -s
+        schools: List of school names, each hook script is run once per
+                 school with the school passed via -s
+        jobs: Number of hooks of a stage run concurrently
+        timeout: Seconds after which a hook is killed (0: no limit)
+
+    Returns:
+        List of 'hook (school)' descriptions of the hooks that failed
     """
     hookpath = environment.POSTDEVIMPORT
-    hookscripts = [f for f in listdir(hookpath) if isfile(
-        join(hookpath, f)) and os.access(join(hookpath, f), os.X_OK)]
-    if len(hookscripts) > 0:
-        printScript('', 'begin')
-        msg = 'Executing post hooks:'
+    stages = getHookStages(hookpath)
+    failed = []
+    if not stages:
+        return failed
+    printScript('', 'begin')
+    msg = 'Executing post hooks:'
+    printScript(msg)
+    logToFile(msg)
+    for stage in stages:
+        tasks = [(h, school) for h in stage for school in schools]
+
+        def run(task):
+            return runHook(hookpath + '/' + task[0], task[1], timeout)
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            for (h, school), (returncode, output, duration) in zip(tasks, pool.map(run, tasks)):
+                msg = '* ' + h + ' '
+                if len(schools) > 1:
+                    msg += '(' + school + ') '
+                if returncode == 0:
+                    status = 'OK'
+                elif returncode is None:
+                    status = 'timed out'
+                else:
+                    status = 'failed (' + str(returncode) + ')'
+                printScript(msg + status + f' [{duration:.1f}s]')
+                _report.addHook(h, school, returncode, duration)
+                logToFile(f'Hook {h} -s {school}: {status}, exit status {returncode}, {duration:.2f}s')
+                if output != '':
+                    print(output)
+                    logToFile('Hook output: ' + output.strip())
+                if returncode != 0:
+                    failed.append(h + ' (' + school + ')')
+    if failed:
+        msg = 'Post hooks failed: ' + ', '.join(failed)
         printScript(msg)
         logToFile(msg)
-        for h in hookscripts:
-            hookscript = hookpath + '/' + h
-            msg = '* ' + h + ' '
-            printScript(msg, '', False, False, True)
-            logToFile('Executing hook: ' + h)
-            output = subprocess.check_output([hookscript, "-s", school]).decode('utf-8')
-            if output != '':
-                print(output)
-                logToFile('Hook output: ' + output.strip())
+    return failed
 
 
 def restartDhcpService():
-    """Restart the ISC DHCP server to apply the newly generated configuration."""
+    """Restart the DHCP server, or let Kea reload its configuration, to apply
+    the newly generated configuration.
+
+    Returns:
+        True if the restart succeeded
+    """
+    backend = dhcpBackend()
     printScript('', 'begin')
-    msg = 'Finally restarting dhcp service.'
+    if backend.restarts:
+        msg = 'Finally restarting dhcp service.'
+    else:
+        msg = 'Finally reloading dhcp service configuration.'
+    printScript(msg)
+    logToFile(msg)
+    ok = backend.reload()
+    logToFile(f'DHCP service {backend.service}: ' + ('ok' if ok else 'failed'))
+    return ok
+
+
+def getOmapiConfig():
+    """Return the OMAPI settings of the running dhcpd, None if not configured.
+
+    OMAPICONF is an ini file matching the omapi-port and omapi-key
+    statements of dhcpd.conf:
+
+        [omapi]
+        host = 127.0.0.1
+        port = 7911
+        keyname = omapi_key
+        secret = <base64 encoded hmac-md5 secret>
+
+    Returns:
+        Dict with keys host, port, keyname and secret or None
+    """
+    if not os.path.isfile(OMAPICONF):
+        return None
+    config = configparser.ConfigParser(delimiters=('='))
+    try:
+        config.read(OMAPICONF)
+        return {'host': config.get('omapi', 'host', fallback='127.0.0.1'),
+                'port': config.getint('omapi', 'port', fallback=7911),
+                'keyname': config.get('omapi', 'keyname', fallback=None),
+                'secret': config.get('omapi', 'secret', fallback=None)}
+    except (configparser.Error, ValueError) as error:
+        logToFile(f'Invalid {OMAPICONF}: {error}')
+        return None
+
+
+def getOmapiHostStatements(host, hostname):
+    """Return the host statements of a snapshot host for an OMAPI host object.
+
+    The statements are taken from buildDhcpHostDeclaration(), leaving out
+    hardware ethernet and fixed-address, which are object attributes.
+    """
+    declaration = buildDhcpHostDeclaration(hostname, host['group'], host['mac'], host['ip'],
+                                           host['dhcpopts'], host['pxe'])
+    statements = []
+    for line in declaration.splitlines()[1:-1]:
+        line = line.strip()
+        if line.startswith('hardware ethernet ') or line.startswith('fixed-address '):
+            continue
+        statements.append(line)
+    return ' '.join(statements)
+
+
+def applyDhcpDeltas(config, diffs):
+    """Apply the host changes of device diffs to the running dhcpd via OMAPI.
+
+    Removed hosts are deleted, changed hosts are deleted and created again
+    with their new settings, added hosts are created. Only hosts of the
+    DHCP configuration are considered (snapshot field 'dhcp'), so the
+    running server keeps matching the configuration files.
+
+    Args:
+        config: getOmapiConfig() result
+        diffs: DeviceDiff instances of all imported schools
+
+    Returns:
+        True if all changes were applied, False on any error
+    """
+    printScript('', 'begin')
+    msg = 'Applying host changes to the running dhcp service:'
+    printScript(msg)
+    logToFile(msg)
+    try:
+        with OmapiClient(config['host'], config['port'], config['keyname'], config['secret']) as omapi:
+            for diff in diffs:
+                for hostname in diff.removed + diff.changed:
+                    if not diff.old[hostname].get('dhcp', True):
+                        continue
+                    omapi.deleteHost(diff.old[hostname]['mac'])
+                    if hostname in diff.removed:
+                        printScript('* removed ' + hostname)
+                for hostname in diff.changed + diff.added:
+                    host = diff.new[hostname]
+                    if not host['dhcp']:
+                        continue
+                    ip = None if host['ip'] == 'DHCP' else host['ip']
+                    omapi.addHost(hostname, host['mac'], ip, getOmapiHostStatements(host, hostname))
+                    printScript(('* changed ' if hostname in diff.changed else '* added ') + hostname)
+    except (OmapiError, OSError) as error:
+        msg = f'OMAPI update failed: {error}'
+        printScript(msg)
+        logToFile(msg)
+        return False
+    logToFile('OMAPI update: ' + ', '.join(diff.summary() for diff in diffs))
+    return True
+
+
+def loadDhcpState():
+    try:
+        with open(DHCPSTATEFILE) as infile:
+            state = json.load(infile)
+        return state if isinstance(state, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def saveDhcpState(state):
+    try:
+        Path(SNAPSHOTDIR).mkdir(parents=True, exist_ok=True)
+        tmpfile = DHCPSTATEFILE + '.tmp'
+        with open(tmpfile, 'w') as outfile:
+            json.dump(state, outfile)
+        os.replace(tmpfile, DHCPSTATEFILE)
+    except OSError as error:
+        logToFile(f'Cannot save dhcp state: {error}')
+
+
+def updateDhcpService(imports=None):
+    """Bring the running DHCP server in line with the activated configuration.
+
+    Nothing is done if the effective configuration hash (see
+    getDhcpConfigHash()) equals the one recorded last time. If only host
+    declarations changed, every import is incremental, its last snapshot
+    was stored while the recorded configuration was running and OMAPI is
+    configured for the isc backend (see getOmapiConfig()), the host changes
+    are applied to the running server with applyDhcpDeltas(). Otherwise, or
+    if that fails, the service is restarted (isc) or reloaded (kea).
+
+    Args:
+        imports: prepareSchoolImport() results providing the device diffs
+
+    Returns:
+        False if the restart failed, True otherwise
+    """
+    state = {'hash': getDhcpConfigHash(), 'base': getDhcpConfigHash(devices=False)}
+    last_state = loadDhcpState()
+    if state['hash'] == last_state.get('hash'):
+        printScript('', 'begin')
+        msg = 'DHCP configuration unchanged, skipping dhcp service restart.'
+        printScript(msg)
+        logToFile(msg)
+        _report.info['dhcp_service'] = 'unchanged'
+        return True
+    if imports and state['base'] == last_state.get('base') \
+            and all(item['diff'] is not None and item['dhcp_hash'] == last_state.get('hash')
+                    for item in imports):
+        config = getOmapiConfig() if dhcpBackend().name == 'isc' else None
+        if config is not None and applyDhcpDeltas(config, [item['diff'] for item in imports]):
+            saveDhcpState(state)
+            _report.info['dhcp_service'] = 'omapi'
+            return True
+    if restartDhcpService():
+        saveDhcpState(state)
+        _report.info['dhcp_service'] = 'restarted'
+        return True
+    _report.info['dhcp_service'] = 'failed'
+    return False
+
+
+def generateStagedConfigs(schools, args, future, state):
+    """Generate all configs while sophomorix-device syncs in the background.
+
+    The DHCP, links and grub files are written to a StagingArea. They are
+    activated once the sync finished successfully and discarded otherwise,
+    in which case the process exits with status 1. LINBO symlinks and
+    devices.conf are updated after activation.
+
+    Args:
+        schools: List of school names
+        args: parseArguments() result
+        future, state: As returned by runSophomorixDeviceSync(background=True)
+
+    Returns:
+        Tuple (imports, failed_groups)
+    """
+    global _staging
+    _staging = StagingArea()
+    try:
+        imports = prepareSchoolImports(schools, args['full'], args['jobs'])
+        failed_groups = generateGrubConfigsForGroups(imports, args['jobs'], links=False)
+        printScript('', 'begin')
+        with _report.phase('sophomorix.wait'):
+            sync_ok = joinSophomorixSync(future, state)
+        if not sync_ok:
+            msg = 'Discarding generated configuration.'
+            printScript(msg)
+            logToFile(msg)
+            _staging.discard()
+            _dhcp_staging.discard()
+            sys.exit(1)
+        count = _staging.activate()
+    except BaseException:
+        _staging.discard()
+        _dhcp_staging.discard()
+        raise
+    finally:
+        _staging = None
+    msg = f'Activated {count} generated file(s).'
     printScript(msg)
     logToFile(msg)
-    result = subprocess.run(['service', 'isc-dhcp-server', 'restart'],
-                           shell=False, check=False)
-    logToFile(f'DHCP service restart: return code {result.returncode}')
+    with _report.phase('grub.symlinks'):
+        doAllGroupLinks()
+    return imports, failed_groups
+
+
+def importDevices(args, schools):
+    """Run the import steps 2-9 described in main().
+
+    Returns:
+        Dict with keys dhcp_ok (True if the DHCP configuration was accepted),
+        imports (prepareSchoolImport() results), failed_groups, failed_hooks
+    """
+    # sophomorix-device always processes all schools
+    with _report.phase('sophomorix'):
+        sync = runSophomorixDeviceSync(args['force_sync'], background=args['pipeline'])
+
+    if sync is None:
+        with _report.phase('prepare'):
+            imports = prepareSchoolImports(schools, args['full'], args['jobs'])
+        with _report.phase('grub'):
+            failed_groups = generateGrubConfigsForGroups(imports, args['jobs'])
+    else:
+        with _report.phase('pipeline'):
+            imports, failed_groups = generateStagedConfigs(schools, args, *sync)
+
+    # Swap in the DHCP configuration only if the server accepts it
+    with _report.phase('dhcp.activate'):
+        dhcp_ok = activateDhcpConfig()
+    if not dhcp_ok:
+        # no snapshot is stored, so the next run retries
+        for item in imports:
+            item['dhcp_status'] = False
+    with _report.phase('hooks'):
+        failed_hooks = runPostImportHooks(schools, args['hook_jobs'], args['hook_timeout'])
+    with _report.phase('dhcp.service'):
+        dhcp_service_ok = updateDhcpService(imports)
+
+    # Remember what was applied for the next incremental run; after a failed
+    # dhcp restart no snapshot is stored, so the next run sends the pending
+    # host changes again
+    with _report.phase('snapshots'):
+        dhcp_hash = loadDhcpState().get('hash')
+        for item in imports:
+            if not item['dhcp_status'] or not dhcp_service_ok:
+                continue
+            # failed groups are left out, so the next run retries them
+            item['snapshot']['startconfs'] = getStartconfHashes(
+                [group for group in item['pxe_groups'] if group not in failed_groups])
+            item['snapshot']['dhcp_hash'] = dhcp_hash
+            saveDeviceSnapshot(item['snapshot'])
+
+    _report.count('failed_groups', len(failed_groups))
+    _report.count('failed_hooks', len(failed_hooks))
+    return {'dhcp_ok': dhcp_ok, 'imports': imports, 'failed_groups': failed_groups,
+            'failed_hooks': failed_hooks}
+
+
+def buildJsonResult(result=None):
+    """Return the machine readable result of a run, see --json.
+
+    Args:
+        result: importDevices() result, None if the run was aborted
+
+    Returns:
+        Dict with the run report (status, phases, counts) and per school
+        the DHCP status, the device changes and the PXE groups
+    """
+    report = _report.asDict()
+    del report['groups'], report['hooks']
+    report['failed_groups'] = result['failed_groups'] if result else []
+    report['failed_hooks'] = result['failed_hooks'] if result else []
+    report['imports'] = []
+    for item in (result['imports'] if result else []):
+        entry = {'school': item['school'], 'dhcp': item['dhcp_status'] or 'failed',
+                 'pxe_groups': item['pxe_groups'], 'groups_rebuilt': item['groups']}
+        if item['diff'] is not None:
+            entry['added'] = item['diff'].added
+            entry['removed'] = item['diff'].removed
+            entry['changed'] = item['diff'].changed
+        report['imports'].append(entry)
+    return report
+
+
+def printQuietResult():
+    """Print the one line result of --quiet."""
+    counts = _report.counts
+    status = _report.info.get('status')
+    print(f"linuxmuster-import-devices: {status}, {counts.get('devices', 0)} device(s) "
+          f"in {counts.get('subnets', 0)} subnet(s), {counts.get('groups_rebuilt', 0)} of "
+          f"{counts.get('pxe_groups', 0)} group(s) rebuilt, dhcp service "
+          f"{_report.info.get('dhcp_service', 'not updated')}, "
+          f"{time.monotonic() - _report.start:.1f}s")
+
+
+def checkDevices(schools, output='verbose'):
+    """Check the devices.csv files and print the issues found, see --check.
+
+    Args:
+        schools: Schools to check, duplicates are detected across all of them
+        output: 'json' prints a JSON document, else one line per issue
+
+    Returns:
+        Number of errors found
+    """
+    try:
+        issues = checkDevicesCsv(schools)
+    except OSError as error:
+        issues = []
+        errors = 1
+        message = str(error)
+    else:
+        errors = sum(1 for issue in issues if issue.level == 'error')
+        message = (f'{len(issues) - errors} warning(s), {errors} error(s) in '
+                   f'{len(schools)} devices.csv file(s).')
+    if output == 'json':
+        print(json.dumps({'status': 'errors' if errors else 'ok', 'schools': schools,
+                          'message': message, 'issues': [issue.asDict() for issue in issues]},
+                         indent=2))
+        return errors
+    for issue in issues:
+        print(str(issue))
+    printScript(message)
+    return errors
 
 
 def main():
@@ -655,29 +1967,89 @@ def main():
     This function orchestrates the complete device import workflow:
     1. Parses command-line arguments
     2. Runs sophomorix-device syntax check and sync
-    3. Generates DHCP configuration for all devices
-    4. Creates LINBO/GRUB boot configurations
-    5. Executes post-import hooks
-    6. Restarts DHCP service
+       (with --pipeline the sync runs while steps 3-5 stage their output)
+    3. Compares each school's devices.csv with the snapshot of the last import
+    4. Generates DHCP configuration and PXE links per school
+       (concurrently with --all-schools)
+    5. Creates LINBO/GRUB boot configurations for changed devices/groups
+    6. Validates the DHCP configuration (dhcpd -t, kea-dhcp4 -t) and
+       activates it
+    7. Executes post-import hooks
+    8. Updates the running DHCP service once if its effective configuration
+       changed, via OMAPI if only hosts changed, otherwise by a restart
+    9. Stores the new snapshots
+
+    The duration of every phase and the device, subnet and group counts are
+    appended as a JSON document to RUNREPORTFILE (see RunReport).
     """
-    school = parseArguments()
+    args = parseArguments()
+    if args['all_schools']:
+        schools = getSchools()
+        if not schools:
+            printScript('No schools with devices.csv found in ' + environment.SOPHOSYSDIR + '.')
+            sys.exit(1)
+    else:
+        schools = [args['school']]
+    if args['check']:
+        schools += [school for school in getSchools() if school not in schools]
+        sys.exit(1 if checkDevices(schools, args['output']) else 0)
+    try:
+        dhcpBackend()
+    except ValueError as error:
+        printScript(str(error))
+        sys.exit(1)
+
+    global _report, _output_mode
+    _report = RunReport()
+    _report.info.update({'schools': schools, 'dhcp_backend': dhcpBackend().name,
+                         'options': {key: args[key] for key in ('full', 'force_sync', 'pipeline',
+                                                                'jobs', 'hook_jobs')}})
+    _output_mode = args['output']
+    capture = None
+    if _output_mode in ('quiet', 'json'):
+        capture = OutputCapture(redirect_fd=_output_mode == 'json')
+        capture.start()
+    profiler = None
+    if args['profile_stats']:
+        profiler = cProfile.Profile()
+        profiler.enable()
 
     # Log import start
     printScript(os.path.basename(__file__), 'begin')
     logToFile('=' * 78)
     logToFile('linuxmuster-import-devices started')
-    logToFile('School: ' + school)
+    logToFile('School: ' + ', '.join(schools))
 
-    runSophomorixDeviceSync()
-    writeDhcpDevicesConfig(school=school)
-    generateGrubConfigsForGroups(school)
-    runPostImportHooks(school)
-    restartDhcpService()
+    _report.info['status'] = 'aborted'
+    result = None
+    try:
+        result = importDevices(args, schools)
+        _report.info['status'] = 'ok' if result['dhcp_ok'] else 'dhcp rejected'
+
+        # Log completion
+        printScript(os.path.basename(__file__), 'end')
+        logToFile('linuxmuster-import-devices completed')
+        logToFile('=' * 78)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args['profile_stats'])
+        _report.save()
+        if capture is not None:
+            output = capture.stop()
+            if _output_mode == 'json':
+                if _report.info['status'] != 'ok':
+                    sys.stderr.write(output)
+                print(json.dumps(buildJsonResult(result), indent=2))
+            else:
+                if _report.info['status'] != 'ok':
+                    print(output, end='')
+                printQuietResult()
+        if args['profile'] and _output_mode != 'json':
+            _report.printSummary()
 
-    # Log completion
-    printScript(os.path.basename(__file__), 'end')
-    logToFile('linuxmuster-import-devices completed')
-    logToFile('=' * 78)
+    if not result['dhcp_ok']:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
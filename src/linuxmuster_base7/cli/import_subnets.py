@@ -4,31 +4,50 @@
 # Description  : Import subnets to DHCP, netplan, NTP and OPNsense firewall
 # Signed-off by: thomas@linuxmuster.net
 # Assisted by  : Claude
-# Date         : 20260818
+# Date         : 20261017
 #
 # Requirements (import_subnets.md):
-#  - Writes DHCP configuration to /etc/dhcp/subnets.conf
+#  - Writes DHCP configuration to /etc/dhcp/subnets.conf (isc) or
+#    /etc/kea/subnets.json (kea), see dhcpbackend in setup.ini
 #  - Manages LAN gateway and static routes on OPNsense via API
 #  - Removes obsolete routes / gateway when no extra subnets are present
 #  - Synchronises outbound NAT rules on OPNsense via API
-#  - Updates static routes in /etc/netplan/01-netcfg.yaml
-#  - Calls linuxmuster-update-ntpconf
+#  - Reads the firewall state once and applies a change plan with one
+#    reconfigure per subsystem; --plan only prints it
+#  - Sends independent route and NAT changes concurrently (--jobs)
+#  - Adds routes as soon as a new gateway is accepted, at most after
+#    the 20-second gateway cache expired
+#  - Updates static routes in /etc/netplan/01-netcfg.yaml and applies
+#    only the route changes to the kernel (ip -batch), no netplan apply
+#  - Updates the ntpsec configuration (linuxmuster-update-ntpconf)
+#  - Renders DHCP, netplan and NTP configuration in memory and only
+#    writes, applies or restarts what changed; reports each as
+#    changed or unchanged
 
 import sys
 sys.path.insert(0, '/usr/lib/linuxmuster')
+import copy
 import csv
 import datetime
 import environment
+import getopt
 import json
+import os
 import subprocess
 import time
 import yaml
 
 from IPy import IP
+from linuxmuster_base7.cli.update_ntpconf import updateNtpConf
 from linuxmuster_base7.functions import (
-    firewallApi, getSetupValue, isValidHostIpv4, printScript
+    FirewallApiError, firewallApi, getDhcpBackend, getFirewallClient, getSetupValue,
+    isValidHostIpv4, mapWithOrderedOutput, printScript, readTextfile
 )
 
+# Exists while the written DHCP configuration has not been activated by a
+# successful restart/reload, so a run after a failed restart retries it
+DHCPPENDING = os.path.dirname(environment.SETUPINI) + '/import-subnets.dhcp-pending'
+
 # LAN gateway constants
 LAN_GW_NAME     = 'LAN_GW'
 LAN_GW_NAME_OLD = 'GW_LAN'   # legacy name - replaced during migration
@@ -38,10 +57,23 @@ LAN_GW_PRIORITY = '255'
 # Outbound NAT constant - used as description prefix to identify own rules
 NAT_RULE_DESCR = 'Outbound NAT rule for subnet'
 
+# Route and NAT changes sent to the firewall concurrently (default of --jobs),
+# at most the connection pool size of FirewallClient
+FW_JOBS     = 4
+FW_JOBS_MAX = 16
+
+# Upper bound for the wait until route creation accepts a new gateway
+# (configd gateway list cache, see applyFirewallPlan()) and the first and
+# largest pause between two attempts
+FW_GW_WAIT_MAX   = 22
+FW_GW_PROBE_WAIT = 0.5
+FW_GW_PROBE_MAX  = 4
+
 # OPNsense API paths
 # Note: verify paths against the installed OPNsense version
 API_GW_SEARCH      = '/routing/settings/search_gateway'
 API_GW_ADD         = '/routing/settings/add_gateway'
+API_GW_SET         = '/routing/settings/set_gateway/'
 API_GW_DEL         = '/routing/settings/del_gateway/'
 API_GW_RECONFIGURE = '/routing/settings/reconfigure'
 API_RT_SEARCH      = '/routes/routes/searchroute'
@@ -149,53 +181,64 @@ def readSubnetsCSV(ipnet_setup):
 # DHCP configuration                                                           #
 # --------------------------------------------------------------------------- #
 
-def writeDhcpConfig(subnets, serverip):
-    """Write /etc/dhcp/subnets.conf from the subnet list.
+def writeDhcpConfig(subnets, serverip, backend=None):
+    """Write the subnet configuration of the DHCP backend from the subnet list.
 
-    Output format follows the specification in import_subnets.md (no indentation).
+    isc: /etc/dhcp/subnets.conf, output format follows the specification in
+    import_subnets.md (no indentation). kea: /etc/kea/subnets.json.
+    The file is only written if the rendered configuration differs from it.
+    Before writing, the DHCPPENDING marker is created; main() removes it
+    once the service was restarted successfully. An unchanged file still
+    counts as changed while the marker exists.
 
     Returns:
-        True on success, False on error.
+        'changed' or 'unchanged', False on error.
     """
+    if backend is None:
+        backend = getDhcpBackend()
     printScript('Writing DHCP configuration:')
+    for s in subnets:
+        printScript('* ' + s['ipnet'])
+    content = backend.renderSubnets(subnets, serverip)
+    rc, current = readTextfile(backend.subnetsconf)
+    if rc and current == content:
+        if not os.path.isfile(DHCPPENDING):
+            printScript(f'* {backend.subnetsconf} unchanged.')
+            return 'unchanged'
+        printScript(f'* {backend.subnetsconf} unchanged, but not yet activated.')
+        return 'changed'
     try:
-        with open(environment.DHCPSUBCONF, 'w') as f:
-            for s in subnets:
-                printScript('* ' + s['ipnet'])
-                f.write('# Subnet ' + s['ipnet'] + '\n')
-                f.write('subnet ' + s['network'] + ' netmask ' + s['netmask'] + ' {\n')
-                f.write('option routers ' + s['router'] + ';\n')
-                f.write('option subnet-mask ' + s['netmask'] + ';\n')
-                f.write('option broadcast-address ' + s['broadcast'] + ';\n')
-                if s['nameserver']:
-                    f.write('option domain-name-servers ' + s['nameserver'] + ';\n')
-                else:
-                    f.write('option netbios-name-servers ' + serverip + ';\n')
-                if s['nextserver']:
-                    f.write('next-server ' + s['nextserver'] + ';\n')
-                if s['range1']:
-                    f.write('range ' + s['range1'] + ' ' + s['range2'] + ';\n')
-                f.write('option host-name pxeclient;\n')
-                f.write('}\n')
-        return True
+        os.makedirs(os.path.dirname(DHCPPENDING), exist_ok=True)
+        open(DHCPPENDING, 'w').close()
+        with open(backend.subnetsconf, 'w') as f:
+            f.write(content)
+        return 'changed'
     except Exception as e:
-        printScript(f'* Failed to write {environment.DHCPSUBCONF}: {e}')
+        printScript(f'* Failed to write {backend.subnetsconf}: {e}')
         return False
 
 
-def restartDhcp():
-    """Restart isc-dhcp-server and verify it is running.
+def restartDhcp(backend=None):
+    """Restart isc-dhcp-server and verify it is running, or let kea-dhcp4
+    reload its configuration.
 
     Returns:
         True if the service is active, False otherwise.
     """
-    service = 'isc-dhcp-server'
-    msg = 'Restarting ' + service + ' '
-    printScript(msg, '', False, False, True)
-    subprocess.call('service ' + service + ' stop', shell=True)
-    subprocess.call('service ' + service + ' start', shell=True)
-    time.sleep(1)
-    rc = subprocess.call('systemctl is-active --quiet ' + service, shell=True)
+    if backend is None:
+        backend = getDhcpBackend()
+    service = backend.service
+    if not backend.restarts:
+        msg = 'Reloading ' + service + ' '
+        printScript(msg, '', False, False, True)
+        rc = 0 if backend.reload() else 1
+    else:
+        msg = 'Restarting ' + service + ' '
+        printScript(msg, '', False, False, True)
+        subprocess.call('service ' + service + ' stop', shell=True)
+        subprocess.call('service ' + service + ' start', shell=True)
+        time.sleep(1)
+        rc = subprocess.call('systemctl is-active --quiet ' + service, shell=True)
     if rc == 0:
         printScript(' OK!', '', True, True, False, len(msg))
     else:
@@ -207,30 +250,93 @@ def restartDhcp():
 # Netplan                                                                      #
 # --------------------------------------------------------------------------- #
 
+def getKernelRoutes(iface):
+    """Return the static gateway routes of iface from the kernel routing table.
+
+    Reads 'ip -j -4 route show dev <iface> proto static', i.e. the routes
+    systemd-networkd installed from netplan or applyRouteChanges() added.
+
+    Returns:
+        Set of (to, via) tuples, to is 'default' or a network in CIDR
+        notation like in netplan; None if the table cannot be read
+    """
+    try:
+        proc = subprocess.run(['ip', '-j', '-4', 'route', 'show', 'dev', iface, 'proto', 'static'],
+                              capture_output=True, text=True)
+        entries = json.loads(proc.stdout or '[]') if proc.returncode == 0 else None
+    except (OSError, ValueError):
+        entries = None
+    if entries is None:
+        return None
+    routes = set()
+    for entry in entries:
+        if not entry.get('gateway'):
+            continue
+        to = entry.get('dst', '')
+        if to != 'default' and '/' not in to:
+            to += '/32'
+        routes.add((to, entry['gateway']))
+    return routes
+
+
+def planRouteChanges(iface, current, desired):
+    """Return the 'ip -batch' commands turning the current into the desired routes.
+
+    Routes to add or to move to another gateway are replaced first, so a
+    destination is never unreachable in between, then obsolete routes are
+    deleted.
+
+    Args:
+        iface: Interface of the routes
+        current: Set of (to, via) as returned by getKernelRoutes()
+        desired: Set of (to, via)
+    """
+    targets = set(to for to, via in desired)
+    commands = [f'route replace {to} via {via} dev {iface} proto static'
+                for to, via in sorted(desired - current)]
+    commands += [f'route del {to} via {via} dev {iface}'
+                 for to, via in sorted(current - desired) if to not in targets]
+    return commands
+
+
+def applyRouteChanges(commands):
+    """Send route commands to the kernel in one 'ip -batch' call, returns True on success."""
+    try:
+        proc = subprocess.run(['ip', '-batch', '-'], input='\n'.join(commands) + '\n',
+                              capture_output=True, text=True)
+    except OSError as error:
+        printScript(f'* ip -batch failed: {error}')
+        return False
+    if proc.returncode != 0:
+        printScript('* ip -batch failed: ' + proc.stderr.strip())
+        return False
+    return True
+
+
 def updateNetplan(extra_subnets, gateway, servernet_router):
-    """Update static routes in /etc/netplan/01-netcfg.yaml.
+    """Update static routes in /etc/netplan/01-netcfg.yaml and the kernel.
 
     - Sets the default route via gateway
     - Adds one route per extra subnet via servernet_router, provided that
       servernet_router != gateway (i.e. a L3 switch is present)
-    - Creates a timestamped backup before any change; rolls back automatically
-      if 'netplan apply' fails
+    - Creates a timestamped backup before any change of the file
+    - Compares the routes with the kernel routing table and sends only the
+      route additions and removals in one 'ip -batch' call (see
+      planRouteChanges()); 'netplan generate' keeps the networkd
+      configuration in line with the file for reboots. The interface
+      configuration is not reloaded, so its other traffic is not disturbed.
+    - Falls back to 'netplan apply' if the kernel routes cannot be read or
+      changed; rolls back the file automatically if 'netplan apply' fails
+    - Leaves file and network alone if both are up to date
 
     Returns:
-        True on success, False on error.
+        'changed' or 'unchanged', False on error.
     """
     printScript('Updating netplan configuration:')
     cfgfile = environment.NETCFG
-    timestamp = (str(datetime.datetime.now())
-                 .replace('-', '').replace(' ', '').replace(':', '')
-                 .split('.')[0])
-    bakfile = cfgfile + '-' + timestamp
-    if subprocess.call(['cp', cfgfile, bakfile]) != 0:
-        printScript('* Failed to back up ' + cfgfile + '!')
-        return False
-
     with open(cfgfile) as f:
-        netcfg = yaml.safe_load(f)
+        current = yaml.safe_load(f)
+    netcfg = copy.deepcopy(current)
 
     iface = list(netcfg['network']['ethernets'].keys())[0]
     ifcfg = netcfg['network']['ethernets'][iface]
@@ -240,30 +346,55 @@ def updateNetplan(extra_subnets, gateway, servernet_router):
         del ifcfg['gateway4']
         printScript('* Removed deprecated gateway4 entry.')
 
-    # remove existing routes
-    if 'routes' in ifcfg:
-        del ifcfg['routes']
-        printScript('* Removed old routes.')
-
-    # set default route
+    # replace existing routes: default route via gateway, subnet routes if
+    # servernet_router differs from gateway
     ifcfg['routes'] = [{'to': 'default', 'via': gateway}]
-
-    # add subnet routes if servernet_router differs from gateway
     if extra_subnets and servernet_router != gateway:
         for s in extra_subnets:
             ifcfg['routes'].append({'to': s['ipnet'], 'via': servernet_router})
-        printScript('* Added routes for all extra subnets.')
-
-    with open(cfgfile, 'w') as f:
-        f.write(yaml.dump(netcfg, default_flow_style=False))
-
+        printScript(f'* {len(extra_subnets)} route(s) for extra subnets.')
+
+    # interface name in the kernel, renamed via set-name if given
+    device = ifcfg.get('set-name', iface)
+    kernel_routes = getKernelRoutes(device)
+    commands = None
+    if kernel_routes is not None:
+        commands = planRouteChanges(device, kernel_routes,
+                                    set((route['to'], route['via']) for route in ifcfg['routes']))
+
+    if netcfg == current:
+        if commands == []:
+            printScript('* ' + cfgfile + ' and kernel routes unchanged.')
+            return 'unchanged'
+        bakfile = None
+    else:
+        timestamp = (str(datetime.datetime.now())
+                     .replace('-', '').replace(' ', '').replace(':', '')
+                     .split('.')[0])
+        bakfile = cfgfile + '-' + timestamp
+        if subprocess.call(['cp', cfgfile, bakfile]) != 0:
+            printScript('* Failed to back up ' + cfgfile + '!')
+            return False
+        with open(cfgfile, 'w') as f:
+            f.write(yaml.dump(netcfg, default_flow_style=False))
+        printScript('* ' + cfgfile + ' written.')
+
+    if commands is not None and (not commands or applyRouteChanges(commands)):
+        for command in commands:
+            printScript('* ' + command.split(' dev ')[0])
+        subprocess.call(['netplan', 'generate'])
+        printScript(f'* {len(commands)} kernel route change(s) applied.')
+        return 'changed'
+
+    printScript('* Applying routes directly failed, running netplan apply.')
     if subprocess.call(['netplan', 'apply']) == 0:
         printScript('* New netplan configuration applied.')
-        return True
+        return 'changed'
 
-    printScript('* netplan apply failed - rolling back.')
-    subprocess.call(['cp', bakfile, cfgfile])
-    subprocess.call(['netplan', 'apply'])
+    printScript('* netplan apply failed' + (' - rolling back.' if bakfile else '.'))
+    if bakfile:
+        subprocess.call(['cp', bakfile, cfgfile])
+        subprocess.call(['netplan', 'apply'])
     return False
 
 
@@ -308,294 +439,327 @@ def checkFwVersion():
 
 
 # --------------------------------------------------------------------------- #
-# Firewall: LAN gateway (API)                                                  #
+# Firewall: plan/apply of gateway, routes and outbound NAT (API)              #
 # --------------------------------------------------------------------------- #
 
-def getFwGateway(name):
-    """Look up a firewall gateway by name via API.
-
-    Returns:
-        (uuid, gateway_dict)  if found
-        (None, None)          if not present
-        (False, None)         on API error
+# API paths, payload key and label per firewall subsystem, in apply order
+FW_SUBSYSTEMS = {
+    'gateways': {'search': API_GW_SEARCH, 'add': API_GW_ADD, 'set': API_GW_SET,
+                 'delete': API_GW_DEL, 'apply': API_GW_RECONFIGURE, 'key': 'gateway_item',
+                 'label': 'Gateway'},
+    'routes':   {'search': API_RT_SEARCH, 'add': API_RT_ADD, 'delete': API_RT_DEL,
+                 'apply': API_RT_RECONFIGURE, 'key': 'route', 'label': 'Route'},
+    'nat':      {'search': API_NAT_SEARCH, 'add': API_NAT_ADD, 'delete': API_NAT_DEL,
+                 'apply': API_NAT_APPLY, 'key': 'rule', 'label': 'NAT'},
+}
+
+
+class FirewallAction(object):
+    """A single write of a FirewallPlan.
+
+    Attributes:
+        subsystem: 'gateways', 'routes' or 'nat' (see FW_SUBSYSTEMS)
+        op: 'add', 'set' or 'delete'
+        name: Human readable name of the item, e.g. 'route 10.0.100.0/24 via LAN_GW'
+        item: Payload of add and set, None for delete
+        uuid: Item uuid for set and delete
     """
-    res = firewallApi('get', API_GW_SEARCH)
-    if res is None:
-        printScript('* API error while fetching gateways.')
-        return False, None
-    for gw in res.get('rows', []):
-        if gw.get('name') == name:
-            return gw.get('uuid'), gw
-    return None, None
 
+    SIGNS = {'add': '+', 'set': '~', 'delete': '-'}
 
-def addFwGateway(router):
-    """Create the LAN gateway on the firewall via API.
+    def __init__(self, subsystem, op, name, item=None, uuid=None):
+        self.subsystem = subsystem
+        self.op = op
+        self.name = name
+        self.item = item
+        self.uuid = uuid
 
-    The payload key must be 'gateway_item' as required by the OPNsense
-    MVC framework (addBase("gateway_item", "gateway_item")).
-
-    Returns:
-        True on success, False on error.
-    """
-    payload = json.dumps({
-        'gateway_item': {
-            'name':            LAN_GW_NAME,
-            'interface':       'lan',
-            'ipprotocol':      'inet',
-            'gateway':         router,
-            'priority':        LAN_GW_PRIORITY,
-            'descr':           LAN_GW_DESCR,
-            'monitor_disable': '1',
-        }
-    })
-    res = firewallApi('post', API_GW_ADD, payload)
-    if res and res.get('result') == 'saved':
-        printScript(f'* LAN gateway {LAN_GW_NAME} ({router}) created.')
-        return True
-    printScript(f'* Failed to create LAN gateway: {res}')
-    return False
+    def __str__(self):
+        return self.SIGNS[self.op] + ' ' + self.name
 
 
-def delFwGateway(uuid, name):
-    """Delete a firewall gateway by UUID via API.
+class FirewallPlan(object):
+    """The writes needed to bring the firewall in line with subnets.csv.
 
-    Returns:
-        True on success, False on error.
+    Attributes:
+        actions: FirewallAction list in apply order
     """
-    res = firewallApi('post', API_GW_DEL + uuid)
-    if res and res.get('result') == 'deleted':
-        printScript(f'* Gateway {name} deleted.')
-        return True
-    printScript(f'* Failed to delete gateway {name} ({uuid}): {res}')
-    return False
-
-
-def delFwRoutesByGateway(gateway_name):
-    """Delete all static routes that use a given gateway.
 
-    Used during GW_LAN migration cleanup. The routes API returns the gateway
-    field as the plain gateway name (e.g. "GW_LAN").
+    def __init__(self):
+        self.actions = []
 
-    Required to resolve the dependency before a gateway can be deleted.
-    Applies changes immediately via API_RT_RECONFIGURE.
+    def __len__(self):
+        return len(self.actions)
 
-    Returns:
-        True if all deletions succeeded, False on error.
-    """
-    res = firewallApi('get', API_RT_SEARCH)
-    if res is None:
-        printScript('* Failed to fetch routes.')
-        return False
-    ok = True
-    deleted = False
-    for route in res.get('rows', []):
-        if route.get('gateway') != gateway_name:
-            continue
-        r = firewallApi('post', API_RT_DEL + route['uuid'])
-        if r and r.get('result') == 'deleted':
-            printScript(f'* Route {route["network"]} via {gateway_name} deleted.')
-            deleted = True
-        else:
-            printScript(f'* Failed to delete route {route["network"]}.')
-            ok = False
-    if deleted:
-        firewallApi('post', API_RT_RECONFIGURE)
-    return ok
+    def add(self, subsystem, op, name, item=None, uuid=None):
+        self.actions.append(FirewallAction(subsystem, op, name, item, uuid))
 
+    def select(self, subsystem, *ops):
+        """Return the actions of a subsystem, optionally only some operations."""
+        return [action for action in self.actions
+                if action.subsystem == subsystem and (not ops or action.op in ops)]
 
-def updateFwGateway(extra_subnets, servernet_router):
-    """Create or remove the LAN gateway depending on extra subnets.
+    def printPlan(self):
+        if not self.actions:
+            printScript('* Firewall is up to date, nothing to do.')
+            return
+        for action in self.actions:
+            printScript('* ' + str(action))
+        counts = ', '.join(f'{subsystem} {len(self.select(subsystem))}'
+                           for subsystem in FW_SUBSYSTEMS if self.select(subsystem))
+        printScript(f'* {len(self.actions)} change(s): {counts}.')
 
-    Also migrates a legacy GW_LAN gateway to LAN_GW:
-    If a GW_LAN entry is found, all dependent static routes are deleted
-    first, then the gateway is replaced by LAN_GW.
 
-    - Extra subnets present: create gateway (or update IP if changed)
-    - No extra subnets:      delete gateway if present
+def readFwState(client):
+    """Read gateways, static routes and source NAT rules, one request each.
 
     Returns:
-        True  if the gateway was actually created, deleted, or replaced
-        False if the gateway was already in the desired state (no change)
-        None  on API error
-    """
-    printScript('Updating LAN gateway on firewall:')
-
-    # Migration: remove legacy GW_LAN if present
-    old_uuid, old_gw = getFwGateway(LAN_GW_NAME_OLD)
-    if old_uuid is False:
-        return None  # API error
-    if old_uuid is not None:
-        printScript(f'* Legacy gateway {LAN_GW_NAME_OLD} found - replacing.')
-        delFwRoutesByGateway(LAN_GW_NAME_OLD)
-        if not delFwGateway(old_uuid, LAN_GW_NAME_OLD):
-            return None
-
-    uuid, gw = getFwGateway(LAN_GW_NAME)
-    if uuid is False:
-        return None  # API error
-
-    if extra_subnets:
-        if uuid is None:
-            ok = addFwGateway(servernet_router)
-            return True if ok else None
-        if gw.get('gateway') != servernet_router:
-            # wrong IP: recreate
-            delFwGateway(uuid, LAN_GW_NAME)
-            ok = addFwGateway(servernet_router)
-            return True if ok else None
-        printScript('* LAN gateway already correctly configured.')
-        return False  # no change
-    else:
-        if uuid is not None:
-            delFwRoutesByGateway(LAN_GW_NAME)
-            ok = delFwGateway(uuid, LAN_GW_NAME)
-            return True if ok else None
-        printScript('* No LAN gateway present, nothing to remove.')
-        return False  # no change
+        Dict subsystem -> list of item dicts as returned by the search endpoint
 
+    Raises:
+        FirewallApiError: If a search request fails
+    """
+    return {subsystem: client.search(paths['search'])
+            for subsystem, paths in FW_SUBSYSTEMS.items()}
 
-# --------------------------------------------------------------------------- #
-# Firewall: static routes (API)                                                #
-# --------------------------------------------------------------------------- #
-
-def updateFwRoutes(extra_subnets, servernet_router):
-    """Synchronise static routes on the firewall with extra_subnets.
 
-    The routes API (/routes/routes/) validates gateways via the configd action
-    'interface gateways list' (gateways.php), which reads OPNsense\\Routing\\Gateways
-    model and returns gateway names as keys. Routes therefore reference gateways
-    by their plain name (LAN_GW_NAME), not by UUID.
+def planFirewall(state, extra_subnets, servernet_router):
+    """Compute the writes that synchronise the firewall with extra_subnets.
 
-    Note: 'interface gateways list' has a 20-second configd cache. After a new
-    gateway is created, the caller must wait for this cache to expire before
-    calling updateFwRoutes, otherwise validation will fail. This is handled in
-    main() by sleeping after a gateway change.
+    - LAN gateway: created if extra subnets exist, its address corrected in
+      place if it differs from servernet_router, deleted if there are no
+      extra subnets. A legacy GW_LAN gateway is deleted.
+    - Static routes: one per extra subnet via LAN_GW_NAME. Own routes (via
+      LAN_GW_NAME) of removed subnets and duplicates are deleted, routes via
+      a gateway that is deleted are deleted first (OPNsense refuses to
+      delete a gateway still in use) and recreated via LAN_GW_NAME. Routes
+      via foreign gateways are left untouched.
+    - Outbound NAT: one rule per extra subnet, own rules are identified by
+      the NAT_RULE_DESCR prefix of their description.
 
-    - Deletes own routes (gateway == LAN_GW_NAME) that are no longer desired
-    - Creates missing routes for new extra subnets
+    Args:
+        state: Firewall state as returned by readFwState()
+        extra_subnets: Subnets other than the server's own subnet
+        servernet_router: Router IP to use as the LAN gateway
 
     Returns:
-        True if changes were made,
-        False if no changes were needed,
-        None on API error.
+        FirewallPlan, deletions of routes before the gateway changes
     """
-    printScript('Updating static routes on firewall:')
+    plan = FirewallPlan()
+    gateways = {gw.get('name'): gw for gw in state['gateways']}
+    desired = list(dict.fromkeys(s['ipnet'] for s in extra_subnets))
+
+    # gateways: legacy name first, then LAN_GW_NAME
+    deleted = set()
+    old_gw = gateways.get(LAN_GW_NAME_OLD)
+    if old_gw is not None:
+        deleted.add(LAN_GW_NAME_OLD)
+    gw = gateways.get(LAN_GW_NAME)
+    if gw is not None and not desired:
+        deleted.add(LAN_GW_NAME)
+
+    # routes: deletions, the gateway deletions depend on them
+    existing = set()
+    for route in state['routes']:
+        network = route.get('network')
+        gateway = route.get('gateway')
+        if gateway in deleted or (gateway == LAN_GW_NAME
+                                  and (network not in desired or network in existing)):
+            plan.add('routes', 'delete', f'route {network} via {gateway}', uuid=route['uuid'])
+        else:
+            existing.add(network)
 
-    res = firewallApi('get', API_RT_SEARCH)
-    if res is None:
-        printScript('* Failed to fetch routes from firewall.')
-        return None
+    if old_gw is not None:
+        plan.add('gateways', 'delete', f'gateway {LAN_GW_NAME_OLD} ({old_gw.get("gateway")})',
+                 uuid=old_gw['uuid'])
+    if desired and gw is None:
+        plan.add('gateways', 'add', f'gateway {LAN_GW_NAME} ({servernet_router})', {
+            'name':            LAN_GW_NAME,
+            'interface':       'lan',
+            'ipprotocol':      'inet',
+            'gateway':         servernet_router,
+            'priority':        LAN_GW_PRIORITY,
+            'descr':           LAN_GW_DESCR,
+            'monitor_disable': '1',
+        })
+    elif desired and gw.get('gateway') != servernet_router:
+        plan.add('gateways', 'set',
+                 f'gateway {LAN_GW_NAME} ({gw.get("gateway")} -> {servernet_router})',
+                 {'gateway': servernet_router}, gw['uuid'])
+    elif LAN_GW_NAME in deleted:
+        plan.add('gateways', 'delete', f'gateway {LAN_GW_NAME} ({gw.get("gateway")})',
+                 uuid=gw['uuid'])
 
-    existing = {r['network']: r for r in res.get('rows', [])}
-    desired  = {s['ipnet'] for s in extra_subnets}
-    changed  = False
-
-    # delete obsolete own routes
-    for network, route in existing.items():
-        if route.get('gateway') != LAN_GW_NAME:
-            continue  # foreign route - leave untouched
-        if network not in desired:
-            res = firewallApi('post', API_RT_DEL + route['uuid'])
-            if res and res.get('result') == 'deleted':
-                printScript(f'* Route {network} deleted.')
-                changed = True
-            else:
-                printScript(f'* Failed to delete route {network}.')
-
-    # create missing routes
     for ipnet in desired:
-        if ipnet in existing:
-            continue
-        payload = json.dumps({
-            'route': {
+        if ipnet not in existing:
+            plan.add('routes', 'add', f'route {ipnet} via {LAN_GW_NAME}', {
                 'network':  ipnet,
                 'gateway':  LAN_GW_NAME,
                 'descr':    'Route for subnet ' + ipnet,
                 'disabled': '0',
-            }
-        })
-        res = firewallApi('post', API_RT_ADD, payload)
-        if res and res.get('result') == 'saved':
-            printScript(f'* Route {ipnet} created.')
-            changed = True
+            })
+
+    # outbound NAT
+    existing = set()
+    for rule in state['nat']:
+        descr = rule.get('description', '')
+        if not descr.startswith(NAT_RULE_DESCR):
+            continue
+        if descr[len(NAT_RULE_DESCR) + 1:] not in desired or descr in existing:
+            plan.add('nat', 'delete', f'NAT rule "{descr}"', uuid=rule['uuid'])
         else:
-            printScript(f'* Failed to create route {ipnet}: {res}')
+            existing.add(descr)
+    for ipnet in desired:
+        descr = NAT_RULE_DESCR + ' ' + ipnet
+        if descr not in existing:
+            plan.add('nat', 'add', f'NAT rule "{descr}"', {
+                'enabled':         '1',
+                'interface':       'wan',
+                'ipprotocol':      'inet',
+                'source_net':      ipnet,
+                'destination_net': 'any',
+                'description':     descr,
+            })
 
-    return changed
+    return plan
 
 
-# --------------------------------------------------------------------------- #
-# Firewall: outbound NAT (API)                                                 #
-# --------------------------------------------------------------------------- #
+def applyFwAction(client, action):
+    """Execute a single FirewallAction, returns True on success."""
+    paths = FW_SUBSYSTEMS[action.subsystem]
+    try:
+        if action.op == 'add':
+            client.add(paths['add'], paths['key'], action.item)
+        elif action.op == 'set':
+            client.set(paths['set'], action.uuid, paths['key'], action.item)
+        else:
+            client.delete(paths['delete'], action.uuid)
+    except FirewallApiError as error:
+        printScript(f'* Failed: {action}: {error}')
+        return False
+    printScript(f'* Done: {action}')
+    return True
+
+
+def applyFwSubsystem(client, subsystem):
+    """Activate the saved configuration of a subsystem (reconfigure/apply)."""
+    paths = FW_SUBSYSTEMS[subsystem]
+    try:
+        client.apply(paths['apply'])
+    except FirewallApiError as error:
+        printScript(f'* Failed to apply {paths["label"].lower()} configuration: {error}')
+        return False
+    printScript(f'* {paths["label"]} configuration applied.')
+    return True
 
-def updateFwNat(extra_subnets):
-    """Synchronise outbound NAT rules on the firewall with extra_subnets.
 
-    Own rules are identified by the NAT_RULE_DESCR prefix in the description.
-    - Deletes own rules whose subnet is no longer in extra_subnets
-    - Creates missing rules for new extra subnets
-    - Applies changes via API_NAT_APPLY
+def applyFwActions(client, actions, jobs=FW_JOBS):
+    """Execute independent FirewallActions, up to jobs at a time.
 
-    NAT rules are visible in the OPNsense WebUI under
-    Firewall -> Automation -> Source NAT.
+    Actions that failed are retried once, one at a time, after all others
+    completed, since concurrent writes may collide on the firewall's
+    configuration lock. Connection errors and 5xx answers of a single
+    request are already retried by FirewallClient.
 
     Returns:
-        True if changes were successfully applied,
-        False if no changes were needed or an error occurred.
+        True if every action succeeded
     """
-    printScript('Updating outbound NAT rules on firewall:')
+    results = mapWithOrderedOutput(lambda action: applyFwAction(client, action), actions, jobs)
+    failed = [action for action, ok in zip(actions, results) if not ok]
+    if not failed:
+        return True
+    printScript(f'Retrying {len(failed)} failed change(s):')
+    return all([applyFwAction(client, action) for action in failed])
 
-    res = firewallApi('get', API_NAT_SEARCH)
-    if res is None:
-        printScript('* Failed to fetch NAT rules.')
+
+def isGatewayValidation(error):
+    """Return True if a route write was refused only because of its gateway."""
+    try:
+        validations = json.loads(error.response).get('validations') or {}
+    except (ValueError, AttributeError):
         return False
+    return list(validations) == ['route.gateway']
 
-    existing = {r['description']: r for r in res.get('rows', [])
-                if r.get('description', '').startswith(NAT_RULE_DESCR)}
-    desired  = {NAT_RULE_DESCR + ' ' + s['ipnet']: s['ipnet']
-                for s in extra_subnets}
-    changed  = False
-
-    # delete obsolete own rules
-    for descr, rule in existing.items():
-        if descr not in desired:
-            res = firewallApi('post', API_NAT_DEL + rule['uuid'])
-            if res and res.get('result') == 'deleted':
-                printScript(f'* NAT rule "{descr}" deleted.')
-                changed = True
-            else:
-                printScript(f'* Failed to delete NAT rule "{descr}".')
-
-    # create missing rules
-    for descr, ipnet in desired.items():
-        if descr in existing:
-            continue
-        payload = json.dumps({
-            'rule': {
-                'enabled':         '1',
-                'interface':       'wan',
-                'ipprotocol':      'inet',
-                'source_net':      ipnet,
-                'destination_net': 'any',
-                'description':     descr,
-            }
-        })
-        res = firewallApi('post', API_NAT_ADD, payload)
-        if res and res.get('result') == 'saved':
-            printScript(f'* NAT rule for {ipnet} created.')
-            changed = True
-        else:
-            printScript(f'* Failed to create NAT rule for {ipnet}.')
 
-    if changed:
-        res = firewallApi('post', API_NAT_APPLY)
-        if res:
-            printScript('* NAT configuration applied.')
-        else:
-            printScript('* Failed to apply NAT configuration.')
+def addFirstRoute(client, action, timeout=FW_GW_WAIT_MAX):
+    """Add the first route after a gateway change, waiting until it is accepted.
+
+    The route validation of OPNsense checks the gateway against the cached
+    gateway list of configd, so a new gateway is refused until the cache
+    expired. The route addition itself is the probe: while it is refused
+    only because of its gateway, it is repeated with growing pauses
+    (FW_GW_PROBE_WAIT doubled up to FW_GW_PROBE_MAX seconds) until timeout
+    seconds passed. Any other error ends the wait at once.
+
+    Returns:
+        True if the route was added
+    """
+    paths = FW_SUBSYSTEMS[action.subsystem]
+    start = time.monotonic()
+    wait = FW_GW_PROBE_WAIT
+    while True:
+        try:
+            client.add(paths['add'], paths['key'], action.item)
+            break
+        except FirewallApiError as error:
+            elapsed = time.monotonic() - start
+            if not isGatewayValidation(error) or elapsed + wait > timeout:
+                printScript(f'* Failed: {action}: {error}')
+                return False
+        if wait == FW_GW_PROBE_WAIT:
+            printScript('Waiting for the firewall to accept the gateway...')
+        time.sleep(wait)
+        wait = min(wait * 2, FW_GW_PROBE_MAX)
+    if wait > FW_GW_PROBE_WAIT:
+        printScript(f'* Gateway accepted after {time.monotonic() - start:.1f}s.')
+    printScript(f'* Done: {action}')
+    return True
+
+
+def applyFirewallPlan(plan, client, jobs=FW_JOBS):
+    """Apply a FirewallPlan with one reconfigure/apply per changed subsystem.
+
+    Order: route deletions, gateway changes and their reconfigure, route
+    additions and the routes reconfigure, NAT changes and the NAT apply.
+    Route deletions are saved before the gateway changes, which satisfies
+    the dependency check of the gateway deletion. Route deletions, route
+    additions and NAT changes are each independent of one another and are
+    sent jobs at a time (see applyFwActions()); a reconfigure/apply is only
+    sent after all changes before it completed.
+
+    The configd 'interface gateways list' action has a 20-second cache
+    (cache_ttl:20 in actions_interface.conf) and route creation validates
+    against this cached list. After a gateway was created or changed the
+    first route addition is therefore repeated until the firewall accepts
+    it, at most FW_GW_WAIT_MAX seconds (see addFirstRoute()), and the
+    others follow.
 
-    return changed
+    Returns:
+        True if all writes succeeded, False if a route or NAT write failed,
+        None if a gateway write failed (routes and NAT are skipped then)
+    """
+    ok = applyFwActions(client, plan.select('routes', 'delete'), jobs)
+
+    gw_actions = plan.select('gateways')
+    for action in gw_actions:
+        if not applyFwAction(client, action):
+            printScript('Gateway update failed - skipping routes and NAT.')
+            return None
+    if gw_actions:
+        applyFwSubsystem(client, 'gateways')
+
+    route_adds = plan.select('routes', 'add')
+    if route_adds and plan.select('gateways', 'add', 'set'):
+        ok = addFirstRoute(client, route_adds[0]) and ok
+        route_adds = route_adds[1:]
+    ok = applyFwActions(client, route_adds, jobs) and ok
+    if plan.select('routes'):
+        ok = applyFwSubsystem(client, 'routes') and ok
+
+    ok = applyFwActions(client, plan.select('nat'), jobs) and ok
+    if plan.select('nat'):
+        ok = applyFwSubsystem(client, 'nat') and ok
+    return ok
 
 
 # --------------------------------------------------------------------------- #
@@ -641,49 +805,91 @@ def partitionSubnets(subnets, firewallip):
     return server_subnet, extra_subnets, servernet_router
 
 
-def updateFirewall(extra_subnets, servernet_router, skipfw):
-    """Update the firewall (LAN gateway, static routes, outbound NAT) via API.
+def updateFirewall(extra_subnets, servernet_router, skipfw, apply=True, jobs=FW_JOBS):
+    """Synchronise LAN gateway, static routes and outbound NAT via API.
 
-    Skipped entirely when skipfw is set. Exits the process with status 1 if
-    the gateway update fails, since routes and NAT depend on a working
-    gateway.
+    Reads the firewall state once, prints the FirewallPlan and, with
+    apply, applies it. Skipped entirely when skipfw is set. Exits the
+    process with status 1 if the state cannot be read or a gateway write
+    fails, since routes and NAT depend on a working gateway.
 
     Args:
         extra_subnets: Subnets other than the server's own subnet
         servernet_router: Router IP to use as the LAN gateway
         skipfw: If truthy, skip all firewall updates
+        apply: If False only print the plan (--plan)
+        jobs: Route and NAT changes sent concurrently
+
+    Returns:
+        Tuple (plan, ok): the FirewallPlan, None if skipped, and False if a
+        route or NAT write or a reconfigure/apply failed (see
+        applyFirewallPlan()), True otherwise
     """
     if skipfw:
         printScript('Skipping firewall updates (skipfw=True).')
-        return
+        return None, True
 
-    gw_changed = updateFwGateway(extra_subnets, servernet_router)
-    if gw_changed is None:
-        printScript('Gateway update failed - skipping routes and NAT.')
+    printScript('Reading firewall gateways, routes and NAT rules:')
+    client = getFirewallClient()
+    try:
+        state = readFwState(client)
+    except FirewallApiError as error:
+        printScript(f'* API error: {error}')
         printScript('', 'end')
         sys.exit(1)
-    if gw_changed:
-        res = firewallApi('post', API_GW_RECONFIGURE)
-        if res:
-            printScript('New gateway applied.')
-        else:
-            printScript('Failed to apply gateway configuration.')
-        # The configd 'interface gateways list' action has a 20-second
-        # cache (cache_ttl:20 in actions_interface.conf). Route creation
-        # validates against this cached list. Wait for the cache to expire
-        # so the newly created gateway is visible to route validation.
-        printScript('Waiting for gateway cache to expire...')
-        time.sleep(22)
-
-    rt_changed = updateFwRoutes(extra_subnets, servernet_router)
-    if rt_changed:
-        res = firewallApi('post', API_RT_RECONFIGURE)
-        if res:
-            printScript('New routes applied.')
-        else:
-            printScript('Failed to apply route configuration.')
+    printScript(f'* {len(state["gateways"])} gateway(s), {len(state["routes"])} route(s), '
+                f'{len(state["nat"])} NAT rule(s).')
+
+    plan = planFirewall(state, extra_subnets, servernet_router)
+    printScript('Firewall changes' + ('' if apply else ' (not applied)') + ':')
+    plan.printPlan()
+    if not apply or not plan:
+        return plan, True
+    ok = applyFirewallPlan(plan, client, jobs)
+    if ok is None:
+        printScript('', 'end')
+        sys.exit(1)
+    return plan, ok
+
 
-    updateFwNat(extra_subnets)
+def usage():
+    print('Usage: linuxmuster-import-subnets [options]')
+    print(' [options] may be:')
+    print(' --plan            : Only print the firewall changes, change nothing.')
+    print(' --apply           : Import the subnets and apply the firewall changes (default).')
+    print(' -j <n>, --jobs=<n>: Send up to <n> route/NAT changes concurrently (default: '
+          + str(FW_JOBS) + ', max: ' + str(FW_JOBS_MAX) + ').')
+
+
+def parseArguments():
+    """Parse command-line arguments.
+
+    Returns:
+        Dict with keys: apply (False with --plan), jobs
+    """
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "j:", ["plan", "apply", "jobs="])
+    except getopt.GetoptError as err:
+        print(err)
+        usage()
+        sys.exit(2)
+    options = [o for o, a in opts]
+    if '--plan' in options and '--apply' in options:
+        print('Options --plan and --apply are mutually exclusive.')
+        usage()
+        sys.exit(2)
+    values = {'apply': '--plan' not in options, 'jobs': FW_JOBS}
+    for o, a in opts:
+        if o in ("-j", "--jobs"):
+            try:
+                values['jobs'] = int(a)
+            except ValueError:
+                values['jobs'] = 0
+            if not 1 <= values['jobs'] <= FW_JOBS_MAX:
+                print('Invalid number of jobs: ' + a)
+                usage()
+                sys.exit(2)
+    return values
 
 
 def main():
@@ -692,15 +898,21 @@ def main():
     1. Read setup values (server IP, network, firewall IP)
     2. Check firewall version (>= 26.1 required; skipped if skipfw)
     3. Parse subnets.csv - every skipped row is logged
-    4. Write /etc/dhcp/subnets.conf
-    5. Restart isc-dhcp-server
-    6. Update netplan routes
-    7. Call linuxmuster-update-ntpconf
-    8. Update firewall (only if skipfw is not set):
-       - Create/remove LAN gateway via API
-       - Synchronise static routes via API
-       - Synchronise outbound NAT rules via API
+    4. Write /etc/dhcp/subnets.conf (kea: /etc/kea/subnets.json)
+    5. Restart isc-dhcp-server (kea: config-reload), only if 4. changed it
+    6. Update netplan routes, send only the route changes to the kernel
+    7. Update the ntpsec configuration, restart only on changes
+       (see update_ntpconf.updateNtpConf())
+    8. Update firewall (only if skipfw is not set): read gateways, routes
+       and outbound NAT rules, plan and apply the changes (see
+       planFirewall() and applyFirewallPlan())
+    9. Print whether each configuration changed; exit with status 1 if
+       any of them failed
+
+    With --plan steps 4-7 and 9 are skipped and the firewall changes are
+    only printed.
     """
+    args = parseArguments()
     setup = readSetupValues()
 
     printScript('linuxmuster-import-subnets')
@@ -730,20 +942,48 @@ def main():
     printScript(f'* {len(subnets)} subnet(s) total, '
                 f'{len(extra_subnets)} extra subnet(s).')
 
+    if not args['apply']:
+        updateFirewall(extra_subnets, servernet_router, setup['skipfw'], apply=False)
+        printScript('', 'end')
+        return
+
     # Write DHCP configuration
-    if not writeDhcpConfig(subnets, setup['serverip']):
+    try:
+        backend = getDhcpBackend()
+    except ValueError as e:
+        printScript('* ' + str(e))
+        printScript('', 'end')
+        sys.exit(1)
+    results = {}
+    results['DHCP'] = writeDhcpConfig(subnets, setup['serverip'], backend)
+    if not results['DHCP']:
         printScript('', 'end')
         sys.exit(1)
 
-    restartDhcp()
-    updateNetplan(extra_subnets, setup['gateway'], servernet_router)
-
-    printScript('Updating NTP configuration:')
-    subprocess.call(['linuxmuster-update-ntpconf'])
-
-    updateFirewall(extra_subnets, servernet_router, setup['skipfw'])
+    if results['DHCP'] == 'changed':
+        if restartDhcp(backend):
+            os.remove(DHCPPENDING)
+        else:
+            results['DHCP'] = 'failed'
+    else:
+        printScript('DHCP configuration unchanged, skipping ' + backend.service + ' restart.')
+    results['netplan'] = updateNetplan(extra_subnets, setup['gateway'], servernet_router) or 'failed'
+    results['NTP'] = updateNtpConf() or 'failed'
+
+    plan, ok = updateFirewall(extra_subnets, servernet_router, setup['skipfw'], jobs=args['jobs'])
+    if plan is None:
+        results['firewall'] = 'skipped'
+    elif not ok:
+        results['firewall'] = 'failed'
+    else:
+        results['firewall'] = 'changed' if plan else 'unchanged'
 
+    printScript('Summary:')
+    for name, result in results.items():
+        printScript(f'* {name}: {result}')
     printScript('', 'end')
+    if 'failed' in results.values():
+        sys.exit(1)
 
 
 if __name__ == '__main__':
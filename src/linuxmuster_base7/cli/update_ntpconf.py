@@ -2,11 +2,12 @@
 #
 # linuxmuster-update-ntpconf
 # thomas@linuxmuster.net
-# 20251113
+# 20261017
 #
 
 import datetime
 import environment
+import os
 import shutil
 import subprocess
 import sys
@@ -14,27 +15,27 @@ import sys
 from linuxmuster_base7.functions import getSetupValue, getSubnetArray, isValidHostIpv4, \
     printScript, readTextfile, writeTextfile
 
+# Exists while the written configuration has not been activated by a
+# successful ntpsec restart, so a run after a failed restart retries it
+NTPPENDING = os.path.dirname(environment.SETUPINI) + '/update-ntpconf.pending'
 
-def main():
-    """Update ntpsec configuration with current network settings."""
-    printScript('Updating ntpsec configuration:')
 
-    # read necessary values from setup.ini and other sources
+def renderNtpConf():
+    """Render the ntpsec configuration from the template.
+
+    Returns:
+        Tuple (cfgfile, content), cfgfile is taken from the template's first
+        line; None if the template cannot be read
+    """
     firewallip = getSetupValue('firewallip')
-    timestamp = str(datetime.datetime.now()).replace('-', '').replace(' ', '').replace(':', '').split('.')[0]
 
     # read template
     cfgtemplate = environment.TPLDIR + '/ntp.conf'
     rc, content = readTextfile(cfgtemplate)
+    if not rc:
+        printScript('* Cannot read ' + cfgtemplate + '!')
+        return None
     cfgfile = content.split('\n')[0].replace('# ', '')
-    # create backup of current configuration
-    bakfile = cfgfile + '-' + timestamp
-    printScript('* Creating backup ' + bakfile + '.')
-    try:
-        shutil.copy2(cfgfile, bakfile)
-    except Exception as e:
-        printScript('* Failed to backup ' + cfgfile + ': ' + str(e))
-        sys.exit(1)
 
     # get subnets
     printScript('* Processing subnets')
@@ -57,13 +58,77 @@ def main():
             restricted_subnets = restricted_subnets + '\nrestrict ' + subnet
     # replace placeholders with values
     content = content.replace('@@firewallip@@', firewallip).replace('@@restricted_subnets@@', restricted_subnets).replace('@@ntpsockdir@@', environment.NTPSOCKDIR)
+    return cfgfile, content
+
+
+def updateNtpConf():
+    """Update ntpsec configuration with current network settings.
+
+    The configuration is rendered in memory; backup, write and the restart
+    of ntpsec only happen if it differs from the deployed file, or if the
+    restart after the last change failed (NTPPENDING exists).
+
+    Returns:
+        'changed' or 'unchanged', False if the template cannot be read, the
+        backup or the restart failed
+    """
+    printScript('Updating ntpsec configuration:')
+    rendered = renderNtpConf()
+    if rendered is None:
+        return False
+    cfgfile, content = rendered
+
+    rc, current = readTextfile(cfgfile)
+    if rc and current == content:
+        if not os.path.isfile(NTPPENDING):
+            printScript('* ' + cfgfile + ' unchanged, skipping ntpsec restart.')
+            return 'unchanged'
+        printScript('* ' + cfgfile + ' unchanged, but not yet activated.')
+        return restartNtp()
+
+    # create backup of current configuration
+    if rc:
+        timestamp = str(datetime.datetime.now()).replace('-', '').replace(' ', '').replace(':', '').split('.')[0]
+        bakfile = cfgfile + '-' + timestamp
+        printScript('* Creating backup ' + bakfile + '.')
+        try:
+            shutil.copy2(cfgfile, bakfile)
+        except Exception as e:
+            printScript('* Failed to backup ' + cfgfile + ': ' + str(e))
+            return False
+
     # write content to cfgfile
+    try:
+        os.makedirs(os.path.dirname(NTPPENDING), exist_ok=True)
+        open(NTPPENDING, 'w').close()
+    except OSError as e:
+        printScript('* Failed to create ' + NTPPENDING + ': ' + str(e))
+        return False
     printScript('* Writing ' + cfgfile + '.')
-    writeTextfile(cfgfile, content, 'w')
+    if not writeTextfile(cfgfile, content, 'w'):
+        printScript('* Failed to write ' + cfgfile + '.')
+        return False
+    return restartNtp()
+
 
-    # restart ntp service
+def restartNtp():
+    """Restart ntpsec, returns 'changed' on success and False otherwise."""
     printScript('* Restarting ntpsec service.')
-    subprocess.run(['systemctl', 'restart', 'ntpsec.service'], check=False)
+    proc = subprocess.run(['systemctl', 'restart', 'ntpsec.service'], check=False)
+    if proc.returncode != 0:
+        printScript('* Failed to restart ntpsec service.')
+        return False
+    try:
+        os.remove(NTPPENDING)
+    except OSError as e:
+        printScript('* Failed to remove ' + NTPPENDING + ': ' + str(e))
+    return 'changed'
+
+
+def main():
+    """Update ntpsec configuration with current network settings."""
+    if not updateNtpConf():
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -5,61 +5,81 @@
 #                preserves "from linuxmuster_base7.functions import X" for
 #                every name that used to live in the single functions.py
 #                file, now split into cohesive submodules (see issue #129):
-#                core, files, network, samba, linbo, certs, remote, security.
+#                core, files, network, samba, linbo, certs, remote, security,
+#                omapi, dhcp.
 # Signed-off by: thomas@linuxmuster.net
 # Assisted by  : Claude
-# Date         : 20260818
+# Date         : 20261017
 #
 
 import datetime  # re-exported: some callers do "from ...functions import datetime"
 
-from .core import tee, printLf, printScript, getSetupValue, mySetupLogfile, \
-    dtStr, setupComment
-from .files import readTextfile, writeTextfile, writeSecretFile, \
-    replaceInFile, modIni, catFiles, backupCfg
-from .network import ipMatchSubnet, getIpSubnet, getIpBcAddress, \
-    getSubnetArray, readDevicesCsv, validateDeviceRow, filterDevices, \
-    transformDeviceRow, getDevicesArray, isValidMac, isValidHostname, \
-    isValidDomainname, isValidHostIpv4, getHostname, detectedInterfaces, \
-    getDefaultIface, checkSocket
+from .core import tee, ThreadOutput, mapWithOrderedOutput, printLf, printScript, \
+    getSetupValue, mySetupLogfile, dtStr, setupComment
+from .files import getFileStamp, readTextfile, writeTextfile, writeTextfileAtomic, \
+    writeSecretFile, replaceInFile, modIni, catFiles, backupCfg
+from .network import SubnetTable, getSubnetTable, ipMatchSubnet, \
+    getIpSubnet, getIpBcAddress, getSubnetArray, getDevicesCsvPath, \
+    readDevicesCsv, DEVICE_COLUMNS, Device, validateDeviceRow, \
+    filterDevices, getFieldProjection, transformDeviceRow, DeviceIndex, \
+    getDeviceIndex, iterSelectedDevices, iterDevicesCsv, getDevicesArray, DeviceCsvIssue, \
+    checkDevicesCsv, isValidMac, \
+    isValidHostname, isValidDomainname, isValidHostIpv4, getHostname, \
+    detectedInterfaces, getDefaultIface, checkSocket
 from .samba import getBaseDN, adSearch, isDynamicIpDevice, sambaTool
-from .linbo import getGrubPart, getGrubOstype, readStartconf, \
-    getStartconfOption, getStartconfPartlabel, getStartconfPartnr, \
-    setGlobalStartconfOption, getStartconfOsValues, getLinboVersion
+from .linbo import getGrubPart, getGrubOstype, readStartconf, StartConf, \
+    getStartConf, GrubTemplate, getGrubTemplate, getStartconfOption, \
+    getStartconfPartlabel, getStartconfPartnr, setGlobalStartconfOption, \
+    getStartconfOsValues, getLinboVersion
 from .certs import encodeCertToBase64, renewCaCertificate, \
     signCertificateWithCa, createCertificateChain, createCnfFromTemplate, \
     createServerCert
-from .remote import waitForFw, firewallApi, checkFwMajorVer, scpTransfer, \
+from .remote import waitForFw, FirewallApiError, FirewallClient, \
+    getFirewallClient, firewallApi, checkFwMajorVer, scpTransfer, \
     getSftp, getFwConfig, putSftp, putFwConfig, sshExec
 from .security import hasNumbers, randomPassword, isValidPassword, \
     enterPassword
+from .omapi import OmapiError, OmapiMessage, OmapiClient
+from .dhcp import buildDhcpHostDeclaration, DhcpBackend, IscDhcpBackend, \
+    KeaDhcpBackend, keaCommand, getDhcpBackend
 
 __all__ = [
     'datetime',
     # core
-    'tee', 'printLf', 'printScript', 'getSetupValue', 'mySetupLogfile',
-    'dtStr', 'setupComment',
+    'tee', 'ThreadOutput', 'mapWithOrderedOutput', 'printLf', 'printScript',
+    'getSetupValue', 'mySetupLogfile', 'dtStr', 'setupComment',
     # files
-    'readTextfile', 'writeTextfile', 'writeSecretFile', 'replaceInFile',
+    'getFileStamp', 'readTextfile', 'writeTextfile', 'writeTextfileAtomic', 'writeSecretFile', 'replaceInFile',
     'modIni', 'catFiles', 'backupCfg',
     # network
-    'ipMatchSubnet', 'getIpSubnet', 'getIpBcAddress', 'getSubnetArray',
-    'readDevicesCsv', 'validateDeviceRow', 'filterDevices',
-    'transformDeviceRow', 'getDevicesArray', 'isValidMac', 'isValidHostname',
+    'SubnetTable', 'getSubnetTable', 'ipMatchSubnet', 'getIpSubnet',
+    'getIpBcAddress', 'getSubnetArray',
+    'getDevicesCsvPath', 'readDevicesCsv', 'DEVICE_COLUMNS', 'Device',
+    'validateDeviceRow', 'filterDevices', 'getFieldProjection',
+    'transformDeviceRow', 'DeviceIndex', 'getDeviceIndex', 'iterSelectedDevices',
+    'iterDevicesCsv', 'getDevicesArray', 'DeviceCsvIssue', 'checkDevicesCsv', 'isValidMac',
+    'isValidHostname',
     'isValidDomainname', 'isValidHostIpv4', 'getHostname',
     'detectedInterfaces', 'getDefaultIface', 'checkSocket',
     # samba
     'getBaseDN', 'adSearch', 'isDynamicIpDevice', 'sambaTool',
     # linbo
-    'getGrubPart', 'getGrubOstype', 'readStartconf', 'getStartconfOption',
+    'getGrubPart', 'getGrubOstype', 'readStartconf', 'StartConf',
+    'getStartConf', 'GrubTemplate', 'getGrubTemplate', 'getStartconfOption',
     'getStartconfPartlabel', 'getStartconfPartnr', 'setGlobalStartconfOption',
     'getStartconfOsValues', 'getLinboVersion',
     # certs
     'encodeCertToBase64', 'renewCaCertificate', 'signCertificateWithCa',
     'createCertificateChain', 'createCnfFromTemplate', 'createServerCert',
     # remote
-    'waitForFw', 'firewallApi', 'checkFwMajorVer', 'scpTransfer', 'getSftp',
+    'waitForFw', 'FirewallApiError', 'FirewallClient', 'getFirewallClient',
+    'firewallApi', 'checkFwMajorVer', 'scpTransfer', 'getSftp',
     'getFwConfig', 'putSftp', 'putFwConfig', 'sshExec',
     # security
     'hasNumbers', 'randomPassword', 'isValidPassword', 'enterPassword',
+    # omapi
+    'OmapiError', 'OmapiMessage', 'OmapiClient',
+    # dhcp
+    'buildDhcpHostDeclaration', 'DhcpBackend', 'IscDhcpBackend',
+    'KeaDhcpBackend', 'keaCommand', 'getDhcpBackend',
 ]
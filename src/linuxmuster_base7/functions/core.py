@@ -5,16 +5,20 @@
 #                by all other functions submodules
 # Signed-off by: thomas@linuxmuster.net
 # Assisted by  : Claude
-# Date         : 20260818
+# Date         : 20261017
 #
 
 import configparser
 import datetime
+import io
 import os
 import sys
+import threading
 sys.path.insert(0, '/usr/lib/linuxmuster')
 import environment
 
+from concurrent.futures import ThreadPoolExecutor
+
 
 # append stdout to logfile
 class tee(object):
@@ -32,6 +36,78 @@ class tee(object):
             f.flush()
 
 
+# collect console output per worker thread
+class ThreadOutput(object):
+    """sys.stdout stand-in buffering the output of threads that asked for it.
+
+    Threads that called start() write into their own buffer until stop();
+    all other writes go straight to the wrapped stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def start(self):
+        self.local.buffer = io.StringIO()
+
+    def stop(self):
+        text = self.local.buffer.getvalue()
+        self.local.buffer = None
+        return text
+
+    def write(self, obj):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(obj)
+        return buffer.write(obj)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+
+def mapWithOrderedOutput(func, items, jobs=1):
+    """Call func for every item, optionally in parallel, keeping output in order.
+
+    With jobs > 1 the items are processed by a pool of worker threads.
+    The console output of each call is collected and printed in the
+    order of items.
+
+    Args:
+        func: Function called with a single item
+        items: List of items
+        jobs: Number of items processed concurrently
+
+    Returns:
+        List of the return values of func, in the order of items
+    """
+    if jobs <= 1 or len(items) < 2:
+        return [func(item) for item in items]
+
+    output = ThreadOutput(sys.stdout)
+
+    def worker(item):
+        output.start()
+        try:
+            rc = func(item)
+        finally:
+            text = output.stop()
+        return rc, text
+
+    results = []
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            for rc, text in pool.map(worker, items):
+                output.stream.write(text)
+                output.stream.flush()
+                results.append(rc)
+    finally:
+        sys.stdout = output.stream
+    return results
+
+
 # print with or without linefeed
 def printLf(msg, lf):
     if lf:
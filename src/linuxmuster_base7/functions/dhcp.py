@@ -0,0 +1,384 @@
+#!/usr/bin/python3
+#
+# Filename     : dhcp.py
+# Description  : DHCP server output backends (ISC dhcpd and Kea DHCPv4) used
+#                by linuxmuster-import-devices and linuxmuster-import-subnets
+# Signed-off by: thomas@linuxmuster.net
+# Assisted by  : Claude
+# Date         : 20261017
+#
+
+import abc
+import configparser
+import json
+import os
+import re
+import shlex
+import socket
+import subprocess
+import sys
+sys.path.insert(0, '/usr/lib/linuxmuster')
+import environment
+
+
+# minimum length of the dhcpopts field to be taken into account
+MIN_DHCP_OPTS_LENGTH = 5
+
+# isc-dhcp-server main config, includes DHCPSUBCONF and DHCPDEVCONF
+DHCPDCONF = os.path.dirname(environment.DHCPDEVCONF) + '/dhcpd.conf'
+
+# kea-dhcp4 files, see docs/import_subnets.md for the includes needed in KEACONF
+KEADIR = '/etc/kea'
+KEACONF = KEADIR + '/kea-dhcp4.conf'
+KEASUBCONF = KEADIR + '/subnets.json'
+KEADEVCONF = KEADIR + '/devices.json'
+KEACTRLSOCKET = '/run/kea/kea4-ctrl-socket'
+
+
+# return isc dhcpd host declaration of a device
+def buildDhcpHostDeclaration(hostname, group, mac, ip, dhcpopts, pxeflag):
+    """Build DHCP host declaration for a single device.
+
+    Args:
+        hostname: Device hostname
+        group: Device group name
+        mac: MAC address
+        ip: IP address or 'DHCP'
+        dhcpopts: DHCP options string (comma-separated)
+        pxeflag: PXE boot flag (0=no PXE, 1/2/3=different PXE modes)
+
+    Returns:
+        String containing complete DHCP host declaration
+    """
+    # Start with basic host declaration template
+    host_decl_tpl = """host @@hostname@@ {
+  option host-name "@@hostname@@";
+  hardware ethernet @@mac@@;
+"""
+    host_decl = host_decl_tpl.replace('@@mac@@', mac).replace('@@hostname@@', hostname)
+
+    # Add fixed IP address if not using DHCP
+    if ip != 'DHCP':
+        host_decl = host_decl + '  fixed-address ' + ip + ';\n'
+
+    # Add PXE-specific options for network boot clients
+    if int(pxeflag) != 0:
+        # extensions-path and nis-domain tell client which LINBO group config to use
+        host_decl = host_decl + '  option extensions-path "' + group + '";\n  option nis-domain "' + group + '";\n'
+        # Add custom DHCP options if provided (minimum length for validation)
+        if len(dhcpopts) >= MIN_DHCP_OPTS_LENGTH:
+            for opt in dhcpopts.split(','):
+                host_decl = host_decl + '  ' + opt + ';\n'
+
+    # Close host declaration block
+    host_decl = host_decl + '}\n'
+    return host_decl
+
+
+class DhcpBackend(abc.ABC):
+    """Renders and applies the configuration of a DHCP server.
+
+    The importers write three kinds of files: subnetsconf (import-subnets),
+    one host file per school in devicesdir and devicesconf combining them
+    (import-devices). mainconf is maintained by the admin and includes
+    subnetsconf and devicesconf. Backends implement all abstract methods,
+    an incomplete one cannot be instantiated.
+
+    Attributes:
+        name: Backend name as used for dhcpbackend in setup.ini
+        service: systemd unit of the server
+        restarts: True if reload() restarts the server, False if it only
+                  reloads the configuration
+        suffix: File name suffix of the per-school host files
+    """
+
+    name = None
+    service = None
+    restarts = True
+    suffix = '.conf'
+
+    def __init__(self, mainconf, subnetsconf, devicesconf, devicesdir=None):
+        self.mainconf = mainconf
+        self.subnetsconf = subnetsconf
+        self.devicesconf = devicesconf
+        self.devicesdir = devicesdir or os.path.dirname(devicesconf) + '/devices'
+
+    @abc.abstractmethod
+    def renderDevices(self, sections):
+        """Return the host file of a school.
+
+        Args:
+            sections: List of (subnet, hosts) tuples, subnet is 'DHCP' for
+                      dynamic ip hosts, hosts a list of (hostname, group, mac,
+                      ip, dhcpopts, pxeflag) tuples
+        """
+
+    @abc.abstractmethod
+    def renderDevicesConf(self, files):
+        """Return devicesconf combining the per-school host files.
+
+        Args:
+            files: List of (target, source) tuples, target the path the file
+                   is activated as, source the path to read it from now
+        """
+
+    @abc.abstractmethod
+    def renderSubnets(self, subnets, serverip):
+        """Return subnetsconf for the readSubnetsCSV() subnet dicts."""
+
+    @abc.abstractmethod
+    def getIncludes(self, content):
+        """Return the paths of the files included by a config file."""
+
+    @abc.abstractmethod
+    def testCommand(self, conffile):
+        """Return the command line checking the main config file conffile."""
+
+    def reload(self):
+        """Make the running server use the current configuration.
+
+        Returns:
+            True on success
+        """
+        result = subprocess.run(['service', self.service, 'restart'], shell=False, check=False)
+        return result.returncode == 0
+
+
+class IscDhcpBackend(DhcpBackend):
+    """isc-dhcp-server: include statements, dhcpd -t, service restart."""
+
+    name = 'isc'
+    service = 'isc-dhcp-server'
+
+    def __init__(self, mainconf=None, subnetsconf=None, devicesconf=None, devicesdir=None):
+        super().__init__(mainconf or DHCPDCONF, subnetsconf or environment.DHCPSUBCONF,
+                         devicesconf or environment.DHCPDEVCONF, devicesdir)
+
+    def renderDevices(self, sections):
+        content = ''
+        for subnet, hosts in sections:
+            if subnet == 'DHCP':
+                content += '# dynamic ip hosts\n'
+            else:
+                content += '# subnet ' + subnet + '\n'
+            for host in hosts:
+                content += buildDhcpHostDeclaration(*host)
+        return content
+
+    def renderDevicesConf(self, files):
+        return ''.join('include "{0}";\n'.format(target) for target, source in files)
+
+    def renderSubnets(self, subnets, serverip):
+        # output format follows the specification in import_subnets.md (no indentation)
+        content = ''
+        for s in subnets:
+            content += '# Subnet ' + s['ipnet'] + '\n'
+            content += 'subnet ' + s['network'] + ' netmask ' + s['netmask'] + ' {\n'
+            content += 'option routers ' + s['router'] + ';\n'
+            content += 'option subnet-mask ' + s['netmask'] + ';\n'
+            content += 'option broadcast-address ' + s['broadcast'] + ';\n'
+            if s['nameserver']:
+                content += 'option domain-name-servers ' + s['nameserver'] + ';\n'
+            else:
+                content += 'option netbios-name-servers ' + serverip + ';\n'
+            if s['nextserver']:
+                content += 'next-server ' + s['nextserver'] + ';\n'
+            if s['range1']:
+                content += 'range ' + s['range1'] + ' ' + s['range2'] + ';\n'
+            content += 'option host-name pxeclient;\n'
+            content += '}\n'
+        return content
+
+    def getIncludes(self, content):
+        return re.findall(r'^\s*include\s+"([^"]+)"\s*;', content, re.MULTILINE)
+
+    def testCommand(self, conffile):
+        return ['dhcpd', '-t', '-cf', conffile]
+
+
+# send a command to the kea control socket and return the first answer
+def keaCommand(command, arguments=None, socketpath=KEACTRLSOCKET, timeout=30):
+    """Send a command to the control socket of kea-dhcp4.
+
+    Returns:
+        Tuple (result, text), result 0 on success
+
+    Raises:
+        OSError if the socket cannot be used, ValueError on an invalid answer
+    """
+    request = {'command': command}
+    if arguments is not None:
+        request['arguments'] = arguments
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socketpath)
+        sock.sendall(json.dumps(request).encode())
+        data = b''
+        while True:
+            try:
+                chunk = sock.recv(65536)
+            except socket.timeout:
+                break
+            if not chunk:
+                break
+            data += chunk
+            try:
+                answer = json.loads(data)
+                break
+            except ValueError:
+                continue
+    answer = json.loads(data)
+    if isinstance(answer, list):
+        answer = answer[0]
+    return answer.get('result', 1), answer.get('text', '')
+
+
+class KeaDhcpBackend(DhcpBackend):
+    """kea-dhcp4: JSON subnets and global host reservations, config-reload.
+
+    Reservations are global, so KEACONF has to include the generated files
+    like this:
+
+        "reservations-global": true,
+        "reservations-in-subnet": false,
+        "subnet4": <?include "/etc/kea/subnets.json"?>,
+        "reservations": <?include "/etc/kea/devices.json"?>,
+    """
+
+    name = 'kea'
+    service = 'kea-dhcp4-server'
+    restarts = False
+    suffix = '.json'
+
+    # isc host statements from the dhcpopts field with a kea equivalent
+    STATEMENTS = {'next-server': 'next-server', 'filename': 'boot-file-name',
+                  'server-name': 'server-hostname'}
+
+    def __init__(self, mainconf=None, subnetsconf=None, devicesconf=None, devicesdir=None,
+                 ctrlsocket=None):
+        super().__init__(mainconf or KEACONF, subnetsconf or KEASUBCONF,
+                         devicesconf or KEADEVCONF, devicesdir)
+        self.ctrlsocket = ctrlsocket or KEACTRLSOCKET
+
+    def buildReservation(self, hostname, group, mac, ip, dhcpopts, pxeflag):
+        """Return the kea reservation of a device, the equivalent of buildDhcpHostDeclaration().
+
+        Entries of dhcpopts are translated if they are of the form
+        'option <name> <value>' or one of STATEMENTS, others are skipped.
+        """
+        reservation = {'hostname': hostname, 'hw-address': mac.lower()}
+        if ip != 'DHCP':
+            reservation['ip-address'] = ip
+        option_data = [{'name': 'host-name', 'data': hostname}]
+        if int(pxeflag) != 0:
+            option_data.append({'name': 'extensions-path', 'data': group})
+            option_data.append({'name': 'nis-domain', 'data': group})
+            if len(dhcpopts) >= MIN_DHCP_OPTS_LENGTH:
+                for opt in dhcpopts.split(','):
+                    try:
+                        words = shlex.split(opt)
+                    except ValueError:
+                        words = []
+                    if len(words) >= 3 and words[0] == 'option':
+                        option_data.append({'name': words[1], 'data': ' '.join(words[2:])})
+                    elif len(words) == 2 and words[0] in self.STATEMENTS:
+                        reservation[self.STATEMENTS[words[0]]] = words[1]
+                    else:
+                        print('* ' + hostname + ': skipping dhcp option without kea equivalent: ' + opt)
+        reservation['option-data'] = option_data
+        return reservation
+
+    def renderDevices(self, sections):
+        reservations = []
+        for subnet, hosts in sections:
+            for host in hosts:
+                reservations.append(self.buildReservation(*host))
+        return json.dumps(reservations, indent=2) + '\n'
+
+    def renderDevicesConf(self, files):
+        # kea cannot include a list of files into one list, so merge them
+        reservations = []
+        for target, source in files:
+            with open(source) as infile:
+                reservations.extend(json.load(infile))
+        return json.dumps(reservations, indent=2) + '\n'
+
+    @staticmethod
+    def subnetId(network, netmask):
+        """Return a stable kea subnet id for a network and its netmask.
+
+        The id is the network address with its highest host bit set, so
+        networks starting at the same address but differing in prefix
+        length (e.g. 10.0.0.0/16 and 10.0.0.0/24) get different ids.
+        """
+        hostmask = ~int.from_bytes(socket.inet_aton(netmask), 'big') & 0xffffffff
+        return int.from_bytes(socket.inet_aton(network), 'big') | ((hostmask + 1) >> 1)
+
+    def renderSubnets(self, subnets, serverip):
+        entries = []
+        for s in subnets:
+            entry = {'id': self.subnetId(s['network'], s['netmask']), 'subnet': s['ipnet']}
+            if s['range1']:
+                entry['pools'] = [{'pool': s['range1'] + ' - ' + s['range2']}]
+            if s['nextserver']:
+                entry['next-server'] = s['nextserver']
+            option_data = [{'name': 'routers', 'data': s['router']},
+                           {'name': 'subnet-mask', 'data': s['netmask']},
+                           {'name': 'broadcast-address', 'data': s['broadcast']}]
+            if s['nameserver']:
+                option_data.append({'name': 'domain-name-servers', 'data': s['nameserver']})
+            else:
+                option_data.append({'name': 'netbios-name-servers', 'data': serverip})
+            option_data.append({'name': 'host-name', 'data': 'pxeclient'})
+            entry['option-data'] = option_data
+            entries.append(entry)
+        return json.dumps(entries, indent=2) + '\n'
+
+    def getIncludes(self, content):
+        return re.findall(r'<\?include\s+"([^"]+)"\s*\?>', content)
+
+    def testCommand(self, conffile):
+        return ['kea-dhcp4', '-t', conffile]
+
+    def reload(self):
+        """Let kea-dhcp4 reread its configuration with config-reload.
+
+        Falls back to a systemd reload (SIGHUP) if the control socket is not
+        available.
+        """
+        if os.path.exists(self.ctrlsocket):
+            try:
+                result, text = keaCommand('config-reload', socketpath=self.ctrlsocket)
+                if result != 0:
+                    print('* config-reload failed: ' + text)
+                return result == 0
+            except (OSError, ValueError) as error:
+                print('* kea control socket: ' + str(error))
+        result = subprocess.run(['systemctl', 'reload', self.service], shell=False, check=False)
+        return result.returncode == 0
+
+
+DHCP_BACKENDS = {'isc': IscDhcpBackend, 'kea': KeaDhcpBackend}
+
+
+# return the configured dhcp backend
+def getDhcpBackend(name=None):
+    """Return the DHCP backend instance.
+
+    Args:
+        name: Backend name, if None the dhcpbackend value of setup.ini is
+              used (default: isc)
+
+    Raises:
+        ValueError if the backend is unknown
+    """
+    if name is None:
+        setup = configparser.RawConfigParser(delimiters=('='))
+        try:
+            setup.read(environment.SETUPINI)
+        except configparser.Error:
+            pass
+        name = setup.get('setup', 'dhcpbackend', fallback='') or 'isc'
+    if name not in DHCP_BACKENDS:
+        raise ValueError('Unknown dhcp backend ' + name + ', use one of ' + ', '.join(DHCP_BACKENDS))
+    return DHCP_BACKENDS[name]()
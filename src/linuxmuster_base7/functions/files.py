@@ -4,7 +4,7 @@
 # Description  : Text file, secret file and ini file read/write helpers
 # Signed-off by: thomas@linuxmuster.net
 # Assisted by  : Claude
-# Date         : 20260818
+# Date         : 20261017
 #
 
 import codecs
@@ -42,6 +42,37 @@ def writeTextfile(tfile, content, flag):
         return False
 
 
+# return (mtime, size) of a file to tell whether it changed on disk, None if
+# it cannot be accessed; used to invalidate caches of parsed files
+def getFileStamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+# write textfile atomically: content goes to a temporary file in the same
+# directory which then replaces tfile, so readers never see a partial file;
+# an existing tfile keeps its permissions
+def writeTextfileAtomic(tfile, content):
+    tmpfile = tfile + '.tmp' + str(os.getpid())
+    try:
+        with open(tmpfile, 'w') as outfile:
+            outfile.write(content)
+        if os.path.isfile(tfile):
+            shutil.copymode(tfile, tmpfile)
+        os.replace(tmpfile, tfile)
+        return True
+    except Exception as error:
+        print(error)
+        try:
+            os.unlink(tmpfile)
+        except OSError:
+            pass
+        return False
+
+
 # write a secret to a file, restricting its permissions from creation onward
 # (avoids the window between a plain write and a later chmod call)
 def writeSecretFile(tfile, content, mode=0o600):
@@ -4,16 +4,19 @@
 # Description  : LINBO start.conf and GRUB boot configuration helpers
 # Signed-off by: thomas@linuxmuster.net
 # Assisted by  : Claude
-# Date         : 20260818
+# Date         : 20261017
 #
 
 import configparser
+import itertools
+import os
 import re
 import sys
+from collections import namedtuple
 sys.path.insert(0, '/usr/lib/linuxmuster')
 import environment
 
-from .files import readTextfile, writeTextfile
+from .files import getFileStamp, readTextfile, writeTextfile
 
 
 # return grub name of partition's device name
@@ -71,63 +74,245 @@ def readStartconf(startconf):
     rc, content = readTextfile(startconf)
     if not rc:
         return rc, None
-    # [Partition] --> [Partition1]
-    content = re.sub(
-        r'\[[Pp][Aa][Rr][Tt][Ii][Tt][Ii][Oo][Nn]\]', '[Partition]', content)
-    count = 1
-    while '[Partition]' in content:
-        content = content.replace(
-            '[Partition]', '[Partition' + str(count) + ']', 1)
-        count = count + 1
+    # [Partition] --> [Partition1], [Partition2], ...
+    count = itertools.count(1)
+    content = re.sub(r'\[[Pp][Aa][Rr][Tt][Ii][Tt][Ii][Oo][Nn]\]',
+                     lambda match: '[Partition' + str(next(count)) + ']', content)
     # replace os sections to make them unique
-    content = re.sub(r'\[[Oo][Ss]\]', '[OS]', content)
-    count = 1
-    while '[OS]' in content:
-        content = content.replace('[OS]', '[OS' + str(count) + ']', 1)
-        count = count + 1
+    count = itertools.count(1)
+    content = re.sub(r'\[[Oo][Ss]\]', lambda match: '[OS' + str(next(count)) + ']', content)
     return True, content
 
 
-# get global options from startconf
-def getStartconfOption(startconf, section, option):
-    rc, content = readStartconf(startconf)
-    if not rc:
+# partition and os entries of a start.conf
+StartconfPartition = namedtuple('StartconfPartition', ['nr', 'dev', 'label', 'options'])
+StartconfOs = namedtuple('StartconfOs', ['nr', 'name', 'baseimage', 'root', 'kernel',
+                                         'initrd', 'append'])
+
+
+class StartConf(object):
+    """
+    LINBO start.conf parsed once into partitions, os entries and options.
+
+    The file is read and its sections renumbered once; the ini view is
+    parsed once with configparser. The getStartconf*() functions are thin
+    wrappers around the cached instance returned by getStartConf(), so
+    building a group's grub.cfg no longer re-reads the file per lookup.
+
+    Attributes:
+        path: Path of the start.conf
+        readable: False if the file could not be read
+        content: Renumbered file content as returned by readStartconf()
+        partitions: List of StartconfPartition in file order
+        oslist: List of StartconfOs in file order, up to the first
+            incomplete os section
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.partitions = []
+        self.oslist = []
+        self._parser = None
+        self._error = None
+        self.readable, self.content = readStartconf(path)
+        if not self.readable:
+            return
+        self._parsePartitions()
+        try:
+            parser = configparser.RawConfigParser(delimiters=('='),
+                                                  inline_comment_prefixes=('#', ';'))
+            parser.read_string(self.content)
+            self._parser = parser
+        except Exception as error:
+            self._error = error
+            return
+        self._parseOs()
+
+    def _parsePartitions(self):
+        # line based, so partitions are available even if configparser
+        # rejects the file (e.g. because of duplicate options)
+        partition = None
+        for line in self.content.split('\n'):
+            if line.startswith('['):
+                partition = None
+                if re.match(r'\[Partition\d+\]', line):
+                    partition = {}
+                    self.partitions.append(partition)
+                continue
+            if partition is None or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            partition.setdefault(key.strip().lower(), value.split('#')[0].strip())
+        self.partitions = [StartconfPartition(nr, options.get('dev', ''),
+                                              options.get('label', ''), options)
+                           for nr, options in enumerate(self.partitions, 1)]
+
+    def _parseOs(self):
+        nr = 1
+        while self._parser.has_section('OS' + str(nr)):
+            values = []
+            try:
+                for option in StartconfOs._fields[1:]:
+                    value = self._parser.get('OS' + str(nr), option).split('#')[0]
+                    values.append(value.strip())
+            except configparser.Error:
+                break
+            self.oslist.append(StartconfOs(str(nr), *values))
+            nr = nr + 1
+
+    def getOption(self, section, option):
+        """Return an option value, None if file, section or option are missing."""
+        if not self.readable:
+            return None
+        if self._parser is None:
+            print(self._error)
+            return None
+        try:
+            return self._parser.get(section, option)
+        except Exception as error:
+            print(error)
+            return None
+
+    def getOsValues(self):
+        """
+        Return the os entries as lists as getStartconfOsValues() always did.
+
+        Returns:
+            List of [name, baseimage, root, kernel, initrd, append, osnr]
+            lists, [] if the first os section is incomplete, None if the
+            file is unreadable, unparsable or has no named first os section
+        """
+        if not self.readable:
+            return None
+        if self._parser is None:
+            print(self._error)
+            return None
+        if not self.oslist:
+            try:
+                self._parser.get('OS1', 'name')
+            except configparser.Error:
+                return None
+            return []
+        return [list(item[1:]) + [item.nr] for item in self.oslist]
+
+    def getPartnr(self, partition):
+        """Return the number (as string) of the partition with device partition, 0 if none."""
+        for item in self.partitions:
+            if item.dev == partition:
+                return str(item.nr)
+        return 0
+
+    def getPartlabel(self, partnr):
+        """Return the label of partition number partnr, '' if there is none."""
+        partnr = int(partnr)
+        if 1 <= partnr <= len(self.partitions):
+            return self.partitions[partnr - 1].label
+        return ''
+
+
+# cache of parsed start.confs: path -> ((mtime, size), StartConf)
+_startconfs = {}
+
+
+def getStartConf(startconf):
+    """
+    Return the parsed StartConf of a file, reusing a cached one if possible.
+
+    The cache is keyed by path and invalidated when the file's mtime or size
+    change (e.g. after setGlobalStartconfOption()).
+    """
+    stamp = getFileStamp(startconf)
+    cached = _startconfs.get(startconf)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    conf = StartConf(startconf)
+    _startconfs[startconf] = (stamp, conf)
+    return conf
+
+
+class GrubTemplate(object):
+    """
+    A LINBO grub template with its @@var@@ placeholders compiled.
+
+    The template text is split once into literal chunks and placeholder
+    names, so render() fills in all variables in a single pass instead of
+    one str.replace() per variable. Placeholders without a value are left
+    as they are, None values render as empty string (the former
+    str.replace() chains wrote 'None' into os entries and failed on None
+    in the global section).
+    """
+
+    placeholder = re.compile(r'@@(\w+)@@')
+
+    def __init__(self, content):
+        self.content = content
+        # even indices are literal text, odd indices placeholder names
+        self.parts = self.placeholder.split(content)
+        self.variables = set(self.parts[1::2])
+
+    def render(self, values):
+        parts = self.parts[:]
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            if name not in values:
+                parts[i] = '@@' + name + '@@'
+            elif values[name] is None:
+                parts[i] = ''
+            else:
+                parts[i] = str(values[name])
+        return ''.join(parts)
+
+
+# cache of compiled grub templates: path -> ((mtime, size), GrubTemplate)
+_grubtemplates = {}
+
+
+def getGrubTemplate(name):
+    """
+    Return the compiled GrubTemplate of LINBOTPLDIR/name, None if unreadable.
+
+    Each template is read and compiled once and reused until the file
+    changes on disk.
+    """
+    path = os.path.join(environment.LINBOTPLDIR, name)
+    stamp = getFileStamp(path)
+    if stamp is None:
         return None
-    try:
-        # read in to configparser
-        s = configparser.RawConfigParser(delimiters=('='), inline_comment_prefixes=('#', ';'))
-        s.read_string(content)
-        return s.get(section, option)
-    except Exception as error:
-        print(error)
+    cached = _grubtemplates.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    rc, content = readTextfile(path)
+    if not rc:
         return None
+    template = GrubTemplate(content)
+    _grubtemplates[path] = (stamp, template)
+    return template
 
 
-# get partition label from start.conf
+# get global options from startconf
+def getStartconfOption(startconf, section, option):
+    return getStartConf(startconf).getOption(section, option)
+
+
+# get partition label from start.conf; the label of the partnr-th
+# [Partition] section, '' if that section has no label (formerly the
+# partnr-th Label line of the file, so a partition without label shifted
+# the labels of all following partitions)
 def getStartconfPartlabel(startconf, partnr):
     partnr = int(partnr)
-    rc, content = readStartconf(startconf)
-    if not rc:
+    conf = getStartConf(startconf)
+    if not conf.readable:
         return ''
-    count = 1
-    for item in re.findall(r'\nLabel.*\n', content, re.IGNORECASE):
-        if count == partnr:
-            return item.split('#')[0].split('=')[1].strip()
-        count = count + 1
-    return ''
+    return conf.getPartlabel(partnr)
 
 
-# get number of partition
+# get number of partition; the number of the [Partition] section with
+# Dev = partition (formerly counted over all Dev lines of the file)
 def getStartconfPartnr(startconf, partition):
-    rc, content = readStartconf(startconf)
-    if not rc:
+    conf = getStartConf(startconf)
+    if not conf.readable:
         return 0
-    count = 1
-    for item in re.findall(r'\nDev.*\n', content, re.IGNORECASE):
-        if item.split('#')[0].split('=')[1].strip() == partition:
-            return str(count)
-        count = count + 1
-    return 0
+    return conf.getPartnr(partition)
 
 
 # write global options to startconf
@@ -156,58 +341,7 @@ def setGlobalStartconfOption(startconf, option, value):
 
 # return os values from linbo start.conf as list
 def getStartconfOsValues(startconf):
-    rc, content = readStartconf(startconf)
-    if not rc:
-        return None
-    try:
-        # read in to configparser
-        s = configparser.RawConfigParser(delimiters=('='), inline_comment_prefixes=('#', ';'))
-        s.read_string(content)
-        count = 1
-        oslists = {}
-        while True:
-            try:
-                oslists[count] = []
-                name = s.get('OS' + str(count), 'name').split('#')[0]
-                if name != '':
-                    name = name.strip()
-                oslists[count].append(name)
-                baseimage = s.get('OS' + str(count), 'baseimage').split('#')[0]
-                if baseimage != '':
-                    baseimage = baseimage.strip()
-                oslists[count].append(baseimage)
-                root = s.get('OS' + str(count), 'root').split('#')[0]
-                if root != '':
-                    root = root.strip()
-                oslists[count].append(root)
-                kernel = s.get('OS' + str(count), 'kernel').split('#')[0]
-                if kernel != '':
-                    kernel = kernel.strip()
-                oslists[count].append(kernel)
-                initrd = s.get('OS' + str(count), 'initrd').split('#')[0]
-                if initrd != '':
-                    initrd = initrd.strip()
-                oslists[count].append(initrd)
-                kappend = s.get('OS' + str(count), 'append').split('#')[0]
-                if kappend != '':
-                    kappend = kappend.strip()
-                oslists[count].append(kappend)
-                oslists[count].append(str(count))
-                count = count + 1
-            except Exception:
-                break
-        if oslists[1] == []:
-            return None
-        maxcount = count
-        count = 1
-        result = []
-        while count < maxcount:
-            result.append(oslists[count])
-            count = count + 1
-        return result
-    except Exception as error:
-        print(error)
-        return None
+    return getStartConf(startconf).getOsValues()
 
 
 def getLinboVersion():
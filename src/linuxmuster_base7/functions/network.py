@@ -5,13 +5,17 @@
 #                network interface helpers
 # Signed-off by: thomas@linuxmuster.net
 # Assisted by  : Claude
-# Date         : 20260818
+# Date         : 20261017
 #
 
 import csv
+import os
 import re
 import socket
+from bisect import bisect_right
 from contextlib import closing
+from functools import lru_cache
+from operator import itemgetter
 from IPy import IP
 from netaddr import IPNetwork, IPAddress
 import sys
@@ -19,6 +23,139 @@ sys.path.insert(0, '/usr/lib/linuxmuster')
 import environment
 import netifaces
 
+from .files import getFileStamp
+
+
+# convert a dotted quad ipv4 address to an integer
+def _ipToInt(ip):
+    return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+
+
+# return (first, last) address of a network as integers
+@lru_cache(maxsize=1024)
+def _cidrRange(cidr):
+    net = IPNetwork(cidr)
+    return net.first, net.last
+
+
+class SubnetTable(object):
+    """
+    Subnets from subnets.csv compiled into sorted integer address ranges.
+
+    subnets.csv is read once; rows whose router is not inside the network
+    are skipped like getSubnetArray() always did. Lookups of an ip address
+    bisect the ranges sorted by start address and then follow the chain of
+    enclosing networks (CIDR networks are either disjoint or nested), so
+    resolving an ip costs O(log n) instead of a linear IPNetwork scan over
+    a freshly parsed file. Use getSubnetTable() to get a cached instance.
+
+    Attributes:
+        csv_path: Path of the parsed subnets.csv
+        rows: Valid subnets.csv rows in file order
+    """
+
+    def __init__(self, csv_path=None):
+        self.csv_path = csv_path or environment.SUBNETSCSV
+        self.rows = []
+        self._starts = []
+        self._ranges = []
+        self._parents = []
+        with open(self.csv_path, newline='') as infile:
+            content = csv.reader(infile, delimiter=';', quoting=csv.QUOTE_NONE)
+            for row in content:
+                # skip rows, which begin with non alphanumeric characters
+                try:
+                    if not row[0][0:1].isalnum():
+                        continue
+                except Exception:
+                    continue
+                try:
+                    first, last = _cidrRange(row[0])
+                    if not first <= int(IPAddress(row[1])) <= last:
+                        continue
+                except Exception as error:
+                    print(error)
+                    continue
+                self._ranges.append((first, last, len(self.rows)))
+                self.rows.append(row)
+        # sort by start, enclosing networks before the ones they contain
+        self._ranges.sort(key=lambda item: (item[0], -item[1], item[2]))
+        self._starts = [item[0] for item in self._ranges]
+        # index of the nearest enclosing range, -1 for top level networks
+        stack = []
+        for nr, (first, last, order) in enumerate(self._ranges):
+            while stack and self._ranges[stack[-1]][1] < first:
+                stack.pop()
+            self._parents.append(stack[-1] if stack else -1)
+            stack.append(nr)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _matches(self, ipint):
+        nr = bisect_right(self._starts, ipint) - 1
+        matches = []
+        while nr >= 0:
+            first, last, order = self._ranges[nr]
+            if ipint <= last:
+                matches.append(order)
+            nr = self._parents[nr]
+        return sorted(matches)
+
+    def matchAll(self, ip):
+        """Return all rows whose network contains ip, in file order."""
+        return [self.rows[order] for order in self._matches(_ipToInt(ip))]
+
+    def match(self, ip):
+        """Return the first row (in file order) whose network contains ip, or None."""
+        matches = self._matches(_ipToInt(ip))
+        if not matches:
+            return None
+        return self.rows[matches[0]]
+
+    def select(self, fieldnrs=''):
+        """
+        Return copies of all valid rows, optionally reduced to some fields.
+
+        Args:
+            fieldnrs: Comma-separated field numbers to return (empty=all fields)
+        """
+        if fieldnrs == '':
+            return [list(row) for row in self.rows]
+        fields = [int(field) for field in fieldnrs.split(',')]
+        subnet_array = []
+        for row in self.rows:
+            try:
+                subnet_array.append([row[field] for field in fields])
+            except Exception as error:
+                print(error)
+                continue
+        return subnet_array
+
+
+# cache of the SubnetTable: (stamp, table)
+_subnet_table = None
+
+
+def getSubnetTable():
+    """
+    Return the SubnetTable of subnets.csv, reusing the cached one if possible.
+
+    The cached table is rebuilt as soon as subnets.csv changes on disk
+    (mtime/size).
+
+    Raises:
+        IOError: If subnets.csv cannot be opened
+    """
+    global _subnet_table
+    stamp = getFileStamp(environment.SUBNETSCSV)
+    if _subnet_table is not None and _subnet_table[0] == stamp \
+            and _subnet_table[1].csv_path == environment.SUBNETSCSV:
+        return _subnet_table[1]
+    table = SubnetTable()
+    _subnet_table = (stamp, table)
+    return table
+
 
 # test if ip matches subnet
 def ipMatchSubnet(ip, subnet):
@@ -28,12 +165,9 @@ def ipMatchSubnet(ip, subnet):
         return False
     try:
         if subnet == 'all':
-            cidr_array = getSubnetArray('0')
-        else:
-            cidr_array = [[subnet]]
-        for cidr in cidr_array:
-            if IPAddress(ip) in IPNetwork(cidr[0]):
-                return True
+            return getSubnetTable().match(ip) is not None
+        first, last = _cidrRange(subnet)
+        return first <= _ipToInt(ip) <= last
     except Exception as error:
         print(error)
     return False
@@ -41,11 +175,13 @@ def ipMatchSubnet(ip, subnet):
 
 # get ip's subnet
 def getIpSubnet(ip):
-    subnets = getSubnetArray('0')
-    for item in subnets:
-        subnet = item[0]
-        if ipMatchSubnet(ip, subnet):
-            return subnet
+    try:
+        row = getSubnetTable().match(ip)
+    except Exception as error:
+        print(error)
+        return
+    if row is not None:
+        return row[0]
 
 
 # get ip's broadcast address
@@ -61,15 +197,22 @@ def getIpBcAddress(ip):
         print(error)
 
 
-# reads devices.csv and returns a list of devices arrays: [array1, array2, ...]
-# fieldnrs: comma separated list of field nrs ('0,1,2,3,...') to be returned,
-#   default is all fields were returned
-# subnet filter: only hosts whose ip matches the specified subnet (CIDR) were
-#   returned, if 'all' is specified all subnets defined insubnets.csv were
-#   checked, if 'DHCP' is specified all dynamic ip hosts are returned
-# pxeflag filter: comma separated list of flags ('0,1,2,3'), only hosts with
-#   the specified pxeflags were returned
-def readDevicesCsv(school='default-school'):
+def getDevicesCsvPath(school='default-school'):
+    """
+    Return the path of the devices.csv file for specified school.
+
+    Args:
+        school: School name (default: 'default-school')
+
+    Returns:
+        Absolute path to the school's devices.csv
+    """
+    if school == "default-school":
+        return environment.SOPHOSYSDIR + "/default-school/devices.csv"
+    return environment.SOPHOSYSDIR + "/" + school + "/" + school + ".devices.csv"
+
+
+def readDevicesCsv(school='default-school', csv_path=None):
     """
     Read devices CSV file for specified school.
 
@@ -79,6 +222,7 @@ def readDevicesCsv(school='default-school'):
 
     Args:
         school: School name (default: 'default-school')
+        csv_path: Explicit path to read instead of the school's devices.csv
 
     Returns:
         List of raw CSV rows (each row is a list of fields)
@@ -87,41 +231,95 @@ def readDevicesCsv(school='default-school'):
         IOError: If devices.csv file cannot be opened
     """
     # Determine CSV file path based on school
-    if school == "default-school":
-        csv_path = environment.SOPHOSYSDIR + "/default-school/devices.csv"
-    else:
-        csv_path = environment.SOPHOSYSDIR + "/" + school + "/" + school + ".devices.csv"
+    if csv_path is None:
+        csv_path = getDevicesCsvPath(school)
+    return list(_iterDevicesCsvRows(csv_path))
+
 
-    # Read CSV file
+def _iterDevicesCsvRows(csv_path):
+    """Yield the rows of a devices.csv, see readDevicesCsv()."""
     with open(csv_path, newline='') as infile:
         content = csv.reader(infile, delimiter=';', quoting=csv.QUOTE_NONE)
-        rows = []
         for row in content:
             # Skip rows that begin with non-alphanumeric characters
             try:
                 if row[0][0:1].isalnum():
-                    rows.append(row)
+                    yield row
             except (IndexError, Exception):
                 continue
-    return rows
+
+
+# column names of devices.csv, see devices.csv(5)
+DEVICE_COLUMNS = ('room', 'hostname', 'group', 'mac', 'ip', 'officekey',
+                  'windowskey', 'dhcpopts', 'role', 'lmnreserved10', 'pxe',
+                  'lmnreserved12', 'lmnreserved13', 'lmnreserved14',
+                  'comment', 'options')
+
+
+def _deviceColumn(nr):
+    def getColumn(self):
+        row = self.row
+        return row[nr] if nr < len(row) else ''
+    return property(getColumn)
+
+
+class Device(object):
+    """
+    A validated devices.csv row with named read-only columns.
+
+    Only the CSV row itself is stored, the named attributes (see
+    DEVICE_COLUMNS, e.g. device.hostname, device.ip, device.pxe) read from
+    it. Missing trailing columns read as ''. For non-default schools the
+    row carries the school-prefixed hostname.
+
+    device['hostname'] and device['raw_row'] are still supported for code
+    written against the former device dicts.
+
+    Attributes:
+        row: CSV row as list of fields
+    """
+
+    __slots__ = ('row',)
+
+    def __init__(self, row):
+        self.row = row
+
+    def __getitem__(self, key):
+        if key == 'raw_row':
+            return self.row
+        if key in DEVICE_COLUMNS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __eq__(self, other):
+        return isinstance(other, Device) and self.row == other.row
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Device(' + repr(self.row) + ')'
+
+
+for _nr, _name in enumerate(DEVICE_COLUMNS):
+    setattr(Device, _name, _deviceColumn(_nr))
+del _nr, _name
 
 
 def validateDeviceRow(row, school='default-school'):
     """
     Validate and parse a device row from devices.csv.
 
-    Extracts device fields, applies hostname transformation for non-default
-    schools, and validates hostname, MAC address, and IP address.
+    Applies hostname transformation for non-default schools and validates
+    hostname, MAC address, and IP address.
 
     Args:
         row: CSV row as list of fields
         school: School name for hostname transformation
 
     Returns:
-        Tuple of (is_valid, device_dict) where:
+        Tuple of (is_valid, device) where:
         - is_valid: Boolean indicating if row is valid
-        - device_dict: Dictionary with parsed fields (hostname, group, mac, ip, pxe, raw_row)
-          or None if invalid
+        - device: Device record or None if invalid
     """
     try:
         # Transform hostname for non-default schools (add school prefix)
@@ -129,30 +327,20 @@ def validateDeviceRow(row, school='default-school'):
             row = row.copy()  # Don't modify original
             row[1] = school + "-" + row[1]
 
-        # Extract device fields from CSV columns
-        hostname = row[1]
-        group = row[2]
-        mac = row[3]
-        ip = row[4]
-        pxe = row[10]
+        # pxe flag is the last mandatory column
+        if len(row) <= 10:
+            raise IndexError('list index out of range')
+        device = Device(row)
 
         # Validate hostname and MAC address
-        if not isValidHostname(hostname) or not isValidMac(mac):
+        if not isValidHostname(device.hostname) or not isValidMac(device.mac):
             return False, None
 
         # Validate IP address (must be valid IPv4 or 'DHCP')
+        ip = device.ip
         if not isValidHostIpv4(ip) and ip != 'DHCP':
             return False, None
 
-        # Return validated device data
-        device = {
-            'hostname': hostname,
-            'group': group,
-            'mac': mac,
-            'ip': ip,
-            'pxe': pxe,
-            'raw_row': row
-        }
         return True, device
 
     except (IndexError, KeyError, Exception) as error:
@@ -171,17 +359,17 @@ def filterDevices(devices, subnet='', pxeflag=''):
     - pxeflag='flag1,flag2': Only include devices with matching PXE flags
 
     Args:
-        devices: List of device dictionaries
+        devices: List of Device records
         subnet: Subnet filter ('DHCP', IP/netmask, or empty for no filter)
         pxeflag: PXE flag filter (comma-separated values, empty for no filter)
 
     Returns:
-        Filtered list of device dictionaries
+        Filtered list of Device records
     """
     filtered = []
     for device in devices:
-        ip = device['ip']
-        pxe = device['pxe']
+        ip = device.ip
+        pxe = device.pxe
 
         # Filter by subnet
         if subnet == 'DHCP':
@@ -203,49 +391,282 @@ def filterDevices(devices, subnet='', pxeflag=''):
     return filtered
 
 
+@lru_cache(maxsize=64)
+def getFieldProjection(fieldnrs=''):
+    """
+    Compile a fieldnrs string into a function projecting a CSV row.
+
+    The field numbers are parsed once per distinct fieldnrs string; the
+    returned function maps a row to a new list of the selected fields.
+    Invalid field numbers are ignored, fields beyond the end of a row are
+    skipped.
+
+    Args:
+        fieldnrs: Comma-separated field numbers (empty=all fields)
+
+    Returns:
+        Function row -> list of fields
+    """
+    if fieldnrs == '':
+        return list
+    fields = []
+    for field in fieldnrs.split(','):
+        try:
+            fields.append(int(field))
+        except ValueError:
+            continue
+    if not fields:
+        return lambda row: []
+    getter = itemgetter(*fields)
+    single = len(fields) == 1
+
+    def project(row):
+        try:
+            values = getter(row)
+        except IndexError:
+            return [row[field] for field in fields if -len(row) <= field < len(row)]
+        return [values] if single else list(values)
+    return project
+
+
 def transformDeviceRow(device, fieldnrs=''):
     """
-    Transform device dict to include only specified fields from raw CSV row.
+    Return the specified fields of a device's CSV row.
 
     Args:
-        device: Device dictionary with 'raw_row' field
+        device: Device record
         fieldnrs: Comma-separated field numbers to return (empty=all fields)
 
     Returns:
-        List with selected fields from raw CSV row
+        New list with selected fields from the CSV row
 
     Examples:
-        fieldnrs='' returns entire row
+        fieldnrs='' returns a copy of the entire row
         fieldnrs='1,3,4' returns fields at positions 1, 3, and 4
     """
-    raw_row = device['raw_row']
+    return getFieldProjection(fieldnrs)(device.row)
 
-    # Return all fields if no specific fields requested
-    if fieldnrs == '':
-        return raw_row
 
-    # Extract only requested field numbers
-    result = []
-    for field in fieldnrs.split(','):
-        try:
-            result.append(raw_row[int(field)])
-        except (ValueError, IndexError):
-            # Invalid field number, skip it
-            continue
+class DeviceIndex(object):
+    """
+    Parsed and validated devices.csv of one school, grouped for lookups.
+
+    The file is read once on construction. Rows are validated and bucketed
+    by subnet (as defined in subnets.csv), pxe flag and group on first use,
+    so the per-subnet and per-pxeflag queries of import-devices become
+    dictionary lookups instead of a full re-read of devices.csv each.
+    Use getDeviceIndex() to get a cached instance.
+
+    Attributes:
+        school: School name the index was built for
+        csv_path: Path of the parsed devices.csv
+        rows: Raw CSV rows (comment and empty lines skipped)
+    """
+
+    def __init__(self, school='default-school', csv_path=None):
+        self.school = school
+        self.csv_path = csv_path or getDevicesCsvPath(school)
+        self.rows = readDevicesCsv(school, self.csv_path)
+        self._devices = None
+        self._subnets = []
+        self._by_subnet = {}
+        self._in_subnets = []
+        self._by_pxe = {}
+        self._by_group = {}
+        self._lookup = None
+
+    def _build(self):
+        """Validate all rows once and fill the subnet/pxe/group buckets."""
+        if self._devices is not None:
+            return
+        self._devices = []
+        table = getSubnetTable()
+        self._subnets = [row[0] for row in table.rows]
+        for cidr in self._subnets:
+            self._by_subnet[cidr] = []
+        self._by_subnet['DHCP'] = []
+        for row in self.rows:
+            is_valid, device = validateDeviceRow(row, self.school)
+            if not is_valid:
+                continue
+            self._devices.append(device)
+            self._by_pxe.setdefault(device.pxe, []).append(device)
+            self._by_group.setdefault(device.group, []).append(device)
+            if device.ip == 'DHCP':
+                self._by_subnet['DHCP'].append(device)
+                continue
+            try:
+                matches = table.matchAll(device.ip)
+            except Exception as error:
+                print(error)
+                continue
+            # subnets listed twice in subnets.csv get the device only once
+            for cidr in dict.fromkeys(row[0] for row in matches):
+                self._by_subnet[cidr].append(device)
+            if matches:
+                self._in_subnets.append(device)
+
+    @property
+    def devices(self):
+        """All valid devices in file order."""
+        self._build()
+        return self._devices
+
+    @property
+    def subnets(self):
+        """Subnets (CIDR strings) from subnets.csv the devices were grouped by."""
+        self._build()
+        return self._subnets
+
+    def select(self, subnet='', pxeflag=''):
+        """
+        Return valid devices matching subnet and pxe flag filters.
+
+        Same filter semantics as filterDevices(), but served from the
+        prebuilt buckets. Subnets not listed in subnets.csv fall back to a
+        filterDevices() scan.
+
+        Args:
+            subnet: Subnet filter ('DHCP', 'all', IP/netmask, or empty for no filter)
+            pxeflag: PXE flag filter (comma-separated values, empty for no filter)
+
+        Returns:
+            List of Device records in file order
+        """
+        self._build()
+        if subnet == '':
+            devices = self._devices
+        elif subnet == 'all':
+            devices = self._in_subnets
+        elif subnet in self._by_subnet:
+            devices = self._by_subnet[subnet]
+        else:
+            devices = filterDevices(self._devices, subnet)
+        if pxeflag == '':
+            return list(devices)
+        flags = set(pxeflag.split(','))
+        return [device for device in devices if device.pxe in flags]
+
+    def group(self, group):
+        """Return all valid devices of a device group."""
+        self._build()
+        return list(self._by_group.get(group, []))
+
+    def lookup(self, search):
+        """
+        Find the first raw row whose ip, mac or hostname matches search.
+
+        Works on the raw rows like the former getHostname() file scan, so
+        rows failing validation can still be looked up.
+
+        Returns:
+            Tuple (hostname, row), hostname lowercased, or (None, None)
+        """
+        if self._lookup is None:
+            by_ip, by_mac, by_host = {}, {}, {}
+            for nr, row in enumerate(self.rows):
+                try:
+                    by_host.setdefault(row[1].lower(), nr)
+                    by_mac.setdefault(row[3].upper(), nr)
+                    by_ip.setdefault(row[4], nr)
+                except IndexError:
+                    continue
+            self._lookup = (by_ip, by_mac, by_host)
+        by_ip, by_mac, by_host = self._lookup
+        hits = [nr for nr in (by_ip.get(search), by_mac.get(search.upper()),
+                              by_host.get(search.lower())) if nr is not None]
+        if not hits:
+            return None, None
+        row = self.rows[min(hits)]
+        return row[1].lower(), row
+
+
+# cache of DeviceIndex instances: (csv_path, school) -> (stamp, index)
+_device_indexes = {}
+
+
+def getDeviceIndex(school='default-school', csv_path=None):
+    """
+    Return a DeviceIndex for the school, reusing a cached one if possible.
+
+    The cached index is rebuilt as soon as devices.csv or subnets.csv change
+    on disk (mtime/size).
+
+    Args:
+        school: School name (default: 'default-school')
+        csv_path: Explicit devices.csv path instead of the school's one
+
+    Returns:
+        DeviceIndex instance
+
+    Raises:
+        IOError: If devices.csv file cannot be opened
+    """
+    if csv_path is None:
+        csv_path = getDevicesCsvPath(school)
+    key = (csv_path, school)
+    stamp = (getFileStamp(csv_path), getFileStamp(environment.SUBNETSCSV))
+    cached = _device_indexes.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    index = DeviceIndex(school, csv_path)
+    _device_indexes[key] = (stamp, index)
+    return index
+
+
+def iterSelectedDevices(fieldnrs='', subnet='', pxeflag='', school='default-school'):
+    """
+    Yield the selected rows of the school's DeviceIndex one at a time.
+
+    The complete DeviceIndex is built (or taken from the cache) first, like
+    for getDevicesArray(); see iterDevicesCsv() for a reader that does not
+    keep the devices in memory.
+    """
+    project = getFieldProjection(fieldnrs)
+    for device in getDeviceIndex(school).select(subnet, pxeflag):
+        yield project(device.row)
+
+
+def iterDevicesCsv(fieldnrs='', subnet='', pxeflag='', school='default-school', csv_path=None):
+    """
+    Read devices.csv row by row and yield the selected rows.
+
+    A streaming reader for callers passing over the devices once: only the
+    current row is held in memory and nothing is cached. The file is read
+    again on every call, so repeated queries should use getDeviceIndex().
+    Filters and result rows are the same as with getDevicesArray().
 
-    return result
+    Args:
+        fieldnrs: Comma-separated field numbers to return (empty=all fields)
+        subnet: Subnet filter ('DHCP', 'all', IP/netmask, or empty for no filter)
+        pxeflag: PXE flag filter (comma-separated values, empty for no filter)
+        school: School name (default: 'default-school')
+        csv_path: Explicit devices.csv path instead of the school's one
+
+    Raises:
+        IOError: If devices.csv file cannot be opened
+    """
+    if csv_path is None:
+        csv_path = getDevicesCsvPath(school)
+    project = getFieldProjection(fieldnrs)
+    for row in _iterDevicesCsvRows(csv_path):
+        is_valid, device = validateDeviceRow(row, school)
+        if is_valid and filterDevices([device], subnet, pxeflag):
+            yield project(device.row)
 
 
 def getDevicesArray(fieldnrs='', subnet='', pxeflag='', school='default-school'):
     """
     Get filtered and validated device array from devices.csv.
 
-    This function orchestrates the device reading, validation, filtering,
-    and transformation process by calling specialized helper functions.
+    Devices are read, validated and grouped once per devices.csv version by
+    getDeviceIndex(); this function only selects and projects them. See
+    iterSelectedDevices() for a variant yielding the projected rows.
 
     Args:
         fieldnrs: Comma-separated field numbers to return (empty=all fields)
-        subnet: Subnet filter ('DHCP', IP/netmask, or empty for no filter)
+        subnet: Subnet filter ('DHCP' for dynamic ip hosts, 'all' for hosts
+                in any subnets.csv network, IP/netmask, or empty for no filter)
         pxeflag: PXE flag filter (comma-separated values, empty for no filter)
         school: School name (default: 'default-school')
 
@@ -262,57 +683,131 @@ def getDevicesArray(fieldnrs='', subnet='', pxeflag='', school='default-school')
         # Get devices in subnet with PXE flags '1' or '3'
         devices = getDevicesArray(subnet='10.0.0.0/16', pxeflag='1,3')
     """
-    # Read CSV file
-    raw_rows = readDevicesCsv(school)
-
-    # Validate and parse each row
-    valid_devices = []
-    for row in raw_rows:
-        is_valid, device = validateDeviceRow(row, school)
-        if is_valid:
-            valid_devices.append(device)
-
-    # Apply filters
-    filtered_devices = filterDevices(valid_devices, subnet, pxeflag)
-
-    # Transform to requested fields
-    devices_array = []
-    for device in filtered_devices:
-        devices_array.append(transformDeviceRow(device, fieldnrs))
-
-    return devices_array
+    return list(iterSelectedDevices(fieldnrs, subnet, pxeflag, school))
 
 
 # read subnets.csv and return subnet array
 # fieldnrs: comma separated list of field nrs to be returned, default is all
 # fields are returned
 def getSubnetArray(fieldnrs=''):
-    infile = open(environment.SUBNETSCSV, newline='')
-    content = csv.reader(infile, delimiter=';', quoting=csv.QUOTE_NONE)
-    subnet_array = []
-    for row in content:
-        # skip rows, which begin with non alphanumeric characters
-        try:
-            if not row[0][0:1].isalnum():
-                continue
-        except Exception:
-            continue
-        try:
-            ipnet = row[0]
-            router = row[1]
-            if IPAddress(router) in IPNetwork(ipnet):
-                # collect fields
-                if fieldnrs == '':
-                    row_res = row
-                else:
-                    row_res = []
-                    for field in fieldnrs.split(','):
-                        row_res.append(row[int(field)])
-                subnet_array.append(row_res)
-        except Exception as error:
-            print(error)
-            continue
-    return subnet_array
+    return getSubnetTable().select(fieldnrs)
+
+
+class DeviceCsvIssue(object):
+    """
+    A problem found in a devices.csv row by checkDevicesCsv().
+
+    Attributes:
+        school: School of the devices.csv
+        path: Path of the devices.csv
+        line: Line number in the file
+        level: 'error' (the row is dropped or conflicts with another one)
+            or 'warning' (the row is imported, but probably not as intended)
+        message: Description of the problem
+    """
+
+    __slots__ = ('school', 'path', 'line', 'level', 'message')
+
+    def __init__(self, school, path, line, level, message):
+        self.school = school
+        self.path = path
+        self.line = line
+        self.level = level
+        self.message = message
+
+    def __str__(self):
+        return f'{self.path}:{self.line}: {self.level}: {self.message}'
+
+    def asDict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _deviceRowError(row, hostname):
+    """Return why validateDeviceRow() rejects a row, None if it is valid."""
+    if len(row) <= 10:
+        return f'{len(row)} fields, at least 11 are required'
+    if not isValidHostname(hostname):
+        return 'invalid hostname ' + hostname
+    if not isValidMac(row[3]):
+        return 'invalid mac address ' + row[3]
+    if row[4] != 'DHCP' and not isValidHostIpv4(row[4]):
+        return 'invalid ip address ' + row[4]
+    return None
+
+
+def checkDevicesCsv(schools=('default-school',), csv_paths=None):
+    """
+    Check the devices.csv files of several schools in one pass.
+
+    Reports with line numbers:
+    - rows validateDeviceRow() would drop (errors)
+    - hostnames, mac and ip addresses used more than once, also across
+      schools, since all schools share one dhcp server (errors)
+    - ip addresses outside of all subnets.csv networks, which get no dhcp
+      host entry (warnings)
+    - PXE groups without start.conf, which boot the unconfigured default
+      start.conf (warnings, once per group)
+
+    Every row costs a few dictionary lookups and one SubnetTable search,
+    so even large inventories are checked in a fraction of a second.
+
+    Args:
+        schools: School names whose devices.csv are checked
+        csv_paths: Dict school -> path of a file to check instead of the
+            school's devices.csv, e.g. an edited copy not yet saved
+
+    Returns:
+        List of DeviceCsvIssue in school and line order
+
+    Raises:
+        IOError: If a devices.csv file cannot be opened
+    """
+    csv_paths = csv_paths or {}
+    issues = []
+    seen = {'hostname': {}, 'mac': {}, 'ip': {}}
+    try:
+        table = getSubnetTable()
+    except Exception:
+        table = None
+        issues.append(DeviceCsvIssue('', environment.SUBNETSCSV, 0, 'warning',
+                                     'cannot read subnets.csv, ip addresses not checked'))
+    groups = {}
+    for school in dict.fromkeys(list(schools) + list(csv_paths)):
+        path = csv_paths.get(school) or getDevicesCsvPath(school)
+
+        def report(line, level, message):
+            issues.append(DeviceCsvIssue(school, path, line, level, message))
+
+        with open(path, newline='') as infile:
+            content = csv.reader(infile, delimiter=';', quoting=csv.QUOTE_NONE)
+            for row in content:
+                # skip rows, which begin with non alphanumeric characters
+                if not row or not row[0][0:1].isalnum():
+                    continue
+                line = content.line_num
+                hostname = row[1] if len(row) > 1 else ''
+                if school != 'default-school':
+                    hostname = school + '-' + hostname
+                error = _deviceRowError(row, hostname)
+                if error is not None:
+                    report(line, 'error', error)
+                    continue
+                keys = {'hostname': hostname.lower(), 'mac': row[3].lower().replace('-', ':')}
+                if row[4] != 'DHCP':
+                    keys['ip'] = row[4]
+                for name, key in keys.items():
+                    first = seen[name].setdefault(key, (path, line))
+                    if first != (path, line):
+                        where = f'line {first[1]}' if first[0] == path else f'{first[0]}:{first[1]}'
+                        report(line, 'error', f'duplicate {name} {key}, first used in {where}')
+                if table is not None and 'ip' in keys and table.match(keys['ip']) is None:
+                    report(line, 'warning', 'ip address ' + keys['ip'] + ' is not in any subnet of subnets.csv')
+                # the pxe flags the import links to a start.conf (pxeflag='1,2,3')
+                if row[10] in ('1', '2', '3') and row[2] not in groups:
+                    groups[row[2]] = True
+                    if not os.path.isfile(environment.LINBODIR + '/start.conf.' + row[2]):
+                        report(line, 'warning', 'pxe group ' + row[2] + ' has no start.conf')
+    return issues
 
 
 def isValidMac(mac):
@@ -349,6 +844,11 @@ def isValidDomainname(domainname):
 
 
 def isValidHostIpv4(ip):
+    # plain dotted quads are checked without parsing them with IPy
+    octets = ip.split('.') if isinstance(ip, str) else []
+    if len(octets) == 4 and all(octet.isascii() and octet.isdigit() for octet in octets):
+        octets = [int(octet) for octet in octets]
+        return 0 < octets[0] <= 254 and octets[1] <= 255 and octets[2] <= 255 and octets[3] <= 254
     try:
         ipv4 = IP(ip)
         if not ipv4.version() == 4:
@@ -371,25 +871,10 @@ def isValidHostIpv4(ip):
 # returns hostname and row from workstations file, search with ip, mac and hostname
 def getHostname(devices, search):
     try:
-        hostname = None
-        hostrow = None
-        f = open(devices, newline='')
-        reader = csv.reader(f, delimiter=';', quoting=csv.QUOTE_NONE)
-        for row in reader:
-            # skip lines
-            if not re.match(r'[a-zA-Z0-9]', row[0]):
-                continue
-            host = row[1]
-            mac = row[3]
-            ip = row[4]
-            if search == ip or search.upper() == mac.upper() or search.lower() == host.lower():
-                hostname = host.lower()
-                hostrow = row
-                break
-        f.close()
+        return getDeviceIndex(csv_path=devices).lookup(search)
     except Exception as error:
         print(error)
-    return hostname, hostrow
+    return None, None
 
 
 # return detected network interfaces
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+#
+# Filename     : omapi.py
+# Description  : Minimal ISC dhcpd OMAPI client to add and remove host objects
+#                of the running server
+# Signed-off by: thomas@linuxmuster.net
+# Assisted by  : Claude
+# Date         : 20261017
+#
+
+import base64
+import hashlib
+import hmac
+import random
+import socket
+import struct
+
+# omapi opcodes
+OMAPI_OP_OPEN = 1
+OMAPI_OP_REFRESH = 2
+OMAPI_OP_UPDATE = 3
+OMAPI_OP_NOTIFY = 4
+OMAPI_OP_STATUS = 5
+OMAPI_OP_DELETE = 6
+
+OMAPI_PROTOCOL_VERSION = 100
+OMAPI_HEADER_SIZE = 24
+OMAPI_HMAC_MD5 = b'hmac-md5.SIG-ALG.REG.INT.'
+
+
+class OmapiError(Exception):
+    """Raised if dhcpd rejects an OMAPI request or the protocol is violated."""
+
+
+def packOmapiDict(items):
+    """Serialize name/value pairs: 16 bit name length, name, 32 bit value length, value."""
+    data = b''
+    for name, value in items.items():
+        data += struct.pack('!H', len(name)) + name + struct.pack('!I', len(value)) + value
+    return data + struct.pack('!H', 0)
+
+
+def macToBytes(mac):
+    return bytes(int(octet, 16) for octet in mac.replace('-', ':').split(':'))
+
+
+class OmapiMessage(object):
+    """A single OMAPI message as sent over the wire.
+
+    Attributes:
+        authid: Handle of the authenticator the message is signed with (0: unsigned)
+        opcode, handle, tid, rid: Message header fields
+        message, obj: Dicts of bytes names to bytes values
+        signature: HMAC-MD5 signature, empty if unsigned
+    """
+
+    def __init__(self, opcode, handle=0, message=None, obj=None, tid=None, rid=0):
+        self.authid = 0
+        self.opcode = opcode
+        self.handle = handle
+        self.tid = random.getrandbits(32) if tid is None else tid
+        self.rid = rid
+        self.message = message or {}
+        self.obj = obj or {}
+        self.signature = b''
+
+    def pack(self, forsigning=False):
+        """Return the message bytes; forsigning leaves out authid and signature."""
+        data = b''
+        if not forsigning:
+            data += struct.pack('!I', self.authid)
+        data += struct.pack('!IIIII', len(self.signature), self.opcode, self.handle, self.tid, self.rid)
+        data += packOmapiDict(self.message) + packOmapiDict(self.obj)
+        if not forsigning:
+            data += self.signature
+        return data
+
+    def sign(self, authid, key):
+        self.authid = authid
+        self.signature = b'\0' * 16
+        self.signature = hmac.new(key, self.pack(forsigning=True), hashlib.md5).digest()
+
+    def verify(self, key):
+        signature = hmac.new(key, self.pack(forsigning=True), hashlib.md5).digest()
+        return hmac.compare_digest(signature, self.signature)
+
+    @property
+    def result(self):
+        """Result code of a status message, 0 if there is none."""
+        value = self.message.get(b'result', b'')
+        return struct.unpack('!I', value)[0] if len(value) == 4 else 0
+
+    @property
+    def text(self):
+        return self.message.get(b'message', b'').decode('utf-8', errors='replace')
+
+
+class OmapiClient(object):
+    """Connection to the OMAPI port of a running ISC dhcpd.
+
+    Usage:
+        with OmapiClient('127.0.0.1', 7911, 'omapi_key', secret) as omapi:
+            omapi.addHost('pc01', '00:11:22:33:44:55', '10.0.0.1')
+
+    Args:
+        host, port: Address of the OMAPI listener (omapi-port in dhcpd.conf)
+        keyname: Name of the omapi-key, None for an unauthenticated connection
+        secret: Base64 encoded HMAC-MD5 secret of the key
+        timeout: Socket timeout in seconds
+    """
+
+    def __init__(self, host, port=7911, keyname=None, secret=None, timeout=5):
+        self.host = host
+        self.port = int(port)
+        self.keyname = keyname
+        self.key = base64.b64decode(secret) if secret else None
+        self.timeout = timeout
+        self.sock = None
+        self.authid = 0
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def connect(self):
+        self.sock = socket.create_connection((self.host, self.port), self.timeout)
+        self.sock.sendall(struct.pack('!II', OMAPI_PROTOCOL_VERSION, OMAPI_HEADER_SIZE))
+        version, header_size = struct.unpack('!II', self._recv(8))
+        if version != OMAPI_PROTOCOL_VERSION or header_size != OMAPI_HEADER_SIZE:
+            raise OmapiError('unsupported omapi protocol version ' + str(version))
+        if self.keyname:
+            response = self.query(OmapiMessage(
+                OMAPI_OP_OPEN, message={b'type': b'authenticator'},
+                obj={b'name': self.keyname.encode(), b'algorithm': OMAPI_HMAC_MD5}))
+            if response.opcode != OMAPI_OP_UPDATE:
+                raise OmapiError('authentication failed: ' + (response.text or 'result ' + str(response.result)))
+            self.authid = response.handle
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _recv(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise OmapiError('connection closed by dhcpd')
+            data += chunk
+        return data
+
+    def _recvDict(self):
+        items = {}
+        while True:
+            namelen = struct.unpack('!H', self._recv(2))[0]
+            if namelen == 0:
+                return items
+            name = self._recv(namelen)
+            valuelen = struct.unpack('!I', self._recv(4))[0]
+            items[name] = self._recv(valuelen)
+
+    def query(self, msg):
+        """Send a message and return the response belonging to it."""
+        if self.authid:
+            msg.sign(self.authid, self.key)
+        self.sock.sendall(msg.pack())
+        authid, authlen, opcode, handle, tid, rid = struct.unpack('!IIIIII', self._recv(OMAPI_HEADER_SIZE))
+        response = OmapiMessage(opcode, handle, tid=tid, rid=rid)
+        response.message = self._recvDict()
+        response.obj = self._recvDict()
+        response.authid = authid
+        response.signature = self._recv(authlen)
+        if response.rid != msg.tid:
+            raise OmapiError('response does not belong to request')
+        if response.authid and not response.verify(self.key):
+            raise OmapiError('invalid response signature')
+        return response
+
+    def _check(self, response, opcode, action):
+        if response.opcode == OMAPI_OP_STATUS and response.result != 0:
+            raise OmapiError(action + ' failed: ' + (response.text or 'result ' + str(response.result)))
+        if response.opcode != opcode:
+            raise OmapiError(action + ' failed: unexpected opcode ' + str(response.opcode))
+        return response
+
+    def lookupHost(self, mac):
+        """Return the handle of the host object with hardware address mac, None if there is none."""
+        response = self.query(OmapiMessage(
+            OMAPI_OP_OPEN, message={b'type': b'host'},
+            obj={b'hardware-address': macToBytes(mac), b'hardware-type': struct.pack('!I', 1)}))
+        if response.opcode != OMAPI_OP_UPDATE:
+            return None
+        return response.handle
+
+    def addHost(self, name, mac, ip=None, statements=None):
+        """Create a host object, ip None for a host without fixed address.
+
+        Args:
+            name: Host declaration name
+            mac: Hardware ethernet address
+            ip: Fixed address or None
+            statements: Further host statements, e.g. 'option host-name "pc01";'
+        """
+        obj = {b'name': name.encode(), b'hardware-address': macToBytes(mac),
+               b'hardware-type': struct.pack('!I', 1)}
+        if ip:
+            obj[b'ip-address'] = socket.inet_aton(ip)
+        if statements:
+            obj[b'statements'] = statements.encode()
+        response = self.query(OmapiMessage(
+            OMAPI_OP_OPEN, obj=obj,
+            message={b'create': struct.pack('!I', 1), b'exclusive': struct.pack('!I', 1),
+                     b'type': b'host'}))
+        self._check(response, OMAPI_OP_UPDATE, 'adding host ' + name)
+
+    def deleteHost(self, mac):
+        """Delete the host object with hardware address mac."""
+        handle = self.lookupHost(mac)
+        if handle is None:
+            raise OmapiError('deleting host ' + mac + ' failed: not found')
+        response = self.query(OmapiMessage(OMAPI_OP_DELETE, handle=handle))
+        self._check(response, OMAPI_OP_STATUS, 'deleting host ' + mac)
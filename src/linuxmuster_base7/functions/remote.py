@@ -4,7 +4,7 @@
 # Description  : OPNsense firewall API and SSH/SCP remote-execution helpers
 # Signed-off by: thomas@linuxmuster.net
 # Assisted by  : Claude
-# Date         : 20260818
+# Date         : 20261017
 #
 
 import configparser
@@ -15,11 +15,15 @@ import sys
 sys.path.insert(0, '/usr/lib/linuxmuster')
 import environment
 import requests
+import threading
 import time
 import urllib3
 import warnings
 
+from requests.adapters import HTTPAdapter
+
 from .core import getSetupValue, printScript
+from .files import getFileStamp
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 warnings.filterwarnings(action='ignore', module='.*paramiko.*')
@@ -57,43 +61,212 @@ def waitForFw(timeout=300, wait=0):
         time.sleep(2)
 
 
-# firewall api get request
-def firewallApi(request, path, data='', retries=3, retry_wait=3):
-    domainname = getSetupValue('domainname')
-    fwapi = configparser.RawConfigParser(delimiters=('='))
-    fwapi.read(environment.FWAPIKEYS)
-    apikey = fwapi.get('api', 'key')
-    apisecret = fwapi.get('api', 'secret')
-    headers = {'content-type': 'application/json'}
-    url = 'https://firewall.' + domainname + '/api' + path
-
-    for attempt in range(1, retries + 1):
-        try:
-            if request == 'get':
-                req = requests.get(url, auth=(apikey, apisecret), verify=False, timeout=30)
-            elif request == 'post' and data == '':
-                req = requests.post(url, auth=(apikey, apisecret), verify=False, timeout=30)
-            elif request == 'post' and data != '':
-                req = requests.post(url, data=data, auth=(
-                    apikey, apisecret), headers=headers, verify=False, timeout=30)
-            else:
-                return None
-        except requests.exceptions.RequestException as error:
-            printScript(f'* Firewall API connection error (attempt {attempt}/{retries}): {error}')
-            if attempt < retries:
-                time.sleep(retry_wait)
+class FirewallApiError(Exception):
+    """Raised if an OPNsense API request fails.
+
+    Attributes:
+        status: HTTP status code, None if no response was received
+        response: Response text or the connection error message
+    """
+
+    def __init__(self, message, status=None, response=''):
+        super().__init__(message)
+        self.status = status
+        self.response = response
+
+
+class FirewallClient(object):
+    """
+    Client of the OPNsense API using one keep-alive requests.Session.
+
+    Domain name and API credentials are read once on construction, the
+    session's connection pool keeps the TLS connection to the firewall open
+    between requests, so a run with dozens of API calls does the handshake
+    only once. Failed connections and the 502/503/504 answers of a
+    restarting web stack are retried, waiting retry_wait seconds before the
+    second attempt and backoff times longer before every further one.
+    Use getFirewallClient() to get a shared instance.
+
+    Attributes:
+        baseurl: API url, e.g. https://firewall.linuxmuster.lan/api
+        retries: Attempts per request
+        retry_wait: Seconds to wait before the first retry
+        backoff: Factor the wait grows by with every further retry
+        max_wait: Upper bound of the wait between two attempts
+        timeout: Seconds to wait for a response
+        requests: Number of HTTP requests sent (including retries)
+
+    The client may be shared by several threads, poolsize connections are
+    kept open for them.
+    """
+
+    RETRY_STATUS = (502, 503, 504)
+
+    def __init__(self, baseurl=None, apikey=None, apisecret=None, retries=3,
+                 retry_wait=3, backoff=2, max_wait=30, timeout=30, poolsize=16):
+        if baseurl is None:
+            baseurl = 'https://firewall.' + getSetupValue('domainname') + '/api'
+        if apikey is None or apisecret is None:
+            fwapi = configparser.RawConfigParser(delimiters=('='))
+            fwapi.read(environment.FWAPIKEYS)
+            apikey = fwapi.get('api', 'key')
+            apisecret = fwapi.get('api', 'secret')
+        self.baseurl = baseurl.rstrip('/')
+        self.retries = retries
+        self.retry_wait = retry_wait
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.auth = (apikey, apisecret)
+        self.session.verify = False
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolsize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def request(self, method, path, data=None, retries=None, retry_wait=None):
+        """
+        Send an API request and return the decoded JSON response.
+
+        Args:
+            method: 'get' or 'post'
+            path: API path below baseurl, e.g. '/routes/routes/searchroute'
+            data: Request body for post, dict or JSON string (None: no body)
+            retries: Attempts for this request instead of self.retries
+            retry_wait: Seconds before the first retry instead of self.retry_wait
+
+        Raises:
+            FirewallApiError: If the firewall cannot be reached after all
+                attempts or answers with another status than 200
+        """
+        if method not in ('get', 'post'):
+            raise FirewallApiError('unsupported request ' + method)
+        retries = retries or self.retries
+        kwargs = {'timeout': self.timeout}
+        if data is not None and data != '':
+            kwargs['data'] = data if isinstance(data, str) else json.dumps(data)
+            kwargs['headers'] = {'content-type': 'application/json'}
+        url = self.baseurl + path
+        wait = self.retry_wait if retry_wait is None else retry_wait
+        for attempt in range(1, retries + 1):
+            if attempt > 1:
+                time.sleep(wait)
+                wait = min(wait * self.backoff, self.max_wait)
+            with self._lock:
+                self.requests += 1
+            try:
+                req = self.session.request(method, url, **kwargs)
+            except requests.exceptions.RequestException as error:
+                printScript(f'* Firewall API connection error (attempt {attempt}/{retries}): {error}')
+                if attempt < retries:
+                    continue
+                raise FirewallApiError(f'{method} {path}: {error}', response=str(error))
+            if req.status_code in self.RETRY_STATUS and attempt < retries:
+                printScript(f'* Firewall API not ready (attempt {attempt}/{retries}): {req.status_code}')
                 continue
-            return None
+            if req.status_code != 200:
+                raise FirewallApiError(f'{method} {path}: status {req.status_code}',
+                                       req.status_code, req.text)
+            try:
+                return req.json()
+            except ValueError:
+                raise FirewallApiError(f'{method} {path}: invalid JSON response',
+                                       req.status_code, req.text)
 
-        # get response
-        if req.status_code == 200:
-            return json.loads(req.text)
-        else:
-            printScript('Connection / Authentication issue, response received:')
-            print(req.text)
-            return None
+    def get(self, path, retries=None):
+        return self.request('get', path, retries=retries)
+
+    def post(self, path, data=None, retries=None):
+        return self.request('post', path, data, retries)
+
+    def search(self, path):
+        """Return the rows of a search endpoint, e.g. search_gateway."""
+        return self.get(path).get('rows', [])
+
+    def add(self, path, item_key, item):
+        """
+        Create an item, e.g. add('/routes/routes/addroute', 'route', {...}).
+
+        Returns:
+            UUID of the new item
+
+        Raises:
+            FirewallApiError: Also if the firewall did not save the item,
+                e.g. because of validation errors
+        """
+        res = self.post(path, {item_key: item})
+        if res.get('result') != 'saved':
+            raise FirewallApiError(f'post {path}: {res}', 200, json.dumps(res))
+        return res.get('uuid')
+
+    def set(self, path, uuid, item_key, item):
+        """Change fields of an item, path is the set endpoint incl. trailing slash."""
+        res = self.post(path + uuid, {item_key: item})
+        if res.get('result') != 'saved':
+            raise FirewallApiError(f'post {path}{uuid}: {res}', 200, json.dumps(res))
+
+    def delete(self, path, uuid):
+        """Delete an item by uuid, path is the del endpoint incl. trailing slash."""
+        res = self.post(path + uuid)
+        if res.get('result') != 'deleted':
+            raise FirewallApiError(f'post {path}{uuid}: {res}', 200, json.dumps(res))
+
+    def apply(self, path):
+        """Activate the saved configuration, e.g. via reconfigure or apply."""
+        res = self.post(path)
+        if res.get('status', 'ok').strip().lower() != 'ok':
+            raise FirewallApiError(f'post {path}: {res}', 200, json.dumps(res))
+        return res
+
+
+# shared FirewallClient: (stamp, client)
+_firewall_client = None
+_firewall_client_lock = threading.Lock()
 
-    return None
+
+def getFirewallClient():
+    """
+    Return the shared FirewallClient, creating it on first use.
+
+    The client is recreated as soon as setup.ini or the API keys file
+    change on disk (mtime/size), e.g. after the firewall setup created new
+    API keys.
+    """
+    global _firewall_client
+    stamp = (getFileStamp(environment.SETUPINI), getFileStamp(environment.FWAPIKEYS))
+    with _firewall_client_lock:
+        if _firewall_client is not None and _firewall_client[0] == stamp:
+            return _firewall_client[1]
+        if _firewall_client is not None:
+            _firewall_client[1].close()
+        client = FirewallClient()
+        _firewall_client = (stamp, client)
+        return client
+
+
+# firewall api request, kept for compatibility, see FirewallClient
+def firewallApi(request, path, data='', retries=3, retry_wait=3):
+    try:
+        return getFirewallClient().request(request, path, data, retries, retry_wait)
+    except FirewallApiError as error:
+        if error.status is not None:
+            printScript('Connection / Authentication issue, response received:')
+            print(error.response)
+        return None
+    except Exception as error:
+        print(error)
+        return None
 
 
 # check firewall's major version
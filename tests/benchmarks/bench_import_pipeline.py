@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+#
+# benchmark the import-devices/import-subnets code paths on generated inventories
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Benchmark the steps of linuxmuster-import-devices and -import-subnets
+against generated inventories (see inventory.py), offline: no sophomorix,
+no dhcpd, no firewall.
+
+Steps timed per inventory size:
+  readSubnetsCSV        import_subnets: parse and validate subnets.csv
+  getSubnetTable        cached ip -> subnet table
+  getDeviceIndex        parse, validate and group devices.csv
+  getDevicesArray       filtered device projection (subnet + pxe filter)
+  writeDhcpDevicesConfig + activateDhcpConfig
+  doPxeGroupsBySchool   links csv of the school
+  doAllGroupLinks       reconcile the start.conf/grub.cfg symlinks
+  readStartconf         parse every group's start.conf
+  processLinboGroups    start.conf check and grub.cfg generation per group
+
+The steps run in pipeline order, repeat times, each time starting with
+cleared caches and without generated files; the best time per step is
+recorded. Peak memory is measured with tracemalloc in a separate run.
+
+Usage:
+  python3 tests/benchmarks/bench_import_pipeline.py [-p <sizes>] [-r <repeat>]
+      [-o <results.json>] [-b <baseline.json>] [-t <percent>]
+
+  -p, --sizes     comma separated: small (1k devices, 10 subnets, 5 groups),
+                  medium (10k, 100, 50), large (50k, 500, 300);
+                  default: small,medium
+  -r, --repeat    runs per step, default 3
+  -o, --output    write the results as JSON, e.g. to be used as a baseline
+  -b, --baseline  compare with a previous results file
+  -t, --threshold percent a step may be slower than the baseline before it
+                  counts as regression (default 20); exits 1 on regressions
+"""
+
+import contextlib
+import datetime
+import getopt
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, '/usr/lib/linuxmuster')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import inventory  # noqa: E402
+
+SIZES = {
+    'small':  (1000, 10, 5),
+    'medium': (10000, 100, 50),
+    'large':  (50000, 500, 300),
+}
+
+
+def getSteps():
+    """Return the (name, function) list of benchmarked steps.
+
+    Imported here, after setEnvironmentRoot(), because the cli modules
+    derive paths from environment at import time.
+    """
+    import environment
+    from linuxmuster_base7.cli import import_devices, import_subnets
+    from linuxmuster_base7.functions import dhcp, linbo, network
+
+    import_devices._dhcp_backend = dhcp.IscDhcpBackend()
+    import_devices.logToFile = lambda msg: None
+
+    def groups():
+        return sorted(set(device.group for device in network.getDeviceIndex().select('')
+                          if device.pxe != '0'))
+
+    def devicesArray():
+        return network.getDevicesArray(fieldnrs='1,2,3,4', subnet='DHCP', pxeflag='1,2,3')
+
+    def dhcpConfig():
+        import_devices.writeDhcpDevicesConfig(index=network.getDeviceIndex())
+        import_devices.activateDhcpConfig()
+
+    def startconfs():
+        for group in groups():
+            linbo.readStartconf(environment.LINBODIR + '/start.conf.' + group)
+
+    return [
+        ('readSubnetsCSV', lambda: import_subnets.readSubnetsCSV('10.0.0.0/16')),
+        ('getSubnetTable', network.getSubnetTable),
+        ('getDeviceIndex', network.getDeviceIndex),
+        ('getDevicesArray', devicesArray),
+        ('writeDhcpDevicesConfig', dhcpConfig),
+        ('doPxeGroupsBySchool', lambda: import_devices.doPxeGroupsBySchool(index=network.getDeviceIndex())),
+        ('doAllGroupLinks', import_devices.doAllGroupLinks),
+        ('readStartconf', startconfs),
+        ('processLinboGroups', lambda: import_devices.processLinboGroups(groups())),
+    ]
+
+
+def clearCaches():
+    from linuxmuster_base7.cli import import_devices
+    from linuxmuster_base7.functions import linbo, network
+    network._device_indexes.clear()
+    network._subnet_table = None
+    linbo._startconfs.clear()
+    linbo._grubtemplates.clear()
+    import_devices._dhcp_staging.discard()
+
+
+def runSteps(root, steps, measure):
+    """Run all steps once on fresh outputs and caches, return {step: measure result}.
+
+    The steps run in pipeline order, so a step finds what the earlier ones
+    cached or wrote, e.g. getDevicesArray uses the index getDeviceIndex built.
+    """
+    inventory.resetOutputs(root)
+    clearCaches()
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, func in steps:
+            results[name] = measure(func)
+    return results
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def peakMemory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(root, size, repeat):
+    devices, subnets, groups = SIZES[size]
+    inventory.writeInventory(root, devices, subnets, groups)
+    steps = getSteps()
+    timings = [runSteps(root, steps, timed) for nr in range(repeat)]
+    memory = runSteps(root, steps, peakMemory)
+    return {'devices': devices, 'subnets': subnets, 'groups': groups,
+            'steps': {name: {'seconds': round(min(run[name] for run in timings), 6),
+                             'peak_bytes': memory[name]}
+                      for name, func in steps}}
+
+
+def compare(results, baseline, threshold):
+    """Print the change of every step against baseline, return the regressions."""
+    regressions = []
+    for size, current in results['sizes'].items():
+        old = baseline.get('sizes', {}).get(size)
+        if old is None:
+            continue
+        print(f'{size}: compared with baseline of {baseline.get("created", "?")}')
+        for name, values in current['steps'].items():
+            if name not in old['steps']:
+                continue
+            before = old['steps'][name]['seconds']
+            change = (values['seconds'] - before) / max(before, 1e-9) * 100
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions.append(size + '/' + name)
+            print(f'  {name: <24} {before:9.4f} s -> {values["seconds"]:9.4f} s {change:+7.1f} %{flag}')
+    return regressions
+
+
+def main():
+    sizes = ['small', 'medium']
+    repeat = 3
+    output = baseline = None
+    threshold = 20.0
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "b:o:p:r:t:",
+                                   ["baseline=", "output=", "sizes=", "repeat=", "threshold="])
+    except getopt.GetoptError as err:
+        print(err)
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-p", "--sizes"):
+            sizes = a.split(',')
+        elif o in ("-r", "--repeat"):
+            repeat = int(a)
+        elif o in ("-o", "--output"):
+            output = a
+        elif o in ("-b", "--baseline"):
+            baseline = a
+        elif o in ("-t", "--threshold"):
+            threshold = float(a)
+    for size in sizes:
+        if size not in SIZES:
+            print('Unknown size ' + size + ', use one of ' + ', '.join(SIZES))
+            sys.exit(2)
+
+    results = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(), 'machine': platform.machine(),
+               'repeat': repeat, 'sizes': {}}
+    with tempfile.TemporaryDirectory() as root:
+        inventory.setEnvironmentRoot(root)
+        for size in sizes:
+            result = benchmark(root, size, repeat)
+            results['sizes'][size] = result
+            print(f'{size}: {result["devices"]} devices, {result["subnets"]} subnets, '
+                  f'{result["groups"]} groups')
+            for name, values in result['steps'].items():
+                print(f'  {name: <24} {values["seconds"]:9.4f} s {values["peak_bytes"] / 2**20:9.1f} MiB')
+
+    if output:
+        with open(output, 'w') as outfile:
+            json.dump(results, outfile, indent=2)
+            outfile.write('\n')
+    if baseline:
+        with open(baseline) as infile:
+            regressions = compare(results, json.load(infile), threshold)
+        if regressions:
+            print('Regressions: ' + ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
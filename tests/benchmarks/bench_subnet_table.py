@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+#
+# benchmark ip -> subnet resolution against a synthetic subnets.csv
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Benchmark SubnetTable lookups against the former per-call linear scan.
+
+Generates a subnets.csv with N /24 networks and M device addresses spread
+over them (plus some outside of every subnet), then times resolving every
+address with
+  - legacy: re-parse subnets.csv and test IPNetwork membership linearly,
+    which is what ipMatchSubnet(ip, 'all') / getIpSubnet() did per call
+  - table:  getIpSubnet() backed by the cached, bisected SubnetTable
+
+Usage:
+  python3 tests/benchmarks/bench_subnet_table.py [-s <subnets>] [-d <devices>]
+
+Defaults to 250 subnets x 10000 devices. Needs linuxmuster-common's
+environment.py importable, like the package itself.
+"""
+
+import csv
+import getopt
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, '/usr/lib/linuxmuster')
+import environment  # noqa: E402
+
+from netaddr import IPAddress, IPNetwork  # noqa: E402
+
+from linuxmuster_base7.functions import network  # noqa: E402
+
+
+def writeSubnetsCsv(path, count):
+    """Write count /24 subnets 10.<a>.<b>.0/24 with router .254."""
+    with open(path, 'w') as outfile:
+        outfile.write('# generated by bench_subnet_table.py\n')
+        for nr in range(count):
+            net = '10.' + str(nr // 256) + '.' + str(nr % 256)
+            outfile.write(net + '.0/24;' + net + '.254;' + net + '.100;' + net + '.200;;;\n')
+
+
+def makeAddresses(subnets, devices, seed=42):
+    """Return device addresses, 5% of them outside of every subnet."""
+    rnd = random.Random(seed)
+    addresses = []
+    for nr in range(devices):
+        if nr % 20 == 0:
+            addresses.append('172.16.' + str(rnd.randint(0, 255)) + '.' + str(rnd.randint(1, 254)))
+            continue
+        snr = rnd.randrange(subnets)
+        addresses.append('10.' + str(snr // 256) + '.' + str(snr % 256) + '.' + str(rnd.randint(1, 99)))
+    return addresses
+
+
+def legacyIpSubnet(ip):
+    """Reference implementation: parse subnets.csv and scan linearly."""
+    with open(environment.SUBNETSCSV, newline='') as infile:
+        for row in csv.reader(infile, delimiter=';', quoting=csv.QUOTE_NONE):
+            if not row or not row[0][0:1].isalnum():
+                continue
+            if IPAddress(row[1]) in IPNetwork(row[0]) and IPAddress(ip) in IPNetwork(row[0]):
+                return row[0]
+
+
+def timeit(func, addresses):
+    start = time.perf_counter()
+    result = [func(ip) for ip in addresses]
+    return time.perf_counter() - start, result
+
+
+def main():
+    subnets = 250
+    devices = 10000
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "d:s:", ["devices=", "subnets="])
+    except getopt.GetoptError as err:
+        print(err)
+        sys.exit(2)
+    for o, a in opts:
+        if o in ("-d", "--devices"):
+            devices = int(a)
+        elif o in ("-s", "--subnets"):
+            subnets = int(a)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        environment.SUBNETSCSV = os.path.join(tmpdir, 'subnets.csv')
+        writeSubnetsCsv(environment.SUBNETSCSV, subnets)
+        addresses = makeAddresses(subnets, devices)
+
+        print(f'{subnets} subnets x {devices} devices')
+        legacy_time, legacy_result = timeit(legacyIpSubnet, addresses)
+        print(f'  legacy linear scan : {legacy_time:8.3f} s')
+        table_time, table_result = timeit(network.getIpSubnet, addresses)
+        print(f'  SubnetTable        : {table_time:8.3f} s')
+        if legacy_result != table_result:
+            print('  results differ!')
+            sys.exit(1)
+        print(f'  speedup            : {legacy_time / max(table_time, 1e-9):8.1f} x')
+
+
+if __name__ == '__main__':
+    main()
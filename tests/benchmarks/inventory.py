@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+#
+# synthetic school inventories for the benchmarks
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Generators for realistic, reproducible inventories: subnets.csv,
+devices.csv, multi-OS start.confs per LINBO group and the files LINBO
+provides (grub templates, linbo-version), all below one environment root.
+
+setEnvironmentRoot() points linuxmuster-common's environment module to the
+root. It has to be called before linuxmuster_base7 modules that derive
+paths from environment at import time (cli.import_devices, functions.dhcp)
+are imported.
+"""
+
+import math
+import os
+import random
+import shutil
+
+import environment
+
+# grub templates as shipped by linuxmuster-linbo7, reduced to the placeholders
+GRUB_TEMPLATES = {
+    'grub.cfg.global': ('### managed by linuxmuster.net ###\n'
+                        'set group=@@group@@\nset cachelabel=@@cachelabel@@\n'
+                        'set cacheroot=@@cacheroot@@\nset kopts="@@kopts@@"\n'),
+    'grub.cfg.os': ('menuentry "@@osname@@ (start)" --class @@ostype@@ {\n'
+                    '  set root="@@osroot@@" # @@oslabel@@ @@partnr@@ os @@osnr@@\n'
+                    '  linux @@kernel@@ @@append@@ @@kopts@@\n  initrd @@initrd@@\n'
+                    '  # @@baseimage@@ @@cacheroot@@ @@cachelabel@@ @@group@@\n}\n'),
+    'grub.cfg.os-iso': 'menuentry "@@osname@@ (iso)" { loopback loop @@baseimage@@ }\n',
+    'grub.cfg.forced_netboot': '### managed by linuxmuster.net ###\n# forced netboot\n',
+}
+
+OPERATING_SYSTEMS = [
+    ('Windows 11', 'win11.qcow2', 'ntfs', '60G', 'auto', '', ''),
+    ('Ubuntu 24.04', 'ubuntu.qcow2', 'ext4', '40G', 'boot/vmlinuz', 'boot/initrd.img', 'ro splash'),
+    ('Debian 13', 'debian.qcow2', 'ext4', '30G', 'vmlinuz', 'initrd.img', 'ro quiet'),
+    ('Rescue', 'rescue.iso', 'ext4', '5G', 'vmlinuz', 'initrd.img', 'ro'),
+]
+
+
+def setEnvironmentRoot(root):
+    """Redirect every environment path used by the import code paths below root."""
+    environment.LOGDIR = root + '/var/log/linuxmuster'
+    environment.SYSDIR = root + '/etc/linuxmuster'
+    environment.SOPHOSYSDIR = environment.SYSDIR + '/sophomorix'
+    environment.SUBNETSCSV = environment.SYSDIR + '/subnets.csv'
+    environment.SETUPINI = root + '/var/lib/linuxmuster/setup.ini'
+    environment.LINBODIR = root + '/srv/linbo'
+    environment.LINBOGRUBDIR = environment.LINBODIR + '/boot/grub'
+    environment.LINBOTPLDIR = root + '/usr/share/linuxmuster/linbo/templates'
+    environment.LINBOVERFILE = environment.LINBODIR + '/linbo-version'
+    environment.DHCPDEVCONF = root + '/etc/dhcp/devices.conf'
+    environment.DHCPSUBCONF = root + '/etc/dhcp/subnets.conf'
+    environment.POSTDEVIMPORT = environment.SYSDIR + '/hooks/device-import.post.d'
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as outfile:
+        outfile.write(content)
+
+
+def makeSubnets(count, devices):
+    """Return count subnets (network, prefix) large enough for their share of devices.
+
+    Every subnet keeps room for its dhcp range (.100-.199 of the last /24
+    block) and the router at the last usable address.
+    """
+    per_subnet = math.ceil(devices / count) + 256
+    prefix = min(24, 32 - math.ceil(math.log2(per_subnet)))
+    size = 2 ** (32 - prefix)
+    base = 10 << 24
+    return [(base + nr * size, prefix) for nr in range(count)]
+
+
+def _ip(value):
+    return '.'.join(str((value >> shift) & 255) for shift in (24, 16, 8, 0))
+
+
+def writeSubnetsCsv(path, subnets):
+    """Write subnets.csv, the first subnet is the server network."""
+    lines = ['# generated benchmark inventory']
+    for nr, (network, prefix) in enumerate(subnets):
+        last = network + 2 ** (32 - prefix) - 1
+        lines.append(';'.join([_ip(network) + '/' + str(prefix), _ip(last - 1),
+                               _ip(last - 155), _ip(last - 56), '', '',
+                               'SETUP' if nr == 0 else '']))
+    _write(path, '\n'.join(lines) + '\n')
+
+
+def makeDevices(count, subnets, groups, seed=42):
+    """Return count devices.csv rows spread over subnets and groups.
+
+    About 5% of the devices get their address by dhcp, 10% are non-PXE
+    printers and 3% carry extra dhcp options.
+    """
+    rnd = random.Random(seed)
+    rows = []
+    used = {}
+    for nr in range(count):
+        hostname = 'pc%05d' % nr
+        mac = '00:16:3e:%02x:%02x:%02x' % ((nr >> 16) & 255, (nr >> 8) & 255, nr & 255)
+        network, prefix = subnets[nr % len(subnets)]
+        if nr % 20 == 19:
+            ip = 'DHCP'
+        else:
+            host = used.get(network, 0) + 1
+            used[network] = host
+            ip = _ip(network + host)
+        if nr % 10 == 9:
+            group, role, pxe = 'printer', 'printer', '0'
+        else:
+            group = groups[rnd.randrange(len(groups))]
+            role, pxe = 'classroom-studentcomputer', rnd.choice('1111112223')
+        dhcpopts = 'option grubmenu "' + group + '"' if nr % 33 == 0 else ''
+        room = 'r%03d' % (nr // 30)
+        rows.append(';'.join([room, hostname, group, mac, ip, '', '', dhcpopts, role, '', pxe]))
+    return rows
+
+
+def makeStartconf(group, oses):
+    """Return a start.conf with a partition and an OS section per OS."""
+    lines = ['[LINBO]', 'Cache = /dev/sda%d' % (len(oses) + 2), 'Server = 10.0.0.1',
+             'Group = ' + group, 'SystemType = efi64', 'KernelOptions = quiet splash', '',
+             '[Partition]', 'Dev = /dev/sda1', 'Label = efi', 'Size = 200M', 'Id = ef',
+             'FSType = vfat', 'Bootable = yes', '']
+    for nr, (name, image, fstype, size, kernel, initrd, append) in enumerate(oses):
+        lines += ['[Partition]', 'Dev = /dev/sda%d' % (nr + 2), 'Label = os%d' % nr,
+                  'Size = ' + size, 'FSType = ' + fstype, '']
+    lines += ['[Partition]', 'Dev = /dev/sda%d' % (len(oses) + 2), 'Label = cache',
+              'Size =', 'FSType = ext4', '']
+    for nr, (name, image, fstype, size, kernel, initrd, append) in enumerate(oses):
+        lines += ['[OS]', 'Name = ' + name, 'BaseImage = ' + image,
+                  'Root = /dev/sda%d # os partition' % (nr + 2), 'Kernel = ' + kernel,
+                  'Initrd = ' + initrd, 'Append = ' + append, 'StartEnabled = yes', '']
+    return '\n'.join(lines)
+
+
+def writeInventory(root, devices, subnets, groups, seed=42):
+    """Create a complete environment root with a generated inventory.
+
+    Removes what a previous call left below root. setEnvironmentRoot(root)
+    must have been called.
+
+    Args:
+        root: Environment root directory
+        devices, subnets, groups: Number of devices, subnets and LINBO groups
+
+    Returns:
+        Dict with the generated numbers
+    """
+    for sub in ('etc', 'srv', 'var', 'usr'):
+        shutil.rmtree(os.path.join(root, sub), ignore_errors=True)
+    rnd = random.Random(seed)
+    subnet_list = makeSubnets(subnets, devices)
+    writeSubnetsCsv(environment.SUBNETSCSV, subnet_list)
+    group_names = ['g%03d' % nr for nr in range(groups)]
+    rows = makeDevices(devices, subnet_list, group_names, seed)
+    _write(environment.SOPHOSYSDIR + '/default-school/devices.csv', '\n'.join(rows) + '\n')
+    for group in group_names:
+        oses = rnd.sample(OPERATING_SYSTEMS, rnd.randint(1, len(OPERATING_SYSTEMS)))
+        _write(environment.LINBODIR + '/start.conf.' + group, makeStartconf(group, oses))
+    _write(environment.LINBODIR + '/start.conf', '[LINBO]\nServer = 10.0.0.1\nGroup = default\n')
+    _write(environment.LINBOVERFILE, 'LINBO 4.3.5: Benchmark\n')
+    for name, content in GRUB_TEMPLATES.items():
+        _write(environment.LINBOTPLDIR + '/' + name, content)
+    _write(environment.SETUPINI, '[setup]\nserverip = 10.0.0.1\ndomainname = linuxmuster.lan\n')
+    for directory in (environment.LOGDIR, environment.LINBOGRUBDIR + '/hostcfg',
+                      os.path.dirname(environment.DHCPDEVCONF), environment.POSTDEVIMPORT):
+        os.makedirs(directory, exist_ok=True)
+    return {'devices': devices, 'subnets': subnets, 'groups': groups}
+
+
+def resetOutputs(root):
+    """Remove everything the import code paths generated below root."""
+    shutil.rmtree(os.path.dirname(environment.DHCPDEVCONF), ignore_errors=True)
+    os.makedirs(os.path.dirname(environment.DHCPDEVCONF))
+    shutil.rmtree(environment.LINBOGRUBDIR, ignore_errors=True)
+    os.makedirs(environment.LINBOGRUBDIR + '/hostcfg')
+    shutil.rmtree(environment.LINBODIR + '/boot/links', ignore_errors=True)
+    for name in os.listdir(environment.LINBODIR):
+        if name.startswith('start.conf-'):
+            os.unlink(os.path.join(environment.LINBODIR, name))
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+#
+# stand-in kernel routing table for tests
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+A routing table answering the 'ip' calls of linuxmuster-import-subnets in
+place of subprocess.run: 'ip -j -4 route show dev <iface> proto static'
+and 'ip -batch -' with 'route replace' and 'route del' commands. Like ip
+without -force, a batch stops at the first failing command; the commands
+before it stay applied.
+
+Usage:
+    table = FakeRouteTable('eth0', '10.0.0.1/16')
+    table.addRoute('default', '10.0.0.254')
+    monkeypatch.setattr(import_subnets.subprocess, 'run', table.run)
+    ...
+    table.routes   # {dst: (gateway, protocol)}
+    table.batches  # [[command, ...]], one list per ip -batch call
+"""
+
+import ipaddress
+import json
+import subprocess
+
+
+class FakeRouteTable(object):
+
+    def __init__(self, iface='eth0', address='10.0.0.1/16'):
+        self.iface = iface
+        self.network = ipaddress.ip_interface(address).network
+        self.routes = {}
+        self.batches = []
+        self.fail = False
+
+    def addRoute(self, dst, gateway, protocol='static'):
+        self.routes[dst] = (gateway, protocol)
+
+    def _route(self, words):
+        """Execute one 'route replace|del <dst> via <gw> dev <iface> ...' command."""
+        op, dst = words[1], words[2]
+        options = dict(zip(words[3::2], words[4::2]))
+        if options.get('dev') != self.iface:
+            return 'Cannot find device "%s"' % options.get('dev')
+        gateway = options.get('via')
+        if op == 'replace':
+            if ipaddress.ip_address(gateway) not in self.network:
+                return 'Error: Nexthop has invalid gateway.'
+            self.routes[dst] = (gateway, options.get('proto', 'boot'))
+        elif op == 'del':
+            if dst not in self.routes or (gateway and self.routes[dst][0] != gateway):
+                return 'RTNETLINK answers: No such process'
+            del self.routes[dst]
+        else:
+            return 'Command "%s" is unknown' % op
+        return None
+
+    def run(self, cmd, input=None, capture_output=False, text=False, check=False):
+        if cmd[:4] == ['ip', '-j', '-4', 'route']:
+            dev = cmd[cmd.index('dev') + 1]
+            rows = []
+            if dev == self.iface:
+                rows.append({'dst': str(self.network), 'protocol': 'kernel', 'scope': 'link',
+                             'prefsrc': '', 'flags': []})
+                for dst, (gateway, protocol) in sorted(self.routes.items()):
+                    if protocol == 'static':
+                        rows.append({'dst': dst, 'gateway': gateway, 'protocol': protocol, 'flags': []})
+            return subprocess.CompletedProcess(cmd, 0, json.dumps(rows), '')
+        if cmd == ['ip', '-batch', '-']:
+            commands = [line for line in input.split('\n') if line]
+            self.batches.append(commands)
+            if self.fail:
+                return subprocess.CompletedProcess(cmd, 1, '', 'RTNETLINK answers: Operation not permitted')
+            for nr, command in enumerate(commands, 1):
+                error = self._route(command.split())
+                if error:
+                    return subprocess.CompletedProcess(
+                        cmd, 2, '', '%s\nCommand failed -:%d' % (error, nr))
+            return subprocess.CompletedProcess(cmd, 0, '', '')
+        raise FileNotFoundError(cmd[0])
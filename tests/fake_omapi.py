@@ -0,0 +1,153 @@
+#!/usr/bin/python3
+#
+# stand-in OMAPI listener of isc-dhcp-server for tests
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+A small threaded TCP server speaking the subset of OMAPI used by
+linuxmuster_base7.functions.omapi: startup handshake, hmac-md5
+authenticator, host create/lookup and delete.
+
+Usage:
+    with FakeOmapiServer('omapi_key', secret) as server:
+        ...  # connect to server.port
+        server.hosts  # {'00:11:22:33:44:55': {'name': ..., 'ip': ..., 'statements': ...}}
+"""
+
+import base64
+import hashlib
+import hmac
+import socket
+import socketserver
+import struct
+import threading
+
+OPEN, UPDATE, STATUS, DELETE = 1, 3, 5, 6
+# isc result codes
+NOT_FOUND, EXISTS, NO_PERM = 23, 18, 20
+
+
+def _recv(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def _recvDict(sock):
+    items = {}
+    while True:
+        namelen, = struct.unpack('!H', _recv(sock, 2))
+        if not namelen:
+            return items
+        name = _recv(sock, namelen)
+        valuelen, = struct.unpack('!I', _recv(sock, 4))
+        items[name] = _recv(sock, valuelen)
+
+
+def _packDict(items):
+    data = b''.join(struct.pack('!H', len(k)) + k + struct.pack('!I', len(v)) + v
+                    for k, v in items.items())
+    return data + b'\0\0'
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server
+        sock = self.request
+        try:
+            _recv(sock, 8)
+            sock.sendall(struct.pack('!II', 100, 24))
+            authid = 0
+            while True:
+                req_authid, authlen, opcode, handle, tid, rid = struct.unpack('!6I', _recv(sock, 24))
+                message = _recvDict(sock)
+                obj = _recvDict(sock)
+                signature = _recv(sock, authlen)
+                if req_authid:
+                    body = (struct.pack('!5I', authlen, opcode, handle, tid, rid)
+                            + _packDict(message) + _packDict(obj))
+                    expected = hmac.new(server.key, body, hashlib.md5).digest()
+                    if req_authid != authid or not hmac.compare_digest(expected, signature):
+                        self._reply(0, STATUS, 0, tid, {b'result': struct.pack('!I', NO_PERM),
+                                                        b'message': b'invalid signature'})
+                        continue
+                elif server.keyname and message.get(b'type') != b'authenticator':
+                    self._reply(0, STATUS, 0, tid, {b'result': struct.pack('!I', NO_PERM),
+                                                    b'message': b'not authenticated'})
+                    continue
+                server.requests.append((opcode, message.get(b'type'), obj))
+                resp_opcode, resp_handle, resp_message = self._dispatch(opcode, handle, message, obj)
+                if resp_opcode == UPDATE and message.get(b'type') == b'authenticator':
+                    self._reply(0, resp_opcode, resp_handle, tid, resp_message)
+                    authid = resp_handle
+                    continue
+                self._reply(authid, resp_opcode, resp_handle, tid, resp_message)
+        except (EOFError, OSError):
+            pass
+
+    def _dispatch(self, opcode, handle, message, obj):
+        server = self.server
+        with server.lock:
+            if opcode == OPEN and message.get(b'type') == b'authenticator':
+                if obj.get(b'name', b'').decode() != server.keyname:
+                    return STATUS, 0, {b'result': struct.pack('!I', NOT_FOUND), b'message': b'no such key'}
+                return UPDATE, 1, {}
+            if opcode == OPEN and message.get(b'type') == b'host':
+                mac = ':'.join('%02x' % octet for octet in obj.get(b'hardware-address', b''))
+                if message.get(b'create') == struct.pack('!I', 1):
+                    if mac in server.hosts and message.get(b'exclusive') == struct.pack('!I', 1):
+                        return STATUS, 0, {b'result': struct.pack('!I', EXISTS), b'message': b'already exists'}
+                    ip = obj.get(b'ip-address')
+                    server.hosts[mac] = {'name': obj.get(b'name', b'').decode(),
+                                         'ip': socket.inet_ntoa(ip) if ip else None,
+                                         'statements': obj.get(b'statements', b'').decode()}
+                elif mac not in server.hosts:
+                    return STATUS, 0, {b'result': struct.pack('!I', NOT_FOUND), b'message': b'not found'}
+                server.handles.setdefault(mac, len(server.handles) + 100)
+                return UPDATE, server.handles[mac], {}
+            if opcode == DELETE:
+                for mac, value in list(server.handles.items()):
+                    if value == handle and mac in server.hosts:
+                        del server.hosts[mac]
+                        return STATUS, 0, {b'result': struct.pack('!I', 0)}
+                return STATUS, 0, {b'result': struct.pack('!I', NOT_FOUND), b'message': b'no object'}
+            return STATUS, 0, {b'result': struct.pack('!I', NOT_FOUND), b'message': b'not implemented'}
+
+    def _reply(self, authid, opcode, handle, rid, message):
+        body = struct.pack('!5I', 16 if authid else 0, opcode, handle, 0, rid) \
+            + _packDict(message) + _packDict({})
+        signature = hmac.new(self.server.key, body, hashlib.md5).digest() if authid else b''
+        self.request.sendall(struct.pack('!I', authid) + body + signature)
+
+
+class FakeOmapiServer(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, keyname, secret):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.keyname = keyname
+        self.key = base64.b64decode(secret)
+        self.hosts = {}
+        self.handles = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
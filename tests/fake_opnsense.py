@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+#
+# stand-in OPNsense API server for tests
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+A small threaded HTTP/1.1 server answering the OPNsense API calls of
+linuxmuster-import-subnets: firmware status, gateways, static routes and
+outbound NAT rules, each with search/add/set/del and reconfigure/apply. Like
+the real API it checks basic auth and answers validation errors with
+{"result": "failed", "validations": ...}.
+
+Usage:
+    with FakeOpnsenseServer('key', 'secret') as server:
+        client = FirewallClient(server.url, 'key', 'secret')
+        ...
+        server.connections  # number of TCP connections accepted
+        server.requests     # [(method, path, body)], one per request
+        server.max_active   # highest number of requests handled at once
+        server.gateways, server.routes, server.nat  # {uuid: item}
+
+    server.latency = 0.05       # seconds every answer is delayed
+    server.failures = [503]     # status of the next answers, one per request
+    server.gateway_cache = 0.3  # seconds route validation sees a stale gateway list
+"""
+
+import base64
+import http.server
+import itertools
+import json
+import threading
+import time
+
+VERSION = '26.1.2'
+
+# (search, add, set, del, apply) path and item key per item type
+ENDPOINTS = {
+    'gateways': ('/routing/settings/search_gateway', '/routing/settings/add_gateway',
+                 '/routing/settings/set_gateway/', '/routing/settings/del_gateway/',
+                 '/routing/settings/reconfigure', 'gateway_item'),
+    'routes': ('/routes/routes/searchroute', '/routes/routes/addroute', '/routes/routes/setroute/',
+               '/routes/routes/delroute/', '/routes/routes/reconfigure', 'route'),
+    'nat': ('/firewall/source_nat/search_rule', '/firewall/source_nat/add_rule',
+            '/firewall/source_nat/set_rule/', '/firewall/source_nat/del_rule/',
+            '/firewall/source_nat/apply', 'rule'),
+}
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('get')
+
+    def do_POST(self):
+        self._handle('post')
+
+    def _handle(self, method):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        path = self.path[4:] if self.path.startswith('/api') else self.path
+        with server.lock:
+            server.requests.append((method, path, body))
+            failure = server.failures.pop(0) if server.failures else None
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            self._answer(method, path, body, failure)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _answer(self, method, path, body, failure):
+        server = self.server
+        if server.latency:
+            # not time.sleep(), tests replace it to skip waits of the code under test
+            threading.Event().wait(server.latency)
+        auth = 'Basic ' + base64.b64encode(f'{server.apikey}:{server.apisecret}'.encode()).decode()
+        if self.headers.get('Authorization') != auth:
+            return self._reply(401, {'status': 401, 'message': 'Authentication Failed'})
+        if failure is not None:
+            return self._reply(failure, {'status': failure, 'message': 'Service Unavailable'})
+        with server.lock:
+            status, answer = server.dispatch(method, path, body)
+        self._reply(status, answer)
+
+    def _reply(self, status, answer):
+        data = json.dumps(answer).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeOpnsenseServer(http.server.ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, apikey='key', apisecret='secret'):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.apikey = apikey
+        self.apisecret = apisecret
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        self.failures = []
+        self.latency = 0
+        self.gateway_cache = 0
+        self._gateway_list = None
+        self.active = 0
+        self.max_active = 0
+        self.applied = []
+        self.gateways = {}
+        self.routes = {}
+        self.nat = {}
+        self._uuids = itertools.count(1)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/api' % self.server_address[1]
+
+    def count(self, method=None, path=None):
+        """Return the number of requests, optionally only of a method and path prefix."""
+        return sum(1 for request in self.requests
+                   if (method is None or request[0] == method)
+                   and (path is None or request[1].startswith(path)))
+
+    def addItem(self, kind, item):
+        """Create an item directly, returns its uuid."""
+        uuid = '%08d-0000-0000-0000-000000000000' % next(self._uuids)
+        getattr(self, kind)[uuid] = dict(item, uuid=uuid)
+        return uuid
+
+    def gatewayList(self):
+        """Return the gateway names route validation knows.
+
+        Like configd's 'interface gateways list' with cache_ttl, the list is
+        kept for gateway_cache seconds after the first query.
+        """
+        names = [gw['name'] for gw in self.gateways.values()]
+        if not self.gateway_cache:
+            return names
+        now = time.monotonic()
+        if self._gateway_list is None or now >= self._gateway_list[0]:
+            self._gateway_list = (now + self.gateway_cache, names)
+        return self._gateway_list[1]
+
+    def validate(self, kind, item):
+        if kind == 'gateways':
+            if not item.get('name') or not item.get('gateway'):
+                return {'gateway_item.name': 'A name and a gateway address are required.'}
+        elif kind == 'routes':
+            if item.get('gateway') not in self.gatewayList():
+                return {'route.gateway': 'Specify a valid gateway from the list.'}
+            if not item.get('network'):
+                return {'route.network': 'A network is required.'}
+        elif kind == 'nat':
+            if not item.get('source_net'):
+                return {'rule.source_net': 'A source network is required.'}
+        return {}
+
+    def dispatch(self, method, path, body):
+        """Answer an API request, returns (status, answer)."""
+        if method == 'get' and path == '/core/firmware/status':
+            return 200, {'product': {'product_version': VERSION}}
+        for kind, (search, add, update, delete, apply, key) in ENDPOINTS.items():
+            items = getattr(self, kind)
+            if path == search:
+                return 200, {'rows': list(items.values()), 'total': len(items), 'rowCount': len(items)}
+            if method != 'post':
+                continue
+            if path == add:
+                if kind == 'gateways':
+                    # the gateway model validation queries the list as well
+                    self.gatewayList()
+                item = json.loads(body or '{}').get(key, {})
+                validations = self.validate(kind, item)
+                if validations:
+                    return 200, {'result': 'failed', 'validations': validations}
+                return 200, {'result': 'saved', 'uuid': self.addItem(kind, item)}
+            if path.startswith(update):
+                uuid = path[len(update):]
+                if uuid not in items:
+                    return 200, {'result': 'failed'}
+                item = dict(items[uuid], **json.loads(body or '{}').get(key, {}))
+                validations = self.validate(kind, item)
+                if validations:
+                    return 200, {'result': 'failed', 'validations': validations}
+                items[uuid] = item
+                return 200, {'result': 'saved'}
+            if path.startswith(delete):
+                uuid = path[len(delete):]
+                if kind == 'gateways' and uuid in items and any(
+                        route.get('gateway') == items[uuid]['name'] for route in self.routes.values()):
+                    # the gateway is still in use
+                    return 200, {'result': 'failed'}
+                if items.pop(uuid, None) is None:
+                    return 200, {'result': 'not found'}
+                return 200, {'result': 'deleted'}
+            if path == apply:
+                self.applied.append(kind)
+                return 200, {'status': 'ok'}
+        return 404, {'errorMessage': 'Endpoint not found'}
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+#
+# smoke test for the benchmark harness
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Runs tests/benchmarks/bench_import_pipeline.py on a tiny generated
+inventory, so the harness keeps working with the code it measures.
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('environment', reason='requires linuxmuster-common (environment.py) on sys.path')
+
+import environment  # noqa: E402  (import must follow importorskip)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+import bench_import_pipeline  # noqa: E402
+import inventory  # noqa: E402
+
+from linuxmuster_base7.cli import import_devices  # noqa: E402
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    # let monkeypatch restore everything the harness redirects
+    for name in ('LOGDIR', 'SYSDIR', 'SOPHOSYSDIR', 'SUBNETSCSV', 'SETUPINI', 'LINBODIR',
+                 'LINBOGRUBDIR', 'LINBOTPLDIR', 'LINBOVERFILE', 'DHCPDEVCONF', 'DHCPSUBCONF',
+                 'POSTDEVIMPORT'):
+        monkeypatch.setattr(environment, name, getattr(environment, name, None), raising=False)
+    for name in ('_dhcp_backend', 'logToFile', '_dhcp_staging'):
+        monkeypatch.setattr(import_devices, name, getattr(import_devices, name))
+    monkeypatch.setitem(bench_import_pipeline.SIZES, 'tiny', (60, 3, 2))
+    inventory.setEnvironmentRoot(str(tmp_path))
+    return str(tmp_path)
+
+
+def test_inventory(root):
+    inventory.writeInventory(root, 60, 3, 2)
+
+    rows = open(environment.SOPHOSYSDIR + '/default-school/devices.csv').read().splitlines()
+    assert len(rows) == 60
+    assert len(set(row.split(';')[4] for row in rows if ';DHCP;' not in row)) == 57
+    subnets = open(environment.SUBNETSCSV).read().splitlines()[1:]
+    assert len(subnets) == 3 and subnets[0].endswith(';SETUP')
+    assert os.path.isfile(environment.LINBODIR + '/start.conf.g001')
+
+
+def test_benchmark_and_compare(root, capsys):
+    result = bench_import_pipeline.benchmark(root, 'tiny', 1)
+
+    assert result['devices'] == 60
+    assert set(result['steps']) >= {'getDeviceIndex', 'writeDhcpDevicesConfig', 'processLinboGroups'}
+    assert os.path.isfile(environment.LINBOGRUBDIR + '/g000.cfg')
+
+    results = {'sizes': {'tiny': result}}
+    baseline = json.loads(json.dumps(results))
+    for values in baseline['sizes']['tiny']['steps'].values():
+        values['seconds'] = values['seconds'] * 2
+    assert bench_import_pipeline.compare(results, baseline, 20) == []
+    baseline['sizes']['tiny']['steps']['getDeviceIndex']['seconds'] = 1e-9
+    assert bench_import_pipeline.compare(results, baseline, 20) == ['tiny/getDeviceIndex']
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+#
+# tests for the parsed devices.csv index in functions.network
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Tests for DeviceIndex / getDeviceIndex() in linuxmuster_base7.functions.network.
+
+import-devices used to re-read and re-validate devices.csv once per subnet.
+DeviceIndex parses the file once and serves the per-subnet, per-pxeflag and
+hostname lookups from memory; these tests check that the answers are the
+same as the old filterDevices()/getHostname() semantics and that the cache
+is invalidated when devices.csv changes on disk.
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip('environment', reason='requires linuxmuster-common (environment.py) on sys.path')
+
+import environment  # noqa: E402  (import must follow importorskip)
+
+from linuxmuster_base7.functions import network  # noqa: E402
+
+
+SUBNETS = (
+    '# network;router;range1;range2;nameserver;nextserver;setup\n'
+    '10.0.0.0/24;10.0.0.254;10.0.0.100;10.0.0.200;;;SETUP\n'
+    '10.0.100.0/24;10.0.100.254;;;;;\n'
+)
+
+DEVICES = (
+    '# room;host;group;mac;ip;;;dhcpopts;role;;pxe\n'
+    'r100;pc01;win11;00:11:22:33:44:01;10.0.0.1;;;;classroom-studentcomputer;;1\n'
+    'r100;pc02;win11;00:11:22:33:44:02;10.0.100.2;;;;classroom-studentcomputer;;1\n'
+    'r100;pc03;ubuntu;00:11:22:33:44:03;DHCP;;;;classroom-studentcomputer;;2\n'
+    'r100;pr01;printer;00:11:22:33:44:04;10.0.100.9;;;;printer;;0\n'
+    'r100;lost;win11;00:11:22:33:44:05;192.168.1.5;;;;classroom-studentcomputer;;1\n'
+    'r100;bad_host;win11;00:11:22:33:44:06;10.0.0.6;;;;classroom-studentcomputer;;1\n'
+)
+
+
+@pytest.fixture
+def sysdir(tmp_path, monkeypatch):
+    """Provide subnets.csv and a default-school devices.csv in a scratch dir."""
+    schooldir = tmp_path / 'default-school'
+    schooldir.mkdir()
+    (schooldir / 'devices.csv').write_text(DEVICES)
+    (tmp_path / 'subnets.csv').write_text(SUBNETS)
+    monkeypatch.setattr(environment, 'SOPHOSYSDIR', str(tmp_path))
+    monkeypatch.setattr(environment, 'SUBNETSCSV', str(tmp_path / 'subnets.csv'))
+    monkeypatch.setattr(network, '_device_indexes', {})
+    return tmp_path
+
+
+def _hosts(devices):
+    return [d.hostname for d in devices]
+
+
+def test_devices_are_grouped_by_subnet(sysdir):
+    index = network.getDeviceIndex()
+
+    assert index.subnets == ['10.0.0.0/24', '10.0.100.0/24']
+    assert _hosts(index.select('10.0.0.0/24')) == ['pc01']
+    assert _hosts(index.select('10.0.100.0/24')) == ['pc02', 'pr01']
+    assert _hosts(index.select('DHCP')) == ['pc03']
+
+
+def test_select_matches_filterDevices(sysdir):
+    index = network.getDeviceIndex()
+
+    for subnet in ('', 'all', 'DHCP', '10.0.100.0/24', '10.0.0.0/16'):
+        for pxeflag in ('', '1', '1,2,3'):
+            expected = network.filterDevices(index.devices, subnet, pxeflag)
+            assert index.select(subnet, pxeflag) == expected
+
+
+def test_getDevicesArray_uses_index(sysdir):
+    rows = network.getDevicesArray(fieldnrs='1,2,4', subnet='all', pxeflag='1,2,3')
+
+    assert rows == [['pc01', 'win11', '10.0.0.1'], ['pc02', 'win11', '10.0.100.2']]
+
+
+
+def test_returned_rows_are_copies(sysdir):
+    index = network.getDeviceIndex()
+    device = index.select('DHCP')[0]
+
+    network.transformDeviceRow(device)[1] = 'changed'
+    network.getDevicesArray(subnet='DHCP')[0][1] = 'changed'
+
+    assert device.row[1] == 'pc03'
+    assert network.getDevicesArray(fieldnrs='1', subnet='DHCP') == [['pc03']]
+
+def test_index_is_cached_until_file_changes(sysdir):
+    first = network.getDeviceIndex()
+    assert network.getDeviceIndex() is first
+
+    csv_path = sysdir / 'default-school' / 'devices.csv'
+    csv_path.write_text(DEVICES + 'r100;pc07;win11;00:11:22:33:44:07;10.0.0.7;;;;x;;1\n')
+    st = os.stat(csv_path)
+    os.utime(csv_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    second = network.getDeviceIndex()
+    assert second is not first
+    assert 'pc07' in _hosts(second.select('10.0.0.0/24'))
+
+
+def test_getHostname_lookup(sysdir):
+    csv_path = str(sysdir / 'default-school' / 'devices.csv')
+
+    assert network.getHostname(csv_path, '10.0.100.2')[0] == 'pc02'
+    assert network.getHostname(csv_path, '00:11:22:33:44:03')[0] == 'pc03'
+    assert network.getHostname(csv_path, 'PR01')[0] == 'pr01'
+    # invalid rows are still found, like the former plain file scan
+    assert network.getHostname(csv_path, 'bad_host')[0] == 'bad_host'
+    assert network.getHostname(csv_path, 'nothere') == (None, None)
+
+
+def test_device_record(sysdir):
+    is_valid, device = network.validateDeviceRow(DEVICES.splitlines()[1].split(';'), 'school2')
+
+    assert is_valid
+    assert not hasattr(device, '__dict__')
+    assert (device.hostname, device.ip, device.pxe, device.comment) == \
+        ('school2-pc01', '10.0.0.1', '1', '')
+    # former dict access keeps working
+    assert device['group'] == 'win11'
+    assert device['raw_row'] is device.row
+    assert network.validateDeviceRow(['r100', 'pc01', 'win11', '00:11:22:33:44:01', '10.0.0.1'])[0] is False
+
+
+def test_field_projection():
+    row = ['r100', 'pc01', 'win11', '00:11:22:33:44:01', '10.0.0.1']
+
+    assert network.getFieldProjection('1,4')(row) == ['pc01', '10.0.0.1']
+    assert network.getFieldProjection('2')(row) == ['win11']
+    # invalid field numbers and fields beyond the row are skipped
+    assert network.getFieldProjection('1,x,12')(row) == ['pc01']
+    assert network.getFieldProjection('')(row) == row
+    assert network.getFieldProjection('1,4') is network.getFieldProjection('1,4')
+
+
+def test_iterSelectedDevices(sysdir):
+    rows = network.iterSelectedDevices(fieldnrs='1', subnet='DHCP')
+
+    assert next(rows) == ['pc03']
+    assert list(rows) == []
+
+
+def test_checkDevicesCsv(sysdir, monkeypatch):
+    linbodir = sysdir / 'linbo'
+    linbodir.mkdir()
+    (linbodir / 'start.conf.win11').write_text('')
+    monkeypatch.setattr(environment, 'LINBODIR', str(linbodir))
+    schooldir = sysdir / 'other'
+    schooldir.mkdir()
+    (schooldir / 'other.devices.csv').write_text(
+        'r1;pc01;win11;00-11-22-33-44-01;10.0.0.1;;;;classroom-studentcomputer;;1\n'
+        'r1;pc02;win11;00:11:22:33:44:07\n'
+        # no pxe group: empty or unknown pxe flag
+        'r1;pr01;printer;00:11:22:33:44:08;DHCP;;;;printer;;\n'
+        'r1;pc03;linux;00:11:22:33:44:09;DHCP;;;;classroom-studentcomputer;;4\n')
+
+    issues = network.checkDevicesCsv(['default-school', 'other'])
+
+    path = str(sysdir / 'default-school' / 'devices.csv')
+    other = str(schooldir / 'other.devices.csv')
+    assert [(issue.school, issue.line, issue.level, issue.message) for issue in issues] == [
+        ('default-school', 4, 'warning', 'pxe group ubuntu has no start.conf'),
+        ('default-school', 6, 'warning', 'ip address 192.168.1.5 is not in any subnet of subnets.csv'),
+        ('default-school', 7, 'error', 'invalid hostname bad_host'),
+        ('other', 1, 'error', 'duplicate mac 00:11:22:33:44:01, first used in ' + path + ':2'),
+        ('other', 1, 'error', 'duplicate ip 10.0.0.1, first used in ' + path + ':2'),
+        ('other', 2, 'error', '4 fields, at least 11 are required'),
+    ]
+    assert str(issues[-1]) == other + ':2: error: 4 fields, at least 11 are required'
+
+
+def test_isValidHostIpv4():
+    for ip in ('10.0.0.1', '254.1.1.254', '010.0.0.1'):
+        assert network.isValidHostIpv4(ip)
+    for ip in ('0.1.2.3', '255.1.1.1', '1.2.3.255', '1.256.3.4', '1.2.3.4.5', 'DHCP', '', None):
+        assert not network.isValidHostIpv4(ip)
+
+
+
+def test_iterDevicesCsv_streams_the_file(sysdir):
+    for subnet in ('', 'all', 'DHCP', '10.0.100.0/24', '10.0.0.0/16'):
+        for pxeflag in ('', '1,2,3'):
+            expected = network.getDevicesArray(fieldnrs='1,4', subnet=subnet, pxeflag=pxeflag)
+            network._device_indexes.clear()
+            rows = network.iterDevicesCsv(fieldnrs='1,4', subnet=subnet, pxeflag=pxeflag)
+            assert list(rows) == expected
+            # no DeviceIndex was built or cached
+            assert network._device_indexes == {}
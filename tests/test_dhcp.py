@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+#
+# tests for the dhcp backends
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Tests for linuxmuster_base7.functions.dhcp: rendering of the isc and kea
+backends, kea control socket commands and backend selection.
+"""
+
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+pytest.importorskip('environment', reason='requires linuxmuster-common (environment.py) on sys.path')
+
+import environment  # noqa: E402  (import must follow importorskip)
+
+from linuxmuster_base7.functions import dhcp  # noqa: E402
+
+
+HOSTS = [('10.0.0.0/24', [('pc01', 'win11', '00:11:22:33:44:01', '10.0.0.1',
+                            'option grubmenu "win11",next-server 10.0.0.5,deny booting', '1'),
+                           ('pr01', 'printer', '00:11:22:33:44:03', '10.0.0.3', '', '0')]),
+         ('DHCP', [('tab01', 'tablets', 'AA:11:22:33:44:04', 'DHCP', '', '0')])]
+
+SUBNETS = [{'ipnet': '10.0.0.0/24', 'router': '10.0.0.254', 'range1': '10.0.0.100',
+            'range2': '10.0.0.200', 'nameserver': '', 'nextserver': '10.0.0.1',
+            'network': '10.0.0.0', 'netmask': '255.255.255.0', 'broadcast': '10.0.0.255',
+            'is_server': True}]
+
+
+def test_isc_renders_host_declarations():
+    content = dhcp.IscDhcpBackend().renderDevices(HOSTS)
+
+    assert content.startswith('# subnet 10.0.0.0/24\nhost pc01 {\n')
+    assert '  option extensions-path "win11";\n  option nis-domain "win11";\n' in content
+    assert '  deny booting;\n' in content
+    assert '# dynamic ip hosts\nhost tab01 {\n' in content
+    assert 'fixed-address DHCP' not in content
+
+
+def test_kea_renders_reservations(capsys):
+    reservations = json.loads(dhcp.KeaDhcpBackend().renderDevices(HOSTS))
+
+    pc01, pr01, tab01 = reservations
+    assert pc01['hw-address'] == '00:11:22:33:44:01'
+    assert pc01['ip-address'] == '10.0.0.1'
+    assert pc01['next-server'] == '10.0.0.5'
+    assert {'name': 'extensions-path', 'data': 'win11'} in pc01['option-data']
+    assert {'name': 'nis-domain', 'data': 'win11'} in pc01['option-data']
+    assert {'name': 'grubmenu', 'data': 'win11'} in pc01['option-data']
+    assert 'deny booting' in capsys.readouterr().out
+    assert pr01['option-data'] == [{'name': 'host-name', 'data': 'pr01'}]
+    assert tab01['hw-address'] == 'aa:11:22:33:44:04'
+    assert 'ip-address' not in tab01
+
+
+def test_kea_merges_school_files(tmp_path):
+    backend = dhcp.KeaDhcpBackend(devicesconf=str(tmp_path / 'devices.json'))
+    (tmp_path / 'a.json').write_text(backend.renderDevices(HOSTS[:1]))
+    (tmp_path / 'b.json').write_text(backend.renderDevices(HOSTS[1:]))
+
+    merged = json.loads(backend.renderDevicesConf([('a', str(tmp_path / 'a.json')),
+                                                   ('b', str(tmp_path / 'b.json'))]))
+    assert [r['hostname'] for r in merged] == ['pc01', 'pr01', 'tab01']
+    assert backend.getIncludes('"reservations": <?include "/etc/kea/devices.json"?>,') \
+        == ['/etc/kea/devices.json']
+
+
+def test_incomplete_backend_cannot_be_instantiated():
+    class PartialBackend(dhcp.DhcpBackend):
+        def renderDevices(self, sections):
+            return ''
+
+    with pytest.raises(TypeError, match='renderSubnets'):
+        PartialBackend('main.conf', 'subnets.conf', 'devices.conf')
+
+
+def test_subnets():
+    isc = dhcp.IscDhcpBackend().renderSubnets(SUBNETS, '10.0.0.1')
+    assert isc == ('# Subnet 10.0.0.0/24\nsubnet 10.0.0.0 netmask 255.255.255.0 {\n'
+                   'option routers 10.0.0.254;\noption subnet-mask 255.255.255.0;\n'
+                   'option broadcast-address 10.0.0.255;\noption netbios-name-servers 10.0.0.1;\n'
+                   'next-server 10.0.0.1;\nrange 10.0.0.100 10.0.0.200;\n'
+                   'option host-name pxeclient;\n}\n')
+
+    kea, = json.loads(dhcp.KeaDhcpBackend().renderSubnets(SUBNETS, '10.0.0.1'))
+    assert kea['id'] == 167772160 | 128
+    assert kea['subnet'] == '10.0.0.0/24'
+    assert kea['pools'] == [{'pool': '10.0.0.100 - 10.0.0.200'}]
+    assert kea['next-server'] == '10.0.0.1'
+    assert {'name': 'netbios-name-servers', 'data': '10.0.0.1'} in kea['option-data']
+
+
+def test_kea_subnet_ids_include_the_prefix():
+    nested = dict(SUBNETS[0], ipnet='10.0.0.0/16', netmask='255.255.0.0', broadcast='10.0.255.255')
+    entries = json.loads(dhcp.KeaDhcpBackend().renderSubnets(SUBNETS + [nested], '10.0.0.1'))
+    ids = [entry['id'] for entry in entries]
+
+    assert ids == [dhcp.KeaDhcpBackend.subnetId('10.0.0.0', '255.255.255.0'),
+                   dhcp.KeaDhcpBackend.subnetId('10.0.0.0', '255.255.0.0')]
+    assert len(set(ids)) == 2
+    assert dhcp.KeaDhcpBackend.subnetId('10.0.1.0', '255.255.255.0') not in ids
+
+
+def test_kea_reload_uses_control_socket(tmp_path):
+    path = str(tmp_path / 'kea4-ctrl-socket')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(1)
+    received = []
+
+    def serve():
+        conn, _ = server.accept()
+        with conn:
+            received.append(json.loads(conn.recv(65536)))
+            conn.sendall(json.dumps({'result': 0, 'text': 'Configuration successful.'}).encode())
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    try:
+        assert dhcp.KeaDhcpBackend(ctrlsocket=path).reload()
+    finally:
+        thread.join(5)
+        server.close()
+    assert received == [{'command': 'config-reload'}]
+
+
+def test_getDhcpBackend(tmp_path, monkeypatch):
+    setupini = tmp_path / 'setup.ini'
+    monkeypatch.setattr(environment, 'SETUPINI', str(setupini))
+    assert dhcp.getDhcpBackend().name == 'isc'
+
+    setupini.write_text('[setup]\ndhcpbackend = kea\n')
+    backend = dhcp.getDhcpBackend()
+    assert backend.name == 'kea'
+    assert backend.devicesdir == os.path.dirname(dhcp.KEADEVCONF) + '/devices'
+
+    with pytest.raises(ValueError):
+        dhcp.getDhcpBackend('dnsmasq')
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+#
+# tests for the OPNsense API client
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Tests for FirewallClient / firewallApi() in linuxmuster_base7.functions.remote
+against the stand-in API server in fake_opnsense.py.
+"""
+
+import socket
+
+import pytest
+
+pytest.importorskip('environment', reason='requires linuxmuster-common (environment.py) on sys.path')
+
+import environment  # noqa: E402  (import must follow importorskip)
+
+from linuxmuster_base7.functions import remote  # noqa: E402
+from linuxmuster_base7.functions.remote import FirewallApiError, FirewallClient  # noqa: E402
+
+from fake_opnsense import FakeOpnsenseServer  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    with FakeOpnsenseServer('key', 'secret') as server:
+        yield server
+
+
+@pytest.fixture
+def client(server):
+    with FirewallClient(server.url, 'key', 'secret', retry_wait=0) as client:
+        yield client
+
+
+def test_requests_share_one_connection(server, client):
+    for nr in range(20):
+        assert client.get('/core/firmware/status')['product']['product_version']
+    assert client.requests == 20
+    assert server.count('get', '/core/firmware/status') == 20
+    assert server.connections == 1
+
+
+def test_helpers(server, client):
+    uuid = client.add('/routing/settings/add_gateway', 'gateway_item',
+                      {'name': 'LAN_GW', 'gateway': '10.0.0.253'})
+    route = client.add('/routes/routes/addroute', 'route', {'network': '10.1.0.0/24', 'gateway': 'LAN_GW'})
+    with pytest.raises(FirewallApiError) as error:
+        client.add('/routes/routes/addroute', 'route', {'network': '10.2.0.0/24', 'gateway': 'WAN_GW'})
+    assert 'valid gateway' in str(error.value)
+    assert [row['network'] for row in client.search('/routes/routes/searchroute')] == ['10.1.0.0/24']
+    assert client.apply('/routes/routes/reconfigure') == {'status': 'ok'}
+
+    client.set('/routing/settings/set_gateway/', uuid, 'gateway_item', {'gateway': '10.0.0.252'})
+    assert server.gateways[uuid]['gateway'] == '10.0.0.252'
+    with pytest.raises(FirewallApiError):
+        # still used by the route
+        client.delete('/routing/settings/del_gateway/', uuid)
+    client.delete('/routes/routes/delroute/', route)
+    client.delete('/routing/settings/del_gateway/', uuid)
+    assert server.gateways == {}
+    with pytest.raises(FirewallApiError):
+        client.delete('/routing/settings/del_gateway/', uuid)
+
+
+def test_retry_with_backoff(server, client, monkeypatch):
+    waits = []
+    monkeypatch.setattr(remote.time, 'sleep', waits.append)
+    client.retry_wait = 1
+    server.failures = [503, 502]
+    assert client.get('/core/firmware/status')
+    assert client.requests == 3
+    assert waits == [1, 2]
+
+    server.failures = [503, 503, 503]
+    with pytest.raises(FirewallApiError) as error:
+        client.get('/core/firmware/status')
+    assert error.value.status == 503
+
+
+def test_connection_error():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    with FirewallClient(f'http://127.0.0.1:{port}/api', 'key', 'secret', retries=2, retry_wait=0) as client:
+        with pytest.raises(FirewallApiError) as error:
+            client.get('/core/firmware/status')
+    assert error.value.status is None
+    assert client.requests == 2
+
+
+def test_firewallApi_wrapper(server, monkeypatch, capsys):
+    monkeypatch.setattr(remote, 'getFirewallClient',
+                        lambda: FirewallClient(server.url, 'key', 'wrong'))
+    assert remote.firewallApi('get', '/core/firmware/status') is None
+    assert 'Authentication Failed' in capsys.readouterr().out
+
+    shared = FirewallClient(server.url, 'key', 'secret')
+    monkeypatch.setattr(remote, 'getFirewallClient', lambda: shared)
+    assert remote.firewallApi('post', '/routing/settings/add_gateway',
+                              '{"gateway_item": {"name": "LAN_GW", "gateway": "10.0.0.253"}}')['result'] == 'saved'
+    assert remote.firewallApi('get', '/routing/settings/search_gateway')['total'] == 1
+    assert remote.firewallApi('put', '/routing/settings/search_gateway') is None
+    assert server.connections == 2
+
+
+def test_getFirewallClient_reuses_client(tmp_path, monkeypatch):
+    (tmp_path / 'setup.ini').write_text('[setup]\ndomainname = linuxmuster.lan\n')
+    (tmp_path / 'fwapi.keys').write_text('[api]\nkey = key\nsecret = secret\n')
+    monkeypatch.setattr(environment, 'SETUPINI', str(tmp_path / 'setup.ini'))
+    monkeypatch.setattr(environment, 'FWAPIKEYS', str(tmp_path / 'fwapi.keys'))
+    monkeypatch.setattr(remote, '_firewall_client', None)
+
+    client = remote.getFirewallClient()
+    assert client.baseurl == 'https://firewall.linuxmuster.lan/api'
+    assert client.session.auth == ('key', 'secret')
+    assert remote.getFirewallClient() is client
+
+    (tmp_path / 'fwapi.keys').write_text('[api]\nkey = key2\nsecret = secret2\n')
+    assert remote.getFirewallClient().session.auth == ('key2', 'secret2')
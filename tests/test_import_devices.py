@@ -0,0 +1,540 @@
+#!/usr/bin/python3
+#
+# tests for linuxmuster-import-devices
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Tests for linuxmuster_base7.cli.import_devices.
+
+Covers the incremental import (device snapshots and the DeviceDiff
+between them) and the LINBO link reconciliation. Every path is redirected
+into a scratch directory.
+"""
+
+import base64
+import json
+import os
+
+import pytest
+
+pytest.importorskip('environment', reason='requires linuxmuster-common (environment.py) on sys.path')
+
+import environment  # noqa: E402  (import must follow importorskip)
+
+from linuxmuster_base7.cli import import_devices  # noqa: E402
+from linuxmuster_base7.functions import network  # noqa: E402
+from linuxmuster_base7.functions.dhcp import IscDhcpBackend, KeaDhcpBackend  # noqa: E402
+
+from fake_omapi import FakeOmapiServer  # noqa: E402
+
+
+SUBNETS = '10.0.0.0/24;10.0.0.254;;;;;SETUP\n'
+
+DEVICES = (
+    'r100;pc01;win11;00:11:22:33:44:01;10.0.0.1;;;;classroom-studentcomputer;;1\n'
+    'r100;pc02;win11;00:11:22:33:44:02;10.0.0.2;;;;classroom-studentcomputer;;1\n'
+    'r100;pr01;printer;00:11:22:33:44:03;10.0.0.3;;;;printer;;0\n'
+)
+
+
+@pytest.fixture
+def scratch(tmp_path, monkeypatch):
+    """Redirect devices.csv, subnets.csv, LINBO and state dirs into tmp_path."""
+    (tmp_path / 'default-school').mkdir()
+    (tmp_path / 'subnets.csv').write_text(SUBNETS)
+    (tmp_path / 'linbo' / 'boot' / 'grub' / 'hostcfg').mkdir(parents=True)
+    monkeypatch.setattr(environment, 'SOPHOSYSDIR', str(tmp_path))
+    monkeypatch.setattr(environment, 'SUBNETSCSV', str(tmp_path / 'subnets.csv'))
+    monkeypatch.setattr(environment, 'LINBODIR', str(tmp_path / 'linbo'))
+    monkeypatch.setattr(environment, 'LINBOGRUBDIR', str(tmp_path / 'linbo' / 'boot' / 'grub'))
+    monkeypatch.setattr(import_devices, 'SNAPSHOTDIR', str(tmp_path / 'state'))
+    monkeypatch.setattr(network, '_device_indexes', {})
+    return tmp_path
+
+
+def _snapshot(scratch, devices):
+    (scratch / 'default-school' / 'devices.csv').write_text(devices)
+    network._device_indexes.clear()
+    index = network.getDeviceIndex()
+    return import_devices.buildDeviceSnapshot(index)
+
+
+def test_snapshot_roundtrip(scratch):
+    snapshot = _snapshot(scratch, DEVICES)
+    import_devices.saveDeviceSnapshot(snapshot)
+
+    assert import_devices.loadDeviceSnapshot() == snapshot
+    assert import_devices.loadDeviceSnapshot('other-school') is None
+    assert snapshot['hosts']['pr01']['links'] == []
+
+
+def test_diff_detects_added_removed_changed(scratch):
+    old = _snapshot(scratch, DEVICES)
+    new = _snapshot(scratch, DEVICES.replace('10.0.0.2;', '10.0.0.20;')
+                    .replace('r100;pr01', '#r100;pr01')
+                    + 'r100;pc03;ubuntu;00:11:22:33:44:04;10.0.0.4;;;;x;;1\n')
+
+    diff = import_devices.DeviceDiff(old, new)
+
+    assert diff.added == ['pc03']
+    assert diff.removed == ['pr01']
+    assert diff.changed == ['pc02']
+    assert diff.groups == {'win11', 'ubuntu', 'printer'}
+    assert not diff.unchanged
+    assert import_devices.DeviceDiff(new, new).unchanged
+
+
+def _writeLinksCsv(scratch, school, links):
+    linksdir = scratch / 'linbo' / 'boot' / 'links'
+    linksdir.mkdir(parents=True, exist_ok=True)
+    (linksdir / (school + '.csv')).write_text(''.join(source + ';' + target + '\n'
+                                                      for source, target in links))
+
+
+def test_doAllGroupLinks_touches_only_differing_links(scratch):
+    old = _snapshot(scratch, DEVICES)
+    for link_source, link_target in old['hosts']['pc01']['links'] + old['hosts']['pc02']['links']:
+        os.symlink(link_source, link_target)
+    linbo = scratch / 'linbo'
+    untouched = os.lstat(linbo / 'start.conf-10.0.0.1')
+    # a regular file and a foreign symlink pattern must be left alone
+    (linbo / 'start.conf-keep').write_text('')
+    os.symlink('start.conf', linbo / 'start.conf.default')
+
+    new = _snapshot(scratch, DEVICES.replace('pc02;win11;00:11:22:33:44:02;10.0.0.2',
+                                             'pc02;ubuntu;00:11:22:33:44:02;10.0.0.22'))
+    _writeLinksCsv(scratch, 'default-school',
+                   new['hosts']['pc01']['links'] + new['hosts']['pc02']['links'])
+    counts = import_devices.doAllGroupLinks()
+
+    assert counts == {'created': 1, 'retargeted': 1, 'removed': 1, 'unchanged': 2}
+    assert not os.path.lexists(linbo / 'start.conf-10.0.0.2')
+    assert os.readlink(linbo / 'start.conf-10.0.0.22') == 'start.conf.ubuntu'
+    assert os.readlink(linbo / 'boot' / 'grub' / 'hostcfg' / 'pc02.cfg') == '../ubuntu.cfg'
+    assert os.lstat(linbo / 'start.conf-10.0.0.1').st_ino == untouched.st_ino
+    assert (linbo / 'start.conf-keep').is_file()
+    assert os.path.islink(linbo / 'start.conf.default')
+
+
+def test_doAllGroupLinks_merges_all_schools(scratch):
+    linbo = scratch / 'linbo'
+    _writeLinksCsv(scratch, 'default-school', [['start.conf.a', str(linbo / 'start.conf-10.0.0.1')]])
+    _writeLinksCsv(scratch, 'school2', [['start.conf.b', str(linbo / 'start.conf-10.2.0.1')]])
+
+    assert import_devices.doAllGroupLinks()['created'] == 2
+    assert import_devices.doAllGroupLinks()['unchanged'] == 2
+
+
+def test_selectGroupsToRebuild(scratch):
+    old = _snapshot(scratch, DEVICES)
+    grubdir = scratch / 'linbo' / 'boot' / 'grub'
+    for group in ('win11', 'ubuntu'):
+        (scratch / 'linbo' / ('start.conf.' + group)).write_text('[LINBO]\n')
+        (grubdir / (group + '.cfg')).write_text('')
+    old['startconfs'] = import_devices.getStartconfHashes(['win11', 'ubuntu'])
+
+    new = _snapshot(scratch, DEVICES + 'r100;pc03;ubuntu;00:11:22:33:44:04;10.0.0.4;;;;x;;1\n')
+    diff = import_devices.DeviceDiff(old, new)
+    assert import_devices.selectGroupsToRebuild(['win11', 'ubuntu'], diff, old) == ['ubuntu']
+
+    (scratch / 'linbo' / 'start.conf.win11').write_text('[LINBO]\nCache = /dev/sda4\n')
+    assert import_devices.selectGroupsToRebuild(['win11', 'ubuntu'], diff, old) == ['win11', 'ubuntu']
+    assert import_devices.selectGroupsToRebuild(['win11'], None, None) == ['win11']
+
+
+def test_processLinboGroups_keeps_order_and_isolates_errors(monkeypatch, capsys):
+    import time
+
+    def fake_doLinboStartconf(group):
+        # later groups finish first
+        time.sleep(0.01 * (5 - int(group[1:])))
+        if group == 'g2':
+            raise OSError('start.conf template missing')
+        print('done ' + group)
+
+    monkeypatch.setattr(import_devices, 'doLinboStartconf', fake_doLinboStartconf)
+    monkeypatch.setattr(import_devices, 'logToFile', lambda msg: None)
+    groups = ['g0', 'g1', 'g2', 'g3', 'g4']
+
+    assert import_devices.processLinboGroups(groups, jobs=4) == ['g2']
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0:2] == ['done g0', 'done g1']
+    assert 'g2' in lines[2] and 'error!' in lines[2]
+    assert lines[3:] == ['done g3', 'done g4']
+
+
+def test_getSchools(scratch):
+    (scratch / 'default-school' / 'devices.csv').write_text(DEVICES)
+    for school in ('b-school', 'a-school', 'no-devices'):
+        (scratch / school).mkdir()
+    (scratch / 'b-school' / 'b-school.devices.csv').write_text('')
+    (scratch / 'a-school' / 'a-school.devices.csv').write_text('')
+
+    assert import_devices.getSchools() == ['default-school', 'a-school', 'b-school']
+
+
+def test_prepareSchoolImports_all_schools(scratch, monkeypatch):
+    (scratch / 'default-school' / 'devices.csv').write_text(DEVICES)
+    (scratch / 'school2').mkdir()
+    (scratch / 'school2' / 'school2.devices.csv').write_text(
+        'r200;pc01;ubuntu;00:11:22:33:55:01;10.0.0.50;;;;x;;1\n')
+    monkeypatch.setattr(import_devices, '_dhcp_backend', IscDhcpBackend(
+        str(scratch / 'dhcp' / 'dhcpd.conf'), devicesconf=str(scratch / 'dhcp' / 'devices.conf')))
+    monkeypatch.setattr(import_devices, 'logToFile', lambda msg: None)
+    monkeypatch.setattr(import_devices, '_dhcp_staging', import_devices.StagingArea())
+
+    imports = import_devices.prepareSchoolImports(['default-school', 'school2'], jobs=2)
+    assert not (scratch / 'dhcp' / 'devices.conf').exists()
+    assert import_devices.activateDhcpConfig()
+
+    assert [item['school'] for item in imports] == ['default-school', 'school2']
+    assert [item['groups'] for item in imports] == [['win11'], ['ubuntu']]
+    assert (scratch / 'dhcp' / 'devices.conf').read_text().count('include') == 2
+    assert (scratch / 'linbo' / 'boot' / 'links' / 'school2.csv').is_file()
+
+
+def test_sophomorix_sync_skipped_while_unchanged(scratch, monkeypatch):
+    import subprocess
+
+    calls = []
+
+    def fake_runSophomorixCommand(action):
+        calls.append(action)
+        return subprocess.CompletedProcess(['sophomorix-device', action], 0)
+
+    monkeypatch.setattr(import_devices, 'runSophomorixCommand', fake_runSophomorixCommand)
+    monkeypatch.setattr(import_devices, 'SYNCSTATEFILE', str(scratch / 'state' / 'sophomorix-sync.json'))
+    monkeypatch.setattr(import_devices, 'logToFile', lambda msg: None)
+    devices_csv = scratch / 'default-school' / 'devices.csv'
+    devices_csv.write_text(DEVICES)
+
+    import_devices.runSophomorixDeviceSync()
+    import_devices.runSophomorixDeviceSync()
+    assert calls == ['--dry-run', '--sync']
+
+    import_devices.runSophomorixDeviceSync(force=True)
+    assert len(calls) == 4
+
+    devices_csv.write_text(DEVICES + 'r100;pc03;ubuntu;00:11:22:33:44:04;10.0.0.4;;;;x;;1\n')
+    import_devices.runSophomorixDeviceSync()
+    assert len(calls) == 6
+
+
+def test_staging_area_activate_and_discard(tmp_path, monkeypatch):
+    target = tmp_path / 'default-school.conf'
+    target.write_text('old\n')
+    staging = import_devices.StagingArea()
+    monkeypatch.setattr(import_devices, '_staging', staging)
+
+    # unchanged content is not staged, changed content does not touch the target yet
+    assert not import_devices.writeIfChanged(str(target), 'old\n')
+    assert import_devices.writeIfChanged(str(target), 'new\n')
+    assert target.read_text() == 'old\n'
+    assert (tmp_path / '.default-school.conf.staged').read_text() == 'new\n'
+
+    staging.discard()
+    assert target.read_text() == 'old\n'
+    assert os.listdir(tmp_path) == ['default-school.conf']
+
+    # the activated file keeps the permissions of the replaced one
+    target.chmod(0o640)
+    import_devices.writeIfChanged(str(target), 'new\n')
+    assert staging.activate() == 1
+    assert target.read_text() == 'new\n'
+    assert os.listdir(tmp_path) == ['default-school.conf']
+    assert target.stat().st_mode & 0o777 == 0o640
+
+
+def test_writeTextfileAtomic_keeps_permissions(tmp_path):
+    target = tmp_path / 'grub.cfg'
+    target.write_text('old\n')
+    target.chmod(0o600)
+
+    assert import_devices.writeTextfileAtomic(str(target), 'new\n')
+    assert target.read_text() == 'new\n'
+    assert target.stat().st_mode & 0o777 == 0o600
+    assert os.listdir(tmp_path) == ['grub.cfg']
+
+
+def _writeHook(hookdir, name, body, executable=True):
+    hook = hookdir / name
+    hook.write_text('#!/bin/sh\n' + body + '\n')
+    hook.chmod(0o755 if executable else 0o644)
+
+
+def test_getHookStages(tmp_path):
+    for name in ('20-torrent', '10-webui', 'zz-last', '10-printers', '5-first'):
+        _writeHook(tmp_path, name, 'true')
+    _writeHook(tmp_path, '01-disabled', 'true', executable=False)
+
+    assert import_devices.getHookStages(str(tmp_path)) == [
+        ['5-first'], ['10-printers', '10-webui'], ['20-torrent'], ['zz-last']]
+
+
+def test_runPostImportHooks_parallel_timeout_and_failures(tmp_path, monkeypatch, capsys):
+    import time
+
+    log = tmp_path / 'order'
+    _writeHook(tmp_path, '10-a', 'sleep 0.5; echo a >> ' + str(log))
+    _writeHook(tmp_path, '10-b', 'sleep 0.5; echo b >> ' + str(log) + '; echo hello $2')
+    _writeHook(tmp_path, '20-fail', 'echo c >> ' + str(log) + '; exit 3')
+    # the child sleep keeps the output pipe open, it must be killed as well
+    _writeHook(tmp_path, '30-hang', 'sleep 30 & sleep 30')
+    monkeypatch.setattr(environment, 'POSTDEVIMPORT', str(tmp_path))
+    monkeypatch.setattr(import_devices, 'logToFile', lambda msg: None)
+
+    start = time.monotonic()
+    failed = import_devices.runPostImportHooks(['default-school'], jobs=2, timeout=1)
+
+    assert time.monotonic() - start < 5
+    assert failed == ['20-fail (default-school)', '30-hang (default-school)']
+    # stage 10 ran in parallel and completed before stage 20 started
+    assert sorted(log.read_text().split()[:2]) == ['a', 'b']
+    assert log.read_text().split()[2] == 'c'
+    out = capsys.readouterr().out
+    assert 'hello default-school' in out
+    assert 'failed (3)' in out and 'timed out' in out
+
+
+def _fakeDhcpd(scratch, monkeypatch, returncode):
+    """Install a dhcpd stub that records its config and exits with returncode."""
+    fakebin = scratch / 'bin'
+    fakebin.mkdir()
+    dhcpd = fakebin / 'dhcpd'
+    dhcpd.write_text('#!/bin/sh\ncat "$3" > ' + str(scratch / 'dhcpd.tested') + '\n'
+                     'echo "dhcpd -t says $*"\nexit ' + str(returncode) + '\n')
+    dhcpd.chmod(0o755)
+    monkeypatch.setenv('PATH', str(fakebin) + os.pathsep + os.environ.get('PATH', ''))
+    dhcpdir = scratch / 'dhcp'
+    dhcpdir.mkdir()
+    (dhcpdir / 'dhcpd.conf').write_text('include "' + str(dhcpdir / 'devices.conf') + '";\n')
+    (dhcpdir / 'devices.conf').write_text('# old\n')
+    monkeypatch.setattr(import_devices, '_dhcp_backend', IscDhcpBackend(
+        str(dhcpdir / 'dhcpd.conf'), devicesconf=str(dhcpdir / 'devices.conf')))
+    monkeypatch.setattr(import_devices, '_dhcp_staging', import_devices.StagingArea())
+    monkeypatch.setattr(import_devices, 'logToFile', lambda msg: None)
+    return dhcpdir
+
+
+def test_activateDhcpConfig_validates_staged_tree(scratch, monkeypatch):
+    dhcpdir = _fakeDhcpd(scratch, monkeypatch, 0)
+    (scratch / 'default-school' / 'devices.csv').write_text(DEVICES)
+
+    assert import_devices.writeDhcpDevicesConfig() == 'changed'
+    assert import_devices.activateDhcpConfig()
+
+    # dhcpd -t saw a devices.conf including the staged school config
+    tested = (scratch / 'dhcpd.tested').read_text()
+    assert '.import-devices-' in tested and str(dhcpdir / 'devices.conf') not in tested
+    assert 'pc01' in (dhcpdir / 'devices' / 'default-school.conf').read_text()
+    assert (dhcpdir / 'devices.conf').read_text() == \
+        'include "' + str(dhcpdir / 'devices' / 'default-school.conf') + '";\n'
+    assert sorted(os.listdir(dhcpdir)) == ['devices', 'devices.conf', 'dhcpd.conf']
+
+
+def test_activateDhcpConfig_keeps_active_config_if_rejected(scratch, monkeypatch):
+    dhcpdir = _fakeDhcpd(scratch, monkeypatch, 1)
+    (scratch / 'default-school' / 'devices.csv').write_text(DEVICES)
+
+    import_devices.writeDhcpDevicesConfig()
+    assert not import_devices.activateDhcpConfig()
+
+    assert (dhcpdir / 'devices.conf').read_text() == '# old\n'
+    assert os.listdir(dhcpdir / 'devices') == []
+
+
+def test_updateDhcpService_restarts_only_on_change(scratch, monkeypatch):
+    dhcpdir = _fakeDhcpd(scratch, monkeypatch, 0)
+    restarts = []
+    monkeypatch.setattr(import_devices, 'restartDhcpService', lambda: restarts.append(1) or True)
+    monkeypatch.setattr(import_devices, 'DHCPSTATEFILE', str(scratch / 'state' / 'dhcp.json'))
+    monkeypatch.setattr(import_devices, 'OMAPICONF', str(scratch / 'omapi.conf'))
+
+    import_devices.updateDhcpService()
+    import_devices.updateDhcpService()
+    assert len(restarts) == 1
+
+    (dhcpdir / 'devices.conf').write_text('# new\n')
+    import_devices.updateDhcpService()
+    assert len(restarts) == 2
+
+
+def test_updateDhcpService_applies_host_changes_via_omapi(scratch, monkeypatch):
+    dhcpdir = _fakeDhcpd(scratch, monkeypatch, 0)
+    restarts = []
+    monkeypatch.setattr(import_devices, 'restartDhcpService', lambda: restarts.append(1) or True)
+    monkeypatch.setattr(import_devices, 'DHCPSTATEFILE', str(scratch / 'state' / 'dhcp.json'))
+    monkeypatch.setattr(import_devices, 'OMAPICONF', str(scratch / 'omapi.conf'))
+    import_devices.updateDhcpService()
+    assert len(restarts) == 1
+
+    old = _snapshot(scratch, DEVICES)
+    # pc03 is outside of all subnets.csv networks and not in the dhcp configuration
+    new = _snapshot(scratch, DEVICES.replace('10.0.0.2;', '10.0.0.20;').replace('r100;pr01', '#r100;pr01')
+                    + 'r100;pc03;win11;00:11:22:33:44:04;10.9.0.3;;;;classroom-studentcomputer;;1\n')
+    assert not new['hosts']['pc03']['dhcp']
+    imports = [{'school': 'default-school', 'diff': import_devices.DeviceDiff(old, new),
+                'dhcp_hash': import_devices.loadDhcpState()['hash']}]
+    (dhcpdir / 'devices.conf').write_text('# hosts changed\n')
+
+    # not configured: fall back to a restart
+    import_devices.updateDhcpService(imports)
+    assert len(restarts) == 2
+
+    secret = base64.b64encode(b'0123456789abcdef').decode()
+    with FakeOmapiServer('omapi_key', secret) as server:
+        server.hosts['00:11:22:33:44:02'] = {'name': 'pc02', 'ip': '10.0.0.2', 'statements': ''}
+        server.hosts['00:11:22:33:44:03'] = {'name': 'pr01', 'ip': '10.0.0.3', 'statements': ''}
+        (scratch / 'omapi.conf').write_text(
+            f'[omapi]\nhost = 127.0.0.1\nport = {server.port}\nkeyname = omapi_key\nsecret = {secret}\n')
+        (dhcpdir / 'devices.conf').write_text('# hosts changed again\n')
+        # the old snapshot was stored before the last restart: restart
+        import_devices.updateDhcpService(imports)
+        assert len(restarts) == 3
+
+        imports[0]['dhcp_hash'] = import_devices.loadDhcpState()['hash']
+        (dhcpdir / 'devices.conf').write_text('# hosts changed once more\n')
+        import_devices.updateDhcpService(imports)
+
+        assert len(restarts) == 3
+        assert server.hosts['00:11:22:33:44:02']['ip'] == '10.0.0.20'
+        assert 'extensions-path "win11"' in server.hosts['00:11:22:33:44:02']['statements']
+        assert '00:11:22:33:44:03' not in server.hosts
+        assert '00:11:22:33:44:04' not in server.hosts
+
+        # anything but host declarations changed: restart
+        (dhcpdir / 'dhcpd.conf').write_text((dhcpdir / 'dhcpd.conf').read_text() + '# other\n')
+        import_devices.updateDhcpService(imports)
+        assert len(restarts) == 4
+
+
+def test_failed_dhcp_restart_is_sent_via_omapi_next_run(scratch, monkeypatch):
+    _fakeDhcpd(scratch, monkeypatch, 0)
+    restarts = []
+    restart_ok = [True]
+    monkeypatch.setattr(import_devices, 'restartDhcpService', lambda: restarts.append(1) or restart_ok[0])
+    monkeypatch.setattr(import_devices, 'DHCPSTATEFILE', str(scratch / 'state' / 'dhcp.json'))
+    monkeypatch.setattr(import_devices, 'OMAPICONF', str(scratch / 'omapi.conf'))
+    monkeypatch.setattr(import_devices, 'runSophomorixDeviceSync', lambda force, background: None)
+    monkeypatch.setattr(import_devices, 'doPxeGroupsBySchool', lambda school, index: [])
+    monkeypatch.setattr(import_devices, 'generateGrubConfigsForGroups', lambda imports, jobs: [])
+    monkeypatch.setattr(import_devices, 'runPostImportHooks', lambda schools, jobs, timeout: [])
+    args = {'force_sync': False, 'pipeline': False, 'full': False, 'jobs': 1,
+            'hook_jobs': 1, 'hook_timeout': 10}
+    devices_csv = scratch / 'default-school' / 'devices.csv'
+
+    devices_csv.write_text(DEVICES)
+    import_devices.importDevices(args, ['default-school'])
+    assert len(restarts) == 1
+
+    # the restart fails: no snapshot is stored
+    restart_ok[0] = False
+    devices_csv.write_text(DEVICES.replace('10.0.0.2;', '10.0.0.20;'))
+    network._device_indexes.clear()
+    import_devices.importDevices(args, ['default-school'])
+    assert len(restarts) == 2
+    assert import_devices.loadDeviceSnapshot()['hosts']['pc02']['ip'] == '10.0.0.2'
+
+    # next run: the pending host change goes to the running server
+    secret = base64.b64encode(b'0123456789abcdef').decode()
+    with FakeOmapiServer('omapi_key', secret) as server:
+        server.hosts['00:11:22:33:44:02'] = {'name': 'pc02', 'ip': '10.0.0.2', 'statements': ''}
+        (scratch / 'omapi.conf').write_text(
+            f'[omapi]\nhost = 127.0.0.1\nport = {server.port}\nkeyname = omapi_key\nsecret = {secret}\n')
+        network._device_indexes.clear()
+        result = import_devices.importDevices(args, ['default-school'])
+
+        assert len(restarts) == 2
+        assert result['imports'][0]['diff'].changed == ['pc02']
+        assert server.hosts['00:11:22:33:44:02']['ip'] == '10.0.0.20'
+    snapshot = import_devices.loadDeviceSnapshot()
+    assert snapshot['hosts']['pc02']['ip'] == '10.0.0.20'
+    assert snapshot['dhcp_hash'] == import_devices.loadDhcpState()['hash']
+
+
+def test_kea_backend_stages_reservations(scratch, monkeypatch):
+    keadir = scratch / 'kea'
+    keadir.mkdir()
+    monkeypatch.setattr(import_devices, '_dhcp_backend', KeaDhcpBackend(
+        str(keadir / 'kea-dhcp4.conf'), devicesconf=str(keadir / 'devices.json')))
+    monkeypatch.setattr(import_devices, '_dhcp_staging', import_devices.StagingArea())
+    monkeypatch.setattr(import_devices, 'logToFile', lambda msg: None)
+    (scratch / 'default-school' / 'devices.csv').write_text(DEVICES)
+
+    assert import_devices.writeDhcpDevicesConfig() == 'changed'
+    assert import_devices.activateDhcpConfig()
+
+    assert (keadir / 'devices' / 'default-school.json').exists()
+    reservations = json.loads((keadir / 'devices.json').read_text())
+    assert [r['hostname'] for r in reservations] == ['pc01', 'pc02', 'pr01']
+    assert import_devices.writeDhcpDevicesConfig() == 'unchanged'
+
+
+def test_run_report(tmp_path):
+    report = import_devices.RunReport()
+    with report.phase('prepare'):
+        with report.phase('prepare.dhcp'):
+            pass
+    with report.phase('prepare.dhcp'):
+        pass
+    report.count('devices', 3)
+    report.count('devices', 2)
+    report.addGroup('win11', 0.5)
+    report.addHook('10-webui', 'default-school', 0, 0.25)
+    report.info['status'] = 'ok'
+
+    report.save(str(tmp_path / 'runs.jsonl'))
+    report.save(str(tmp_path / 'runs.jsonl'))
+
+    lines = (tmp_path / 'runs.jsonl').read_text().splitlines()
+    assert len(lines) == 2
+    data = json.loads(lines[0])
+    assert list(data['phases']) == ['prepare', 'prepare.dhcp']
+    assert data['counts'] == {'devices': 5}
+    assert data['groups'] == {'win11': 0.5}
+    assert data['hooks'] == [{'hook': '10-webui', 'school': 'default-school',
+                              'returncode': 0, 'duration': 0.25}]
+    assert data['status'] == 'ok'
+
+
+def test_summary_mode_prints_counts(scratch, monkeypatch, capsys):
+    (scratch / 'default-school' / 'devices.csv').write_text(DEVICES)
+    monkeypatch.setattr(import_devices, '_output_mode', 'summary')
+
+    hosts = import_devices.processDevicesForSubnet('10.0.0.0/24', 'default-school')
+
+    out = capsys.readouterr().out
+    assert [host[0] for host in hosts] == ['pc01', 'pc02', 'pr01']
+    assert '10.0.0.0/24: 3 device(s)' in out
+    assert 'pc01' not in out
+
+
+def test_output_capture():
+    capture = import_devices.OutputCapture()
+    capture.start()
+    print('hidden')
+    assert capture.stop() == 'hidden\n'
+
+
+def test_buildJsonResult(scratch, monkeypatch):
+    old = _snapshot(scratch, DEVICES)
+    new = _snapshot(scratch, DEVICES.replace('10.0.0.2;', '10.0.0.22;'))
+    report = import_devices.RunReport()
+    report.count('devices', 3)
+    report.info['status'] = 'ok'
+    monkeypatch.setattr(import_devices, '_report', report)
+    result = {'dhcp_ok': True, 'failed_groups': [], 'failed_hooks': [],
+              'imports': [{'school': 'default-school', 'dhcp_status': 'changed',
+                           'diff': import_devices.DeviceDiff(old, new),
+                           'pxe_groups': ['win11'], 'groups': ['win11']}]}
+
+    data = json.loads(json.dumps(import_devices.buildJsonResult(result)))
+
+    assert data['status'] == 'ok'
+    assert data['counts'] == {'devices': 3}
+    assert data['imports'] == [{'school': 'default-school', 'dhcp': 'changed',
+                                'pxe_groups': ['win11'], 'groups_rebuilt': ['win11'],
+                                'added': [], 'removed': [], 'changed': ['pc02']}]
+    assert import_devices.buildJsonResult()['imports'] == []
@@ -0,0 +1,401 @@
+#!/usr/bin/python3
+#
+# tests for linuxmuster-import-subnets
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Tests for the firewall plan/apply engine of linuxmuster_base7.cli.import_subnets
+against the stand-in OPNsense API server in fake_opnsense.py.
+"""
+
+import threading
+
+import pytest
+
+pytest.importorskip('environment', reason='requires linuxmuster-common (environment.py) on sys.path')
+
+from linuxmuster_base7.cli import import_subnets  # noqa: E402
+from linuxmuster_base7.functions.remote import FirewallClient  # noqa: E402
+
+from fake_iproute import FakeRouteTable  # noqa: E402
+from fake_opnsense import FakeOpnsenseServer  # noqa: E402
+
+
+ROUTER = '10.0.0.253'
+
+
+def _subnets(*ipnets):
+    return [{'ipnet': ipnet} for ipnet in ipnets]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    waits = []
+    monkeypatch.setattr(import_subnets.time, 'sleep', waits.append)
+    with FakeOpnsenseServer('key', 'secret') as server:
+        server.waits = waits
+        client = FirewallClient(server.url, 'key', 'secret', retry_wait=0)
+        monkeypatch.setattr(import_subnets, 'getFirewallClient', lambda: client)
+        yield server
+        client.close()
+
+
+def _writes(server):
+    return [(method, path) for method, path, body in server.requests if method == 'post']
+
+
+def test_plan_migrates_legacy_gateway():
+    state = {
+        'gateways': [{'uuid': 'g1', 'name': 'GW_LAN', 'gateway': ROUTER},
+                     {'uuid': 'g2', 'name': 'WAN_GW', 'gateway': '192.168.1.1'}],
+        'routes': [{'uuid': 'r1', 'network': '10.1.0.0/24', 'gateway': 'GW_LAN'},
+                   {'uuid': 'r2', 'network': '10.9.0.0/24', 'gateway': 'WAN_GW'},
+                   {'uuid': 'r3', 'network': '10.2.0.0/24', 'gateway': 'LAN_GW'}],
+        'nat': [{'uuid': 'n1', 'description': 'Outbound NAT rule for subnet 10.1.0.0/24'},
+                {'uuid': 'n2', 'description': 'Outbound NAT rule for subnet 10.3.0.0/24'},
+                {'uuid': 'n3', 'description': 'foreign rule'}],
+    }
+
+    plan = import_subnets.planFirewall(state, _subnets('10.1.0.0/24', '10.9.0.0/24'), ROUTER)
+
+    assert [str(action) for action in plan.actions] == [
+        '- route 10.1.0.0/24 via GW_LAN',
+        '- route 10.2.0.0/24 via LAN_GW',
+        '- gateway GW_LAN (10.0.0.253)',
+        '+ gateway LAN_GW (10.0.0.253)',
+        '+ route 10.1.0.0/24 via LAN_GW',
+        '- NAT rule "Outbound NAT rule for subnet 10.3.0.0/24"',
+        '+ NAT rule "Outbound NAT rule for subnet 10.9.0.0/24"',
+    ]
+
+
+def test_apply_uses_one_read_and_one_apply_per_subsystem(server):
+    import_subnets.updateFirewall(_subnets('10.1.0.0/24', '10.2.0.0/24', '10.3.0.0/24'), ROUTER, False)
+
+    assert server.count('get') == 3
+    assert _writes(server).count(('post', '/routing/settings/add_gateway')) == 1
+    assert _writes(server).count(('post', '/routes/routes/addroute')) == 3
+    assert _writes(server).count(('post', '/firewall/source_nat/add_rule')) == 3
+    assert server.applied == ['gateways', 'routes', 'nat']
+    assert server.waits == []  # the new gateway is accepted at once
+    assert sorted(route['network'] for route in server.routes.values()) == \
+        ['10.1.0.0/24', '10.2.0.0/24', '10.3.0.0/24']
+    assert server.connections <= import_subnets.FW_JOBS
+
+    # a second run finds nothing to do
+    server.requests.clear()
+    plan, ok = import_subnets.updateFirewall(_subnets('10.1.0.0/24', '10.2.0.0/24', '10.3.0.0/24'),
+                                             ROUTER, False)
+    assert len(plan) == 0 and ok
+    assert _writes(server) == []
+
+
+def test_apply_migration_and_gateway_change(server):
+    server.addItem('gateways', {'name': 'GW_LAN', 'gateway': ROUTER})
+    server.addItem('routes', {'network': '10.1.0.0/24', 'gateway': 'GW_LAN'})
+
+    import_subnets.updateFirewall(_subnets('10.1.0.0/24'), ROUTER, False)
+
+    assert [gw['name'] for gw in server.gateways.values()] == ['LAN_GW']
+    assert [(route['network'], route['gateway']) for route in server.routes.values()] == \
+        [('10.1.0.0/24', 'LAN_GW')]
+
+    server.requests.clear()
+    server.applied.clear()
+    import_subnets.updateFirewall(_subnets('10.1.0.0/24'), '10.0.0.252', False)
+    assert [gw['gateway'] for gw in server.gateways.values()] == ['10.0.0.252']
+    assert len(_writes(server)) == 2  # set_gateway and its reconfigure
+    assert server.applied == ['gateways']
+
+
+def test_plan_only_makes_no_writes(server, capsys):
+    server.addItem('routes', {'network': '10.5.0.0/24', 'gateway': 'LAN_GW'})
+
+    plan, ok = import_subnets.updateFirewall(_subnets('10.1.0.0/24'), ROUTER, False, apply=False)
+
+    assert len(plan) == 4
+    assert _writes(server) == []
+    out = capsys.readouterr().out
+    assert '+ gateway LAN_GW (10.0.0.253)' in out
+    assert '- route 10.5.0.0/24 via LAN_GW' in out
+
+
+def test_gateway_failure_skips_routes_and_nat(server):
+    server.addItem('gateways', {'name': 'LAN_GW', 'gateway': ROUTER})
+    server.failures = [None, None, None, 500]
+
+    with pytest.raises(SystemExit):
+        import_subnets.updateFirewall(_subnets(), ROUTER, False)
+    assert server.applied == []
+
+
+def test_route_and_nat_changes_run_concurrently(server):
+    subnets = _subnets(*['10.%d.0.0/24' % nr for nr in range(1, 41)])
+    server.addItem('gateways', {'name': 'LAN_GW', 'gateway': ROUTER})
+    server.latency = 0.01
+
+    import_subnets.updateFirewall(subnets, ROUTER, False, jobs=8)
+
+    assert 1 < server.max_active <= 8
+    assert len(server.routes) == len(server.nat) == 40
+    paths = [path for method, path, body in server.requests]
+    assert paths.index('/routes/routes/reconfigure') > max(
+        nr for nr, path in enumerate(paths) if path == '/routes/routes/addroute')
+    assert paths.count('/routes/routes/reconfigure') == 1
+    assert paths[-1] == '/firewall/source_nat/apply'
+
+
+def test_failed_changes_are_retried(server, capsys):
+    server.addItem('gateways', {'name': 'LAN_GW', 'gateway': ROUTER})
+    # searches pass, the first two writes fail
+    server.failures = [None, None, None, 500, 500]
+
+    import_subnets.updateFirewall(_subnets('10.1.0.0/24', '10.2.0.0/24', '10.3.0.0/24'),
+                                  ROUTER, False, jobs=2)
+
+    assert len(server.routes) == len(server.nat) == 3
+    assert server.count('post', '/routes/routes/addroute') == 5
+    assert 'Retrying 2 failed change(s)' in capsys.readouterr().out
+
+
+def _patchMain(monkeypatch, skipfw=True, backend=None):
+    """Let main() run on fixed setup values and subnets, netplan and NTP unchanged."""
+    monkeypatch.setattr(import_subnets.sys, 'argv', ['linuxmuster-import-subnets'])
+    monkeypatch.setattr(import_subnets, 'readSetupValues', lambda: {
+        'serverip': '10.0.0.1', 'gateway': '10.0.0.254', 'firewallip': '10.0.0.254',
+        'skipfw': skipfw, 'ipnet_setup': '10.0.0.0/16'})
+    monkeypatch.setattr(import_subnets, 'checkFwVersion', lambda: True)
+    monkeypatch.setattr(import_subnets, 'readSubnetsCSV', lambda ipnet: [
+        {'ipnet': '10.0.0.0/16', 'router': ROUTER, 'is_server': True},
+        {'ipnet': '10.1.0.0/24', 'router': ROUTER, 'is_server': False}])
+    monkeypatch.setattr(import_subnets, 'getDhcpBackend', lambda: backend or _Backend('unused'))
+    monkeypatch.setattr(import_subnets, 'updateNetplan', lambda *args: 'unchanged')
+    monkeypatch.setattr(import_subnets, 'updateNtpConf', lambda: 'unchanged')
+
+
+def test_rejected_nat_write_fails_the_run(server, monkeypatch, capsys):
+    server.addItem('gateways', {'name': 'LAN_GW', 'gateway': ROUTER})
+    server.addItem('routes', {'network': '10.1.0.0/24', 'gateway': 'LAN_GW'})
+    # searches pass, the NAT rule is rejected twice (write and retry)
+    server.failures = [None, None, None, 500, 500]
+
+    plan, ok = import_subnets.updateFirewall(_subnets('10.1.0.0/24'), ROUTER, False)
+    assert len(plan) == 1 and ok is False
+    assert server.nat == {}
+
+    # main reports the failure and exits non-zero
+    server.failures = [None, None, None, 500, 500]
+    _patchMain(monkeypatch, skipfw=False)
+    monkeypatch.setattr(import_subnets, 'writeDhcpConfig', lambda *args: 'unchanged')
+    capsys.readouterr()
+    with pytest.raises(SystemExit) as error:
+        import_subnets.main()
+    assert error.value.code == 1
+    assert '* firewall: failed' in capsys.readouterr().out
+
+
+def _sleep(server):
+    """time.sleep replacement that waits and records the pause."""
+    def sleep(secs):
+        server.waits.append(secs)
+        threading.Event().wait(secs)
+    return sleep
+
+
+def test_routes_wait_until_gateway_is_accepted(server, monkeypatch, capsys):
+    monkeypatch.setattr(import_subnets.time, 'sleep', _sleep(server))
+    server.gateway_cache = 0.3
+
+    import_subnets.updateFirewall(_subnets('10.1.0.0/24', '10.2.0.0/24'), ROUTER, False)
+
+    assert len(server.routes) == 2
+    assert server.waits == [import_subnets.FW_GW_PROBE_WAIT]
+    assert server.count('post', '/routes/routes/addroute') == 3
+    assert 'Gateway accepted after' in capsys.readouterr().out
+
+
+def test_gateway_wait_is_bounded(server, monkeypatch, capsys):
+    monkeypatch.setattr(import_subnets.time, 'sleep', _sleep(server))
+    server.gateway_cache = 60
+    server.gatewayList()
+    server.addItem('gateways', {'name': 'LAN_GW', 'gateway': ROUTER})
+    action = import_subnets.FirewallAction('routes', 'add', 'route 10.1.0.0/24 via LAN_GW',
+                                           {'network': '10.1.0.0/24', 'gateway': 'LAN_GW'})
+
+    assert not import_subnets.addFirstRoute(import_subnets.getFirewallClient(), action, timeout=1)
+    assert server.waits == [0.5]
+    assert server.routes == {}
+    assert 'valid gateway' in capsys.readouterr().out
+
+    # other validation errors end the wait at once
+    server.waits.clear()
+    server.gateway_cache = 0
+    action.item['network'] = ''
+    assert not import_subnets.addFirstRoute(import_subnets.getFirewallClient(), action)
+    assert server.waits == []
+
+
+class _Backend(object):
+    service = 'isc-dhcp-server'
+
+    def __init__(self, path):
+        self.subnetsconf = str(path)
+
+    def renderSubnets(self, subnets, serverip):
+        return ''.join(f'subnet {s["ipnet"]}\n' for s in subnets)
+
+
+def test_dhcp_config_only_written_on_change(tmp_path, monkeypatch):
+    backend = _Backend(tmp_path / 'subnets.conf')
+    pending = tmp_path / 'state' / 'dhcp-pending'
+    monkeypatch.setattr(import_subnets, 'DHCPPENDING', str(pending))
+
+    assert import_subnets.writeDhcpConfig(_subnets('10.1.0.0/24'), '10.0.0.1', backend) == 'changed'
+    mtime = (tmp_path / 'subnets.conf').stat().st_mtime_ns
+    # the restart failed: the unchanged file is activated again
+    assert pending.exists()
+    assert import_subnets.writeDhcpConfig(_subnets('10.1.0.0/24'), '10.0.0.1', backend) == 'changed'
+    assert (tmp_path / 'subnets.conf').stat().st_mtime_ns == mtime
+    # the restart succeeded
+    pending.unlink()
+    assert import_subnets.writeDhcpConfig(_subnets('10.1.0.0/24'), '10.0.0.1', backend) == 'unchanged'
+    assert (tmp_path / 'subnets.conf').stat().st_mtime_ns == mtime
+    assert import_subnets.writeDhcpConfig(_subnets('10.2.0.0/24'), '10.0.0.1', backend) == 'changed'
+
+
+def test_failed_dhcp_restart_is_retried(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(import_subnets, 'DHCPPENDING', str(tmp_path / 'dhcp-pending'))
+    _patchMain(monkeypatch, backend=_Backend(tmp_path / 'subnets.conf'))
+    restarts = []
+    monkeypatch.setattr(import_subnets, 'restartDhcp', lambda backend: restarts.append(1) or len(restarts) > 1)
+
+    with pytest.raises(SystemExit):
+        import_subnets.main()
+    assert '* DHCP: failed' in capsys.readouterr().out
+
+    import_subnets.main()
+    assert len(restarts) == 2
+    assert '* DHCP: changed' in capsys.readouterr().out
+    import_subnets.main()
+    assert len(restarts) == 2
+    assert '* DHCP: unchanged' in capsys.readouterr().out
+
+
+@pytest.fixture
+def netplan(tmp_path, monkeypatch):
+    cfgfile = tmp_path / '01-netcfg.yaml'
+    cfgfile.write_text('network:\n  version: 2\n  ethernets:\n    eth0:\n'
+                       '      addresses: [10.0.0.1/16]\n      gateway4: 10.0.0.254\n')
+    monkeypatch.setattr(import_subnets.environment, 'NETCFG', str(cfgfile))
+    table = FakeRouteTable('eth0', '10.0.0.1/16')
+    table.addRoute('default', '10.0.0.254')
+    table.calls = []
+    monkeypatch.setattr(import_subnets.subprocess, 'run', table.run)
+    monkeypatch.setattr(import_subnets.subprocess, 'call', lambda cmd: table.calls.append(cmd) or 0)
+    table.cfgfile = cfgfile
+    return table
+
+
+def _netplanRoutes(cfgfile):
+    return import_subnets.yaml.safe_load(cfgfile.read_text())['network']['ethernets']['eth0']['routes']
+
+
+def test_netplan_route_deltas_without_netplan_apply(netplan):
+    assert import_subnets.updateNetplan(_subnets('10.1.0.0/24', '10.2.0.0/24'), '10.0.0.254', ROUTER) == 'changed'
+    assert _netplanRoutes(netplan.cfgfile) == [{'to': 'default', 'via': '10.0.0.254'},
+                                               {'to': '10.1.0.0/24', 'via': ROUTER},
+                                               {'to': '10.2.0.0/24', 'via': ROUTER}]
+    assert netplan.batches == [['route replace 10.1.0.0/24 via 10.0.0.253 dev eth0 proto static',
+                                'route replace 10.2.0.0/24 via 10.0.0.253 dev eth0 proto static']]
+    assert ['netplan', 'apply'] not in netplan.calls
+    assert ['netplan', 'generate'] in netplan.calls
+
+    # nothing to do
+    netplan.calls.clear()
+    assert import_subnets.updateNetplan(_subnets('10.1.0.0/24', '10.2.0.0/24'), '10.0.0.254', ROUTER) == 'unchanged'
+    assert netplan.calls == [] and len(netplan.batches) == 1
+
+    # a subnet is removed, the default gateway moves
+    assert import_subnets.updateNetplan(_subnets('10.2.0.0/24'), '10.0.0.252', ROUTER) == 'changed'
+    assert netplan.batches[-1] == ['route replace default via 10.0.0.252 dev eth0 proto static',
+                                   'route del 10.1.0.0/24 via 10.0.0.253 dev eth0']
+    assert netplan.routes == {'default': ('10.0.0.252', 'static'), '10.2.0.0/24': (ROUTER, 'static')}
+
+
+def test_netplan_repairs_kernel_routes(netplan):
+    import_subnets.updateNetplan(_subnets('10.1.0.0/24'), '10.0.0.254', ROUTER)
+    # a route was removed by hand, another one added by networkd earlier
+    del netplan.routes['10.1.0.0/24']
+    netplan.addRoute('10.9.0.0/24', ROUTER)
+    netplan.addRoute('10.8.0.0/24', ROUTER, 'dhcp')
+
+    assert import_subnets.updateNetplan(_subnets('10.1.0.0/24'), '10.0.0.254', ROUTER) == 'changed'
+    assert netplan.batches[-1] == ['route replace 10.1.0.0/24 via 10.0.0.253 dev eth0 proto static',
+                                   'route del 10.9.0.0/24 via 10.0.0.253 dev eth0']
+    assert '10.8.0.0/24' in netplan.routes
+
+
+def test_netplan_apply_fallback(netplan, monkeypatch):
+    netplan.fail = True
+    assert import_subnets.updateNetplan(_subnets('10.1.0.0/24'), '10.0.0.254', ROUTER) == 'changed'
+    assert netplan.calls[-1] == ['netplan', 'apply']
+
+    # a failed netplan apply restores the backup
+    netplan.calls.clear()
+    monkeypatch.setattr(import_subnets.subprocess, 'call',
+                        lambda cmd: netplan.calls.append(cmd) or int(cmd == ['netplan', 'apply']))
+    assert import_subnets.updateNetplan(_subnets('10.2.0.0/24'), '10.0.0.254', ROUTER) is False
+    bakfile = netplan.calls[0][2]
+    assert netplan.calls[-2:] == [['cp', bakfile, str(netplan.cfgfile)], ['netplan', 'apply']]
+
+
+def test_ntp_only_restarted_on_change(tmp_path, monkeypatch):
+    from linuxmuster_base7.cli import update_ntpconf
+
+    cfgfile = tmp_path / 'ntp.conf'
+    (tmp_path / 'templates').mkdir()
+    (tmp_path / 'templates' / 'ntp.conf').write_text(
+        f'# {cfgfile}\nserver @@firewallip@@\n@@restricted_subnets@@\n')
+    monkeypatch.setattr(update_ntpconf.environment, 'TPLDIR', str(tmp_path / 'templates'))
+    monkeypatch.setattr(update_ntpconf, 'getSetupValue', lambda key: '10.0.0.254')
+    subnets = [['10.0.0.0/16'], ['10.1.0.0/24']]
+    monkeypatch.setattr(update_ntpconf, 'getSubnetArray', lambda: subnets)
+    monkeypatch.setattr(update_ntpconf, 'NTPPENDING', str(tmp_path / 'state' / 'ntp-pending'))
+    restarts = []
+    results = []
+
+    def run(cmd, check):
+        restarts.append(cmd)
+        return update_ntpconf.subprocess.CompletedProcess(cmd, results.pop(0) if results else 0)
+    monkeypatch.setattr(update_ntpconf.subprocess, 'run', run)
+
+    assert update_ntpconf.updateNtpConf() == 'changed'
+    assert cfgfile.read_text() == f'# {cfgfile}\nserver 10.0.0.254\nrestrict 10.0.0.0/16\nrestrict 10.1.0.0/24\n'
+    assert len(restarts) == 1
+    assert update_ntpconf.updateNtpConf() == 'unchanged'
+    assert len(restarts) == 1
+
+    subnets.append(['10.2.0.0/24'])
+    assert update_ntpconf.updateNtpConf() == 'changed'
+    assert len(restarts) == 2
+    assert len(list(tmp_path.glob('ntp.conf-*'))) == 1
+
+    # a failed restart is retried by the next run, although the file is unchanged
+    subnets.append(['10.3.0.0/24'])
+    results.append(1)
+    assert update_ntpconf.updateNtpConf() is False
+    assert update_ntpconf.updateNtpConf() == 'changed'
+    assert len(restarts) == 4
+    assert update_ntpconf.updateNtpConf() == 'unchanged'
+    assert len(restarts) == 4
+
+    # an unusable state directory ends the run with an error, not a traceback
+    subnets.append(['10.4.0.0/24'])
+    monkeypatch.setattr(update_ntpconf, 'NTPPENDING', str(cfgfile / 'ntp-pending'))
+    assert update_ntpconf.updateNtpConf() is False
+    with pytest.raises(SystemExit) as exit_info:
+        update_ntpconf.main()
+    assert exit_info.value.code == 1
+    assert len(restarts) == 4
+    assert '10.4.0.0/24' not in cfgfile.read_text()
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+#
+# tests for the start.conf and grub template helpers in functions.linbo
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Tests for StartConf / getStartConf() and GrubTemplate / getGrubTemplate()
+in linuxmuster_base7.functions.linbo.
+
+The getStartconf*() helpers used to re-read and re-parse start.conf on
+every call. They are now thin wrappers around a StartConf parsed once per
+file version; these tests check the values they return and that a file is
+only parsed again after it changed. Grub templates are likewise compiled
+once and rendered in a single pass.
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip('environment', reason='requires linuxmuster-common (environment.py) on sys.path')
+
+import environment  # noqa: E402  (import must follow importorskip)
+
+from linuxmuster_base7.functions import linbo  # noqa: E402
+
+
+STARTCONF = """[LINBO]
+Cache = /dev/sda3
+KernelOptions = quiet splash # comment
+
+[Partition]
+Dev = /dev/sda1
+Label = efi
+FSType = vfat
+
+[partition]
+Dev = /dev/sda2
+Label = windows
+FSType = ntfs
+
+[Partition]
+Dev = /dev/sda3
+Label = cache
+FSType = ext4
+
+[OS]
+Name = Windows 11
+BaseImage = win11.qcow2
+Root = /dev/sda2
+Kernel = auto
+Initrd =
+Append =
+
+[os]
+Name = Ubuntu
+BaseImage = ubuntu.iso
+Root = /dev/sda2 # shares the partition
+Kernel = boot/vmlinuz
+Initrd = boot/initrd.img
+Append = ro splash
+"""
+
+
+@pytest.fixture
+def startconf(tmp_path, monkeypatch):
+    monkeypatch.setattr(linbo, '_startconfs', {})
+    path = tmp_path / 'start.conf.win11'
+    path.write_text(STARTCONF)
+    return str(path)
+
+
+def test_partitions_and_os_entries(startconf):
+    conf = linbo.getStartConf(startconf)
+
+    assert [(p.nr, p.dev, p.label) for p in conf.partitions] == [
+        (1, '/dev/sda1', 'efi'), (2, '/dev/sda2', 'windows'), (3, '/dev/sda3', 'cache')]
+    assert [(o.nr, o.name, o.root) for o in conf.oslist] == [
+        ('1', 'Windows 11', '/dev/sda2'), ('2', 'Ubuntu', '/dev/sda2')]
+
+
+def test_wrappers(startconf):
+    assert linbo.getStartconfOption(startconf, 'LINBO', 'Cache') == '/dev/sda3'
+    assert linbo.getStartconfOption(startconf, 'LINBO', 'KernelOptions') == 'quiet splash'
+    assert linbo.getStartconfOption(startconf, 'LINBO', 'Missing') is None
+    assert linbo.getStartconfPartnr(startconf, '/dev/sda3') == '3'
+    assert linbo.getStartconfPartnr(startconf, '/dev/sdb1') == 0
+    assert linbo.getStartconfPartlabel(startconf, '2') == 'windows'
+    assert linbo.getStartconfPartlabel(startconf, 0) == ''
+    assert linbo.getStartconfOsValues(startconf) == [
+        ['Windows 11', 'win11.qcow2', '/dev/sda2', 'auto', '', '', '1'],
+        ['Ubuntu', 'ubuntu.iso', '/dev/sda2', 'boot/vmlinuz', 'boot/initrd.img', 'ro splash', '2']]
+
+
+def test_partition_without_label(tmp_path, monkeypatch):
+    monkeypatch.setattr(linbo, '_startconfs', {})
+    path = tmp_path / 'start.conf.nolabel'
+    path.write_text(STARTCONF.replace('Label = windows\n', ''))
+
+    # by section: the labels of the following partitions do not shift
+    assert linbo.getStartconfPartlabel(str(path), 2) == ''
+    assert linbo.getStartconfPartlabel(str(path), 3) == 'cache'
+    assert linbo.getStartconfPartnr(str(path), '/dev/sda3') == '3'
+
+
+def test_missing_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(linbo, '_startconfs', {})
+    missing = str(tmp_path / 'start.conf.none')
+
+    assert linbo.getStartconfOption(missing, 'LINBO', 'Cache') is None
+    assert linbo.getStartconfOsValues(missing) is None
+    assert linbo.getStartconfPartnr(missing, '/dev/sda1') == 0
+    assert linbo.getStartconfPartlabel(missing, 1) == ''
+
+
+def test_parsed_once_until_changed(startconf, monkeypatch):
+    reads = []
+    read = linbo.readStartconf
+    monkeypatch.setattr(linbo, 'readStartconf', lambda path: reads.append(path) or read(path))
+
+    for nr in range(1, 4):
+        linbo.getStartconfPartlabel(startconf, linbo.getStartconfPartnr(startconf, '/dev/sda' + str(nr)))
+        linbo.getStartconfOption(startconf, 'LINBO', 'Cache')
+    linbo.getStartconfOsValues(startconf)
+    assert len(reads) == 1
+
+    linbo.setGlobalStartconfOption(startconf, 'KernelOptions', 'nomodeset')
+    st = os.stat(startconf)
+    os.utime(startconf, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert linbo.getStartconfOption(startconf, 'LINBO', 'KernelOptions') == 'nomodeset'
+    assert len(reads) == 2
+
+
+def test_grub_template_render():
+    template = linbo.GrubTemplate('menuentry "@@osname@@" { linux @@kernel@@ @@kopts@@ @@unknown@@ }\n')
+
+    assert template.variables == {'osname', 'kernel', 'kopts', 'unknown'}
+    # single pass: a value containing a placeholder is not substituted again
+    assert template.render({'osname': '@@kernel@@', 'kernel': 'vmlinuz', 'kopts': None}) == \
+        'menuentry "@@kernel@@" { linux vmlinuz  @@unknown@@ }\n'
+
+
+
+def test_grub_template_none_renders_empty():
+    # e.g. a start.conf without cache partition: getGrubPart() returns None.
+    # The former chained str.replace() rendered None as 'None' in os
+    # entries and failed with TypeError in the global section.
+    template = linbo.GrubTemplate('set cacheroot=@@cacheroot@@\nset root="@@osroot@@"\n')
+
+    assert template.render({'cacheroot': None, 'osroot': None}) == 'set cacheroot=\nset root=""\n'
+    assert template.render({'cacheroot': 0, 'osroot': '(hd0,2)'}) == 'set cacheroot=0\nset root="(hd0,2)"\n'
+
+def test_grub_template_cached_until_changed(tmp_path, monkeypatch):
+    monkeypatch.setattr(environment, 'LINBOTPLDIR', str(tmp_path))
+    monkeypatch.setattr(linbo, '_grubtemplates', {})
+    path = tmp_path / 'grub.cfg.global'
+    path.write_text('set group=@@group@@\n')
+
+    first = linbo.getGrubTemplate('grub.cfg.global')
+    assert linbo.getGrubTemplate('grub.cfg.global') is first
+    assert first.render({'group': 'win11'}) == 'set group=win11\n'
+    assert linbo.getGrubTemplate('grub.cfg.missing') is None
+
+    path.write_text('set group="@@group@@"\n')
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert linbo.getGrubTemplate('grub.cfg.global').render({'group': 'win11'}) == 'set group="win11"\n'
@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+#
+# tests for the OMAPI client
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Tests for linuxmuster_base7.functions.omapi against the stand-in server
+in fake_omapi.py.
+"""
+
+import base64
+
+import pytest
+
+pytest.importorskip('environment', reason='requires linuxmuster-common (environment.py) on sys.path')
+
+from linuxmuster_base7.functions.omapi import OmapiClient, OmapiError  # noqa: E402
+
+from fake_omapi import FakeOmapiServer  # noqa: E402
+
+
+SECRET = base64.b64encode(b'0123456789abcdef').decode()
+
+
+@pytest.fixture
+def server():
+    with FakeOmapiServer('omapi_key', SECRET) as server:
+        yield server
+
+
+def test_add_lookup_delete_host(server):
+    with OmapiClient('127.0.0.1', server.port, 'omapi_key', SECRET) as omapi:
+        omapi.addHost('pc01', '00:11:22:33:44:01', '10.0.0.1', 'option host-name "pc01";')
+        omapi.addHost('pc02', '00:11:22:33:44:02')
+        assert omapi.lookupHost('00:11:22:33:44:01') is not None
+        assert omapi.lookupHost('00:11:22:33:44:09') is None
+
+        omapi.deleteHost('00:11:22:33:44:01')
+
+    assert server.hosts == {'00:11:22:33:44:02': {'name': 'pc02', 'ip': None, 'statements': ''}}
+
+
+def test_errors_are_raised(server):
+    with OmapiClient('127.0.0.1', server.port, 'omapi_key', SECRET) as omapi:
+        omapi.addHost('pc01', '00:11:22:33:44:01', '10.0.0.1')
+        with pytest.raises(OmapiError, match='already exists'):
+            omapi.addHost('pc01', '00:11:22:33:44:01', '10.0.0.1')
+        with pytest.raises(OmapiError, match='not found'):
+            omapi.deleteHost('00:11:22:33:44:09')
+
+
+def test_wrong_key_is_rejected(server):
+    with pytest.raises(OmapiError, match='authentication failed'):
+        OmapiClient('127.0.0.1', server.port, 'other_key', SECRET).connect()
+    other = base64.b64encode(b'fedcba9876543210').decode()
+    with OmapiClient('127.0.0.1', server.port, 'omapi_key', other) as omapi:
+        with pytest.raises(OmapiError, match='adding host pc01 failed'):
+            omapi.addHost('pc01', '00:11:22:33:44:01')
+    assert server.hosts == {}
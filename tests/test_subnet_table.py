@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+#
+# tests for the compiled subnets.csv lookup table in functions.network
+# thomas@linuxmuster.net
+# 20261017
+#
+"""
+Tests for SubnetTable / getSubnetTable() in linuxmuster_base7.functions.network.
+
+ipMatchSubnet(ip, 'all'), getIpSubnet() and getIpBcAddress() used to
+re-read subnets.csv and test every network linearly per call. They now
+bisect a cached table of integer ranges; these tests pin down that the
+answers, including nested networks and invalid rows, are unchanged.
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip('environment', reason='requires linuxmuster-common (environment.py) on sys.path')
+
+import environment  # noqa: E402  (import must follow importorskip)
+
+from linuxmuster_base7.functions import network  # noqa: E402
+
+
+SUBNETS = (
+    '# network;router;range1;range2;nameserver;nextserver;setup\n'
+    '10.0.0.0/16;10.0.0.254;;;;;SETUP\n'
+    '10.0.100.0/24;10.0.100.254;;;;;\n'
+    '10.1.0.0/24;10.9.9.9;;;;;\n'
+    'garbage;10.2.0.254;;;;;\n'
+    '10.2.0.0/24;10.2.0.254;;;;;\n'
+    '\n'
+)
+
+
+@pytest.fixture
+def subnets_csv(tmp_path, monkeypatch):
+    path = tmp_path / 'subnets.csv'
+    path.write_text(SUBNETS)
+    monkeypatch.setattr(environment, 'SUBNETSCSV', str(path))
+    monkeypatch.setattr(network, '_subnet_table', None)
+    return path
+
+
+def test_invalid_rows_are_skipped(subnets_csv):
+    assert network.getSubnetArray('0') == [['10.0.0.0/16'], ['10.0.100.0/24'], ['10.2.0.0/24']]
+
+
+def test_first_matching_subnet_in_file_order(subnets_csv):
+    # 10.0.100.0/24 is nested in 10.0.0.0/16, which comes first in the file
+    assert network.getIpSubnet('10.0.100.7') == '10.0.0.0/16'
+    assert network.getIpSubnet('10.2.0.7') == '10.2.0.0/24'
+    assert network.getIpSubnet('10.1.0.7') is None
+    assert network.getIpBcAddress('10.2.0.7') == '10.2.0.255'
+
+
+def test_matchAll_returns_enclosing_networks(subnets_csv):
+    table = network.getSubnetTable()
+
+    assert [row[0] for row in table.matchAll('10.0.100.7')] == ['10.0.0.0/16', '10.0.100.0/24']
+    assert [row[0] for row in table.matchAll('10.0.200.7')] == ['10.0.0.0/16']
+    assert table.matchAll('192.168.0.1') == []
+
+
+def test_ipMatchSubnet(subnets_csv):
+    assert network.ipMatchSubnet('DHCP', 'all')
+    assert not network.ipMatchSubnet('DHCP', '10.0.0.0/16')
+    assert network.ipMatchSubnet('10.2.0.1', 'all')
+    assert not network.ipMatchSubnet('10.1.0.1', 'all')
+    assert network.ipMatchSubnet('10.1.0.1', '10.1.0.0/24')
+    assert not network.ipMatchSubnet('not-an-ip', 'all')
+
+
+def test_table_is_reloaded_when_file_changes(subnets_csv):
+    first = network.getSubnetTable()
+    assert network.getSubnetTable() is first
+
+    subnets_csv.write_text(SUBNETS + '10.1.0.0/24;10.1.0.254;;;;;\n')
+    st = os.stat(subnets_csv)
+    os.utime(subnets_csv, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    assert network.getSubnetTable() is not first
+    assert network.getIpSubnet('10.1.0.7') == '10.1.0.0/24'